@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+'''
+替代 mcp-server-fetch 的离线 fetch MCP 服务器，工具名和参数与原服务器相同。
+所有URL的主机都被替换为 BENCH_FETCH_TARGET（见 Bench/fetch_target.py），路径保持不变，
+因此搜索结果中的任意URL都能在本地取到确定的内容。
+'''
+from pathlib import Path
+from urllib.parse import urlsplit
+import os
+import sys
+
+import httpx
+from fastmcp import FastMCP
+
+sys.path.append(str(Path(__file__).parent.parent))
+from RAG.scraper import extract_text
+from tracing import span
+
+FETCH_TARGET = os.getenv("BENCH_FETCH_TARGET", "http://127.0.0.1:8767")
+
+mcp = FastMCP("fetch")
+_client = None
+
+
+def local_url(url):
+    parts = urlsplit(url)
+    return f"{FETCH_TARGET}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+
+@mcp.tool()
+async def fetch(url: str, max_length: int = 5000, start_index: int = 0, raw: bool = False) -> str:
+    '''
+    Fetches a URL from the internet and extracts its contents as text.
+
+    params:
+        url: str, URL to fetch
+        max_length: int, maximum number of characters to return
+        start_index: int, start the output at this character index
+        raw: bool, return the raw HTML instead of extracted text
+    '''
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=httpx.Timeout(10.0))
+    with span('fetch.page') as s:
+        try:
+            response = await _client.get(local_url(url))
+        except httpx.HTTPError as e:
+            return f"Failed to fetch {url}: {type(e).__name__}"
+        s.set('payload.response_bytes', len(response.content))
+        text = response.text if raw else extract_text(response.text)
+    return f"Contents of {url}:\n{text[start_index:start_index + max_length]}"
+
+
+if __name__ == '__main__':
+    mcp.run(transport="stdio")
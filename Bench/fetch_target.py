@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+'''
+本地网页目标：任意路径都返回由路径确定的HTML页面，带 ETag，支持条件请求（304）。
+用于离线测试网页抓取（RAG/scraper.py）和 fetch 工具（Bench/fetch_server.py）。
+
+用法:
+    python Bench/fetch_target.py --port 8767 --paragraphs 20
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import threading
+import time
+
+WORDS = ('data', 'model', 'search', 'index', 'vector', 'agent', 'query', 'network', 'policy', 'energy',
+         'finance', 'health', 'climate', 'history', 'science', 'music', 'travel', 'robot', 'market', 'city')
+
+
+def page_html(path, paragraphs=20):
+    '''按路径生成确定的HTML页面。'''
+    seed = int(hashlib.md5(path.encode('utf-8')).hexdigest(), 16)
+    title = f"Page {path.strip('/') or 'index'}"
+    body = []
+    for p in range(paragraphs):
+        words = [WORDS[(seed >> ((i + p) % 64)) % len(WORDS)] for i in range(60)]
+        body.append(f"<p>{' '.join(words)}.</p>")
+    return (f"<html><head><title>{title}</title><style>p {{margin: 0}}</style>"
+            f"<script>var page = '{path}';</script></head>"
+            f"<body><nav>home | about</nav><h1>{title}</h1>{''.join(body)}</body></html>")
+
+
+class FetchTargetHandler(BaseHTTPRequestHandler):
+    # 由 start_target 设置
+    latency = 0.0
+    paragraphs = 20
+    counts = None
+    lock = threading.Lock()
+
+    def do_GET(self):
+        etag = f'"{hashlib.md5(self.path.encode("utf-8")).hexdigest()[:12]}"'
+        with self.lock:
+            self.counts['requests'] += 1  # type: ignore
+        if self.latency:
+            time.sleep(self.latency)
+        if self.headers.get('If-None-Match') == etag:
+            with self.lock:
+                self.counts['not_modified'] += 1  # type: ignore
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = page_html(self.path, self.paragraphs).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_target(port=0, latency_ms=0.0, paragraphs=20):
+    '''在后台线程中启动，返回 (server, base_url, counts)。'''
+    counts = {'requests': 0, 'not_modified': 0}
+    handler = type('Handler', (FetchTargetHandler,), {
+        'latency': latency_ms / 1000, 'paragraphs': paragraphs, 'counts': counts,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地网页目标")
+    parser.add_argument('--port', type=int, default=8767)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--paragraphs', type=int, default=20)
+    args = parser.parse_args()
+    server, url, _ = start_target(args.port, args.latency_ms, args.paragraphs)
+    print(f"网页目标已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
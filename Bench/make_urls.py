@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+'''
+生成合成的URL文件（"url 描述" 格式）和查询文件，用于不同规模下的基准测试。
+
+用法:
+    python Bench/make_urls.py Bench/data/urls_100k.txt 100000
+'''
+from pathlib import Path
+import argparse
+import json
+import random
+
+TOPICS = ('python', 'machine learning', 'climate change', 'space exploration', 'world history', 'cooking',
+          'personal finance', 'public health', 'renewable energy', 'music theory', 'travel guide',
+          'web development', 'databases', 'neuroscience', 'economics', 'philosophy', 'robotics', 'photography',
+          'marine biology', 'urban planning', '人工智能', '新加坡 绿色金融', '中国历史', '量子计算')
+KINDS = ('tutorial', 'course', 'news', 'blog post', 'reference', 'documentation', 'encyclopedia article',
+         'video lecture', 'research paper', 'forum thread')
+ADJECTIVES = ('free', 'beginner', 'advanced', 'official', 'interactive', 'comprehensive', 'latest', 'open')
+
+
+def url_line(i, rng):
+    topic, kind, adjective = rng.choice(TOPICS), rng.choice(KINDS), rng.choice(ADJECTIVES)
+    slug = '-'.join(topic.split()) if topic.isascii() else f"topic{TOPICS.index(topic)}"
+    return f"https://site{i % 997}.example/{slug}/{i} {adjective} {kind} about {topic} #{i}"
+
+def generate_urls(path, n, seed=0):
+    '''写入 n 行合成的URL，文件已存在且行数相同时直接返回。'''
+    path = Path(path)
+    if path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            if sum(1 for _ in f) == n:
+                return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(n):
+            f.write(url_line(i, rng) + '\n')
+    return path
+
+def make_queries(n, seed=1):
+    '''返回 n 个合成查询，措辞与URL描述相近但不完全相同。'''
+    rng = random.Random(seed)
+    return [f"where can I find a {rng.choice(ADJECTIVES)} {rng.choice(KINDS)} on {rng.choice(TOPICS)}? ({i})"
+            for i in range(n)]
+
+def write_queries(path, n, seed=1):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, query in enumerate(make_queries(n, seed)):
+            f.write(json.dumps({'id': i, 'query': query}, ensure_ascii=False) + '\n')
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="生成合成的URL文件")
+    parser.add_argument('path')
+    parser.add_argument('n', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_urls(args.path, args.n, args.seed)
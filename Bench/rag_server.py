@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+'''
+基准测试用的 ragSearch 服务器：与 Servers/RAGSearch.py 相同，但使用 Bench/stub_embedder.py 的 HashEmbedder，
+不需要下载模型。向量缓存按模型名称保存，因此必须同时设置 RAG_EMBED_CACHE_DIR 指向独立目录，
+避免哈希向量写入真实模型的缓存。设置 BENCH_REAL_MODEL=1 时使用真实模型。
+
+也可以作为 HTTP 部署的服务器模块：python Servers/serve.py Bench.rag_server --workers 4
+'''
+from pathlib import Path
+import os
+import sys
+
+sys.path.append(str(Path(__file__).parent.parent))
+if os.getenv("BENCH_REAL_MODEL", "0") != "1":
+    if "RAG_EMBED_CACHE_DIR" not in os.environ:
+        sys.exit("使用 HashEmbedder 时必须设置 RAG_EMBED_CACHE_DIR")
+    from Bench.stub_embedder import HashEmbedder
+    from Servers import RAGSearch
+    RAGSearch.registry.register_model(RAGSearch.MODEL_NAME, HashEmbedder())
+else:
+    from Servers import RAGSearch
+
+# serve.py 使用的接口
+mcp = RAGSearch.mcp
+preload = RAGSearch.preload
+warmup = RAGSearch.warmup
+reload_index = RAGSearch.reload_index
+
+
+if __name__ == '__main__':
+    preload()
+    mcp.run(transport="stdio")
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+'''
+离线基准测试：不需要API密钥、网络和模型下载，衡量各阶段的延迟、吞吐量和内存，
+用于发现检索器构建、搜索、工具调用和完整查询流程中的性能回退。
+
+三部分:
+    retriever: 对 1k / 100k / 1M 条合成URL（Bench/make_urls.py），每种规模在独立子进程中测量
+               索引构建、从磁盘加载、单条搜索 p50/p95、批量搜索吞吐量以及进程内存。
+    tools:     Brave 客户端对模拟接口（Servers/MockBrave.py）的并发搜索，以及网页抓取（RAG/scraper.py）
+               对本地网页目标（Bench/fetch_target.py）的首次抓取和条件请求。
+    e2e:       启动模拟的 OpenAI 接口（Bench/stub_openai.py）、模拟 Brave 接口和本地网页目标，
+               在临时工作目录中生成 mcp_agent 配置（fetch / webSearch / ragSearch 都指向本地服务），
+               用 batch.py 执行完整的 main.py 流程，并按 tracing.py 的 span 汇总各阶段耗时。
+
+默认使用 Bench/stub_embedder.py 的哈希编码器代替 Sentence Transformer，结果不受模型推理速度影响；
+--real-model 使用真实模型（需要已下载）。
+
+用法:
+    python Bench/run.py                                  # 全部，检索器规模 1k 和 100k
+    python Bench/run.py retriever --sizes 1000 100000 1000000
+    python Bench/run.py e2e --queries 50 --concurrency 8 --llm-latency-ms 50
+    python Bench/run.py --json bench.json                # 同时把结果写入JSON文件，便于比较
+'''
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+from Bench.make_urls import generate_urls, make_queries, write_queries
+from RAG.perf import memory_usage_mb, peak_rss_mb
+from tracing import percentile
+
+SECTIONS = ('retriever', 'tools', 'e2e')
+DEFAULT_SIZES = (1000, 100000)
+# 基准测试使用的模型名称，哈希编码器的向量缓存和索引不会与真实模型混用
+HASH_MODEL_NAME = 'bench-hash-384'
+
+
+def latency_stats(seconds):
+    values = sorted(s * 1000 for s in seconds)
+    return {
+        'p50_ms': percentile(values, 0.5),
+        'p95_ms': percentile(values, 0.95),
+        'mean_ms': sum(values) / len(values) if values else 0.0,
+    }
+
+
+# --- 检索器 ---
+
+def retriever_worker(size, workdir, n_queries, real_model, storage):
+    '''在子进程中运行：测量一个规模的检索器，最后一行输出JSON。'''
+    os.environ['RAG_EMBED_CACHE_DIR'] = str(Path(workdir) / 'emb_cache')
+    from RAG.retriever import MODEL_NAME, UrlRetriever, index_file_for
+
+    urls_file = generate_urls(Path(workdir) / f"urls_{size}.txt", size)
+    index_path = index_file_for(urls_file)
+    if real_model:
+        model_name, model = MODEL_NAME, None
+    else:
+        from Bench.stub_embedder import HashEmbedder
+        model_name, model = HASH_MODEL_NAME, HashEmbedder()
+    result = {'size': size, 'rss_before_mb': memory_usage_mb()['rss']}
+
+    retriever = UrlRetriever(model_name, model=model, index_path=index_path, storage=storage)
+    model = retriever.model
+    start = time.perf_counter()
+    retriever.load(urls_file, force_rebuild=True)
+    result['build_s'] = time.perf_counter() - start
+    result['index_type'] = retriever.active_index_type
+    del retriever
+
+    # 清单与URL文件一致时直接从磁盘打开，相当于服务重启后的加载时间
+    start = time.perf_counter()
+    retriever = UrlRetriever(model_name, model=model, index_path=index_path, storage=storage)
+    retriever.load(urls_file)
+    result['load_s'] = time.perf_counter() - start
+
+    queries = make_queries(n_queries)
+    retriever.search(queries[0], 3)
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        retriever.search(query, 3)
+        timings.append(time.perf_counter() - start)
+    result['search'] = latency_stats(timings)
+
+    # 批量搜索的查询不与单条搜索重复，避免全部命中查询向量缓存
+    batch_queries = make_queries(n_queries, seed=2)
+    start = time.perf_counter()
+    for i in range(0, len(batch_queries), 32):
+        retriever.search_batch(batch_queries[i:i + 32], 3)
+    result['batch_qps'] = len(batch_queries) / (time.perf_counter() - start)
+    result['rss_mb'] = memory_usage_mb()['rss']
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+def bench_retriever(sizes, workdir, n_queries=200, real_model=False, storage='memory'):
+    results = []
+    print(f"{'规模':>10}{'索引':>10}{'构建 s':>10}{'加载 s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'批量 q/s':>10}{'RSS MB':>10}{'峰值 MB':>10}")
+    for size in sizes:
+        command = [sys.executable, __file__, '_retriever_worker', '--size', str(size), '--workdir', str(workdir),
+                   '--queries', str(n_queries), '--storage', storage] + (['--real-model'] if real_model else [])
+        process = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+        if process.returncode != 0:
+            print(f"{size:>10} 失败:\n{process.stderr[-2000:]}")
+            results.append({'size': size, 'error': process.stderr[-2000:]})
+            continue
+        r = json.loads(process.stdout.strip().splitlines()[-1])
+        results.append(r)
+        print(f"{size:>10}{r['index_type']:>10}{r['build_s']:>10.2f}{r['load_s']:>10.3f}"
+              f"{r['search']['p50_ms']:>10.2f}{r['search']['p95_ms']:>10.2f}{r['batch_qps']:>10.0f}"
+              f"{r['rss_mb'] or 0:>10.0f}{r['peak_rss_mb'] or 0:>10.0f}")
+    return results
+
+
+# --- 工具调用 ---
+
+def bench_tools(workdir, n_queries=200, concurrency=16, n_pages=100, upstream_latency_ms=20):
+    from Bench.fetch_target import start_target
+    from RAG.scraper import scrape_urls
+    from Servers.brave_client import BraveClient, TTLCache
+    from Servers.MockBrave import start_mock
+    from Servers.rate_limit import QuotaStore, UpstreamGovernor
+
+    results = {}
+    server, url, counts = start_mock(latency_ms=upstream_latency_ms)
+    client = BraveClient("bench-key", url, cache=TTLCache(), governor=UpstreamGovernor(
+        rate=10000, burst=concurrency, max_concurrency=concurrency, quota=QuotaStore(path=None, limit=10**9)))
+    queries = make_queries(n_queries)
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+
+        async def one(query):
+            async with semaphore:
+                start = time.perf_counter()
+                await client.search(query)
+                timings.append(time.perf_counter() - start)
+
+        rounds = {}
+        # 第一轮全部请求上游，第二轮全部命中缓存
+        for name in ('cold', 'cached'):
+            timings.clear()
+            start = time.perf_counter()
+            await asyncio.gather(*(one(q) for q in queries))
+            rounds[name] = {'qps': len(queries) / (time.perf_counter() - start), **latency_stats(timings)}
+        await client.aclose()
+        return rounds
+
+    try:
+        results['brave'] = {**asyncio.run(run()), 'upstream_requests': counts['requests']}
+    finally:
+        server.shutdown()
+    for name, r in results['brave'].items():
+        if isinstance(r, dict):
+            print(f"brave {name:<8} {r['qps']:>8.0f} q/s  p50 {r['p50_ms']:.2f} ms  p95 {r['p95_ms']:.2f} ms")
+
+    server, base_url, counts = start_target(latency_ms=upstream_latency_ms)
+    urls = [f"{base_url}/page/{i}" for i in range(n_pages)]
+    cache_path = Path(workdir) / 'bench_scrape.sqlite'
+    if cache_path.exists():
+        cache_path.unlink()
+    results['scrape'] = {}
+    try:
+        # 第一轮下载全部页面；第二轮视为过期，走条件请求得到304；第三轮缓存未过期，不发请求
+        for name, max_age in (('cold', 0), ('revalidate', 0), ('fresh', 3600)):
+            start = time.perf_counter()
+            pages = scrape_urls(urls, cache_path, max_age=max_age)
+            elapsed = time.perf_counter() - start
+            results['scrape'][name] = {'pages_per_s': len(urls) / elapsed, 'seconds': elapsed,
+                                       'texts': sum(1 for t in pages.values() if t)}
+            print(f"scrape {name:<10} {len(urls) / elapsed:>8.0f} 页/s  {elapsed:.2f}s")
+        results['scrape']['not_modified'] = counts['not_modified']
+    finally:
+        server.shutdown()
+    return results
+
+
+# --- 端到端 ---
+
+def write_e2e_config(workdir, openai_url, brave_url, fetch_target, urls_file, trace_file, real_model):
+    '''在工作目录中生成 mcp_agent.config.yaml 和 mcp_agent.secrets.yaml，所有服务都指向本地。'''
+    python = sys.executable
+    common_env = {'TRACE_FILE': str(trace_file)}
+    servers = {
+        'fetch': {'command': python, 'args': [str(ROOT / 'Bench' / 'fetch_server.py')],
+                  'env': {**common_env, 'BENCH_FETCH_TARGET': fetch_target}},
+        'webSearch': {'command': python, 'args': [str(ROOT / 'Servers' / 'BraveSearch.py')],
+                      'env': {**common_env, 'BRAVE_API_URL': brave_url, 'BRAVE_API_KEY': 'bench-key',
+                              'BRAVE_RATE': '10000', 'BRAVE_BURST': '100', 'BRAVE_CACHE_FILE': '',
+                              'BRAVE_QUOTA_FILE': ''}},
+        'ragSearch': {'command': python, 'args': [str(ROOT / 'Bench' / 'rag_server.py')],
+                      'env': {**common_env, 'RAG_URLS_FILE': str(urls_file),
+                              'RAG_EMBED_CACHE_DIR': str(Path(workdir) / 'emb_cache'),
+                              'BENCH_REAL_MODEL': '1' if real_model else '0'}},
+    }
+    # JSON 是合法的 YAML，不需要额外依赖
+    config = {
+        'execution_engine': 'asyncio',
+        'logger': {'type': 'file', 'level': 'warning', 'transports': ['file'],
+                   'path': str(Path(workdir) / 'mcp-agent.log'), 'progress_display': False},
+        'mcp': {'servers': servers},
+        'openai': {'base_url': openai_url, 'default_model': 'stub'},
+    }
+    with open(Path(workdir) / 'mcp_agent.config.yaml', 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    with open(Path(workdir) / 'mcp_agent.secrets.yaml', 'w', encoding='utf-8') as f:
+        json.dump({'openai': {'api_key': 'bench-key'}}, f)
+
+def bench_e2e(workdir, n_queries=20, concurrency=4, n_urls=1000, llm_latency_ms=0, upstream_latency_ms=20,
+              real_model=False):
+    from Bench.fetch_target import start_target
+    from Bench.stub_openai import start_stub
+    from Servers.MockBrave import start_mock
+    import tracing
+
+    workdir = Path(workdir) / 'e2e'
+    workdir.mkdir(parents=True, exist_ok=True)
+    urls_file = generate_urls(workdir / 'urls.txt', n_urls)
+    queries_file = write_queries(workdir / 'queries.jsonl', n_queries)
+    output_file = workdir / 'results.jsonl'
+    trace_file = workdir / 'trace.jsonl'
+    for path in (output_file, trace_file, workdir / 'fetch_cache.sqlite'):
+        if path.exists():
+            path.unlink()
+
+    servers = [start_stub(latency_ms=llm_latency_ms), start_mock(latency_ms=upstream_latency_ms),
+               start_target(latency_ms=upstream_latency_ms)]
+    (_, openai_url, llm_counts), (_, brave_url, _), (_, fetch_target, fetch_counts) = servers
+    write_e2e_config(workdir, openai_url, brave_url, fetch_target, urls_file, trace_file, real_model)
+    # 合成查询各不相同，关闭答案缓存，测量的是完整流程
+    env = {**os.environ, 'TRACE_FILE': str(trace_file), 'ANSWER_CACHE': '0',
+           'FETCH_CACHE_FILE': str(workdir / 'fetch_cache.sqlite')}
+    try:
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, str(ROOT / 'batch.py'), str(queries_file), str(output_file),
+                                  '--concurrency', str(concurrency)], cwd=workdir, env=env,
+                                 capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        for server, _, _ in servers:
+            server.shutdown()
+    if process.returncode != 0:
+        print(f"batch.py 失败:\n{process.stderr[-4000:]}")
+        return {'error': process.stderr[-4000:]}
+
+    with open(output_file, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    ok = [r for r in records if 'error' not in r]
+    result = {
+        'queries': len(records),
+        'failed': len(records) - len(ok),
+        # 包含启动MCP服务器和预热知识库的时间
+        'wall_s': elapsed,
+        'queries_per_minute': len(ok) / elapsed * 60 if elapsed else 0.0,
+        'latency': latency_stats([r['seconds'] for r in ok]),
+        # 子进程（batch.py 及其启动的MCP服务器）中最大的峰值内存
+        'children_peak_rss_mb': peak_rss_mb(children=True),
+        'llm_requests': llm_counts['requests'],
+        'fetch_requests': fetch_counts['requests'],
+    }
+    print(f"端到端: {result['queries']} 个查询，失败 {result['failed']} 个，{elapsed:.1f}s，"
+          f"{result['queries_per_minute']:.1f} 个查询/分钟，p50 {result['latency']['p50_ms']:.0f} ms，"
+          f"p95 {result['latency']['p95_ms']:.0f} ms，子进程峰值内存 {result['children_peak_rss_mb'] or 0:.0f} MB")
+    if trace_file.exists():
+        result['stages'] = tracing.report(trace_file)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument('sections', nargs='*', default=list(SECTIONS),
+                        help=f"要运行的部分，可选 {', '.join(SECTIONS)}，默认全部")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="检索器测试的URL数量")
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--queries', type=int, default=None, help="查询数量")
+    parser.add_argument('--concurrency', type=int, default=4, help="端到端测试的并发查询数")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help="模拟 LLM 每次调用的延迟")
+    parser.add_argument('--upstream-latency-ms', type=float, default=20.0, help="模拟 Brave 和网页的响应延迟")
+    parser.add_argument('--storage', default='memory', choices=('memory', 'mmap'))
+    parser.add_argument('--real-model', action='store_true', help="使用真实的 Sentence Transformer 模型")
+    parser.add_argument('--workdir', default=None, help="数据和索引目录，默认使用临时目录")
+    parser.add_argument('--json', default=None, help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    if args.sections == ['_retriever_worker']:
+        retriever_worker(args.size, args.workdir, args.queries or 200, args.real_model, args.storage)
+        return
+    unknown = set(args.sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"未知的部分: {', '.join(sorted(unknown))}")
+
+    temp = None
+    if args.workdir is None:
+        temp = tempfile.TemporaryDirectory(prefix='rag-bench-')
+        args.workdir = temp.name
+    results = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0]}
+    try:
+        if 'retriever' in args.sections:
+            print("== 检索器 ==")
+            results['retriever'] = bench_retriever(args.sizes, args.workdir, args.queries or 200,
+                                                   args.real_model, args.storage)
+        if 'tools' in args.sections:
+            print("== 工具调用 ==")
+            results['tools'] = bench_tools(args.workdir, args.queries or 200,
+                                           upstream_latency_ms=args.upstream_latency_ms)
+        if 'e2e' in args.sections:
+            print("== 端到端 ==")
+            results['e2e'] = bench_e2e(args.workdir, args.queries or 20, args.concurrency,
+                                       llm_latency_ms=args.llm_latency_ms,
+                                       upstream_latency_ms=args.upstream_latency_ms, real_model=args.real_model)
+    finally:
+        if temp is not None:
+            temp.cleanup()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+'''
+不需要下载模型的确定性文本编码器，接口与 SentenceTransformer.encode 相同。
+每个词（以及中日韩文本的每个字）哈希到一个维度，得到归一化的词袋向量；
+词相同的文本向量相近，足以让基准测试中的检索结果有意义，同时不受模型推理速度影响。
+'''
+import hashlib
+import re
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'[\w]+|[^\s\w]', re.UNICODE)
+
+
+class HashEmbedder:
+    def __init__(self, dim=384):
+        self.dim = dim
+        self._cache = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _bucket(self, token):
+        bucket = self._cache.get(token)
+        if bucket is None:
+            h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            bucket = (h % self.dim, 1.0 if (h >> 32) & 1 else -1.0)
+            self._cache[token] = bucket
+        return bucket
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(texts), self.dim), dtype='float32')
+        for row, text in enumerate(texts):
+            for token in TOKEN_PATTERN.findall(text.lower()):
+                # 非ASCII的词（中文等没有空格分词）按单字计入
+                for t in (token if not token.isascii() else [token]):
+                    col, sign = self._bucket(t)
+                    vectors[row, col] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        return vectors[0] if single else vectors
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+'''
+确定性的 OpenAI 兼容接口（/v1/chat/completions），用于离线运行完整工作流。
+
+行为:
+    请求带有工具且最后一条消息不是工具结果时，按工具的参数调用工具：
+        有 url 参数的工具（fetch）对消息中的每个URL各调用一次；有 query 参数的工具用【】中的查询调用一次。
+    否则把本轮的工具结果（没有时为用户消息）截断拼接为回复。
+    usage 按字符数估算，延迟可通过 latency_ms 设置。
+
+用法:
+    python Bench/stub_openai.py --port 8766 --latency-ms 20
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+
+# 优先调用的工具（mcp-agent 会在工具名前加上服务器名）
+PREFERRED_TOOLS = ('search_in_RAG', 'brave_search', 'fetch')
+MAX_FETCH = 5
+URL_PATTERN = re.compile(r'https?://[^\s"\'<>\]\)，,]+')
+
+
+def _text(message):
+    content = message.get('content') or ''
+    if isinstance(content, list):
+        content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content
+
+def _pick_tool(tools):
+    functions = [tool['function'] for tool in tools if tool.get('type') == 'function']
+    for preferred in PREFERRED_TOOLS:
+        for function in functions:
+            if function['name'].endswith(preferred):
+                return function
+    for function in functions:
+        properties = (function.get('parameters') or {}).get('properties', {})
+        if 'query' in properties or 'url' in properties:
+            return function
+    return None
+
+def plan_tool_calls(tools, user_text, ids):
+    function = _pick_tool(tools)
+    if function is None:
+        return []
+    properties = (function.get('parameters') or {}).get('properties', {})
+    if 'url' in properties:
+        urls = list(dict.fromkeys(URL_PATTERN.findall(user_text)))[:MAX_FETCH]
+        arguments = [{'url': url} for url in urls]
+    else:
+        match = re.search(r'【(.+?)】', user_text)
+        arguments = [{'query': match.group(1) if match else user_text[:200]}]
+        if 'output' in properties:
+            arguments[0]['output'] = 'urls'
+    return [{'id': f"call_{next(ids)}", 'type': 'function',
+             'function': {'name': function['name'], 'arguments': json.dumps(arguments_, ensure_ascii=False)}}
+            for arguments_ in arguments]
+
+def compose_reply(messages):
+    last_user = max((i for i, m in enumerate(messages) if m.get('role') == 'user'), default=-1)
+    tool_outputs = [_text(m) for m in messages[last_user + 1:] if m.get('role') == 'tool']
+    if tool_outputs:
+        return '\n\n'.join(f"{i}. {' '.join(out.split())[:300]}" for i, out in enumerate(tool_outputs, start=1))
+    user_text = _text(messages[last_user]) if last_user >= 0 else ''
+    return f"总结: {' '.join(user_text.split())[:500]}"
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    # 由 start_stub 设置
+    latency = 0.0
+    counts = None
+    ids = None
+    lock = threading.Lock()
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {'error': {'message': 'not found'}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        messages = body.get('messages', [])
+        with self.lock:
+            self.counts['requests'] += 1  # type: ignore
+        if self.latency:
+            time.sleep(self.latency)
+
+        tool_calls = []
+        if body.get('tools') and messages and messages[-1].get('role') != 'tool':
+            last_user = next((m for m in reversed(messages) if m.get('role') == 'user'), {})
+            tool_calls = plan_tool_calls(body['tools'], _text(last_user), self.ids)
+        if tool_calls:
+            message = {'role': 'assistant', 'content': None, 'tool_calls': tool_calls}
+            finish_reason = 'tool_calls'
+        else:
+            message = {'role': 'assistant', 'content': compose_reply(messages)}
+            finish_reason = 'stop'
+        prompt_tokens = sum(len(_text(m)) for m in messages) // 4
+        completion_tokens = len(json.dumps(message, ensure_ascii=False)) // 4
+        with self.lock:
+            self.counts['prompt_tokens'] += prompt_tokens  # type: ignore
+            self.counts['completion_tokens'] += completion_tokens  # type: ignore
+        self._send(200, {
+            'id': f"chatcmpl-stub-{next(self.ids)}",  # type: ignore
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason, 'logprobs': None}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(port=0, latency_ms=0.0):
+    '''在后台线程中启动，返回 (server, base_url, counts)，base_url 以 /v1 结尾。'''
+    counts = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    handler = type('Handler', (StubOpenAIHandler,), {
+        'latency': latency_ms / 1000, 'counts': counts, 'ids': itertools.count(1),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1", counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OpenAI 兼容接口的确定性模拟服务")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    args = parser.parse_args()
+    server, url, _ = start_stub(args.port, args.latency_ms)
+    print(f"模拟服务已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
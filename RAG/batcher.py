@@ -0,0 +1,135 @@
+from pathlib import Path
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(str(Path(__file__).parent.parent))
+from tracing import detach, span
+
+
+# 微批处理的默认参数，可通过环境变量调整
+MAX_BATCH_SIZE = int(os.getenv("RAG_BATCH_MAX_SIZE", "32"))
+MAX_WAIT_MS = float(os.getenv("RAG_BATCH_WAIT_MS", "5"))
+MAX_QUEUE = int(os.getenv("RAG_BATCH_MAX_QUEUE", "1024"))
+
+
+class QueueFullError(RuntimeError):
+    """等待中的查询数量达到上限。"""
+
+
+class MicroBatcher:
+    """
+    查询微批处理器：把并发到达的查询合并成批。
+    收集最多 max_wait_ms 毫秒或 max_batch_size 个查询后，在工作线程中执行一次批量编码
+    和一次FAISS搜索（UrlRetriever.search_records），再把结果分发给各自等待的调用方。
+    上一批执行期间到达的查询会自动攒成下一批。
+
+    参数:
+    get_retriever (callable): 返回当前检索器的函数。每批执行时调用，因此重新加载索引后
+        新的查询会自动使用新的检索器。
+    """
+    def __init__(self, get_retriever, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, max_queue=MAX_QUEUE):
+        self.get_retriever = get_retriever
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._loop = None
+        self._queue: "asyncio.Queue | None" = None
+        self._worker = None
+        self.batches = 0
+        self.queries = 0
+        self.rejected = 0
+        self.max_batch_seen = 0
+        self.max_depth_seen = 0
+        self.wait_total = 0.0
+        self.exec_total = 0.0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue(self.max_queue)
+            self._worker = loop.create_task(self._run())
+
+    async def search(self, query, top_k=3, nprobe=None, ef_search=None):
+        """提交一个查询并等待它所在批次的结果，返回 {'url', 'description', 'score'} 记录列表。"""
+        self._ensure_worker()
+        future = self._loop.create_future()  # type: ignore
+        try:
+            self._queue.put_nowait((query, top_k, nprobe, ef_search, future, time.perf_counter()))  # type: ignore
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"检索队列已满（{self.max_queue}），请稍后重试。")
+        self.max_depth_seen = max(self.max_depth_seen, self._queue.qsize())  # type: ignore
+        return await future
+
+    async def _collect(self):
+        queue = self._queue
+        batch = [await queue.get()]  # type: ignore
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not queue.empty():  # type: ignore
+                batch.append(queue.get_nowait())  # type: ignore
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))  # type: ignore
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        # 工作任务创建时继承了第一个调用方的上下文，之后的批次不应挂在该调用方的 span 下
+        detach()
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            self.batches += 1
+            self.queries += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.wait_total += sum(started - item[5] for item in batch)
+
+            # 搜索参数不同的查询不能放进同一次FAISS搜索，按参数分组执行
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[2], item[3]), []).append(item)
+            for (nprobe, ef_search), items in groups.items():
+                top_k = max(item[1] for item in items)
+                try:
+                    with span('rag.batch', queries=len(items), top_k=top_k,
+                              queue_wait_ms=max(started - item[5] for item in items) * 1000):
+                        results = await asyncio.to_thread(
+                            self._search, [item[0] for item in items], top_k, nprobe, ef_search
+                        )
+                except Exception as e:
+                    for item in items:
+                        if not item[4].done():
+                            item[4].set_exception(e)
+                    continue
+                for item, records in zip(items, results):
+                    if not item[4].done():
+                        item[4].set_result(records[:item[1]])
+            self.exec_total += time.perf_counter() - started
+
+    def _search(self, queries, top_k, nprobe, ef_search):
+        # 批次数和查询数由 stats() 统计，热路径上不打印
+        return self.get_retriever().search_records(queries, top_k, nprobe=nprobe, ef_search=ef_search)
+
+    def stats(self):
+        """返回队列深度、批大小和等待/执行时间等统计。"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_queue_depth': self.max_depth_seen,
+            'batches': self.batches,
+            'queries': self.queries,
+            'rejected': self.rejected,
+            'avg_batch_size': self.queries / self.batches if self.batches else 0.0,
+            'max_batch_seen': self.max_batch_seen,
+            'avg_wait_ms': self.wait_total / self.queries * 1000 if self.queries else 0.0,
+            'avg_batch_exec_ms': self.exec_total / self.batches * 1000 if self.batches else 0.0,
+        }
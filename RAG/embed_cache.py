@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from pathlib import Path
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+
+import numpy as np
+
+
+# 向量缓存目录，每个模型一个子目录
+EMBED_CACHE_DIR = Path(os.getenv("RAG_EMBED_CACHE_DIR", Path(__file__).parent / 'emb_cache'))
+# 查询向量内存LRU的默认容量
+QUERY_CACHE_SIZE = 1024
+
+DIGEST_SIZE = 16
+
+
+def normalize_text(text):
+    """规范化文本：统一Unicode形式并折叠空白，不改变大小写（模型区分大小写）。"""
+    return unicodedata.normalize('NFC', ' '.join(text.split()))
+
+def text_digest(text):
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class EmbeddingCache:
+    """
+    sentence-transformer 向量的磁盘缓存，键为 (模型名, 规范化文本的哈希)。
+
+    每个模型对应一个目录：keys.bin 依次保存16字节的文本哈希，vectors.f32 保存对应行的
+    float32 向量。两个文件都只追加写入，读取时通过 np.memmap 映射，不会整体载入内存。
+    只有文档向量写入磁盘；查询向量只保存在容量有限的内存LRU中，大量不同的查询不会让缓存无限增长。
+
+    同一进程内请通过 get_embedding_cache() 共享实例。写入磁盘前需要取得目录中 writer.lock 的排他锁，
+    同一时间只有一个进程写入；其他进程（包括 fork 出的工作进程）只读取打开时已有的行，新计算的向量不落盘。
+    """
+    def __init__(self, model_name, cache_dir=EMBED_CACHE_DIR, query_cache_size=QUERY_CACHE_SIZE):
+        self.model_name = model_name
+        self.dir = Path(cache_dir) / model_name.replace('/', '__')
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.keys_path = self.dir / 'keys.bin'
+        self.vectors_path = self.dir / 'vectors.f32'
+        self.meta_path = self.dir / 'meta.json'
+        self.query_cache_size = query_cache_size
+
+        self.dim: "int | None" = None
+        self._rows = {}
+        # 磁盘上完整的行数（先写向量后写键，两者都完整的行）
+        self._n_rows = 0
+        self._vectors = None
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+        # 写锁的状态：持有写锁的进程号，以及已确认拿不到写锁的进程号
+        self._writer_file = None
+        self._writer_pid = None
+        self._denied_pid = None
+        self.hits = {'doc': 0, 'query': 0}
+        self.misses = {'doc': 0, 'query': 0}
+        self._open()
+
+    def _open(self):
+        if not self.meta_path.exists():
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            self.dim = json.load(f)['dim']
+        keys = self.keys_path.read_bytes() if self.keys_path.exists() else b''
+        row_bytes = self.dim * 4
+        vector_rows = os.path.getsize(self.vectors_path) // row_bytes if self.vectors_path.exists() else 0
+        # 先写向量后写键，中断时多出的部分由下一个取得写锁的进程截掉（见 _repair_tail）
+        n = min(len(keys) // DIGEST_SIZE, vector_rows)
+        self._rows = {keys[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i for i in range(n)}
+        self._n_rows = n
+        self._remap(n)
+
+    def _repair_tail(self):
+        """
+        截掉中断的写入在文件末尾留下的不完整部分。只在取得写锁后调用一次，追加时不再截断；
+        其他进程映射的行数不超过完整的行数，不会因截断而访问到文件末尾之外。
+        """
+        if self.dim is None:
+            return
+        for path, size in ((self.vectors_path, self._n_rows * self.dim * 4),
+                           (self.keys_path, self._n_rows * DIGEST_SIZE)):
+            if path.exists() and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _acquire_writer(self):
+        """
+        返回当前进程能否写入磁盘。第一次写入时以非阻塞方式获取 writer.lock 的排他锁，并从磁盘重新读取
+        已有的行（上次打开后其他进程可能追加过）。flock 随文件描述符被 fork 继承，因此按进程号判断，
+        fork 出的子进程需要重新获取，而父进程仍持有锁时获取失败。没有 fcntl 的平台上不加锁。
+        """
+        pid = os.getpid()
+        if self._writer_pid == pid:
+            return True
+        if self._denied_pid == pid:
+            return False
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+        f = open(self.dir / 'writer.lock', 'a+b')
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                self._denied_pid = pid
+                print(f"向量缓存 {self.dir} 正由其他进程写入，本进程新计算的向量不写入磁盘。")
+                return False
+        self._writer_file = f
+        self._writer_pid = pid
+        self._open()
+        self._repair_tail()
+        return True
+
+    def _remap(self, n):
+        if n > 0:
+            self._vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(n, self.dim))  # type: ignore
+
+    def _append(self, digests, vectors):
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+        if not self.meta_path.exists():
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'model_name': self.model_name, 'dim': self.dim}, f)
+        # 持有写锁，文件末尾就是第 _n_rows 行之后，只追加不截断
+        base = self._n_rows
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype='float32').tobytes())
+        with open(self.keys_path, 'ab') as f:
+            f.write(b''.join(digests))
+        for i, digest in enumerate(digests):
+            self._rows[digest] = base + i
+        self._n_rows = base + len(digests)
+        self._remap(self._n_rows)
+
+    def _remember_query(self, digest, vector):
+        self._queries[digest] = vector
+        self._queries.move_to_end(digest)
+        while len(self._queries) > self.query_cache_size:
+            self._queries.popitem(last=False)
+
+    def encode(self, texts, encode_fn, is_query=False):
+        """
+        返回 texts 的向量矩阵 (len(texts), dim)，只对缓存未命中的文本调用 encode_fn。
+
+        参数:
+        texts (list): 待编码的文本列表。
+        encode_fn (callable): 接收文本列表、返回向量矩阵的函数，通常是 model.encode。
+        is_query (bool): 是否为查询文本。查询会先查内存LRU，并分开统计命中率；未命中的查询只放入内存LRU，不写入磁盘。
+        """
+        kind = 'query' if is_query else 'doc'
+        digests = [text_digest(text) for text in texts]
+        out = np.empty((len(texts), self.dim or 0), dtype='float32')
+        disk_pos, disk_rows = [], []
+        missing = {}
+        with self._lock:
+            for i, digest in enumerate(digests):
+                if is_query and digest in self._queries:
+                    self._queries.move_to_end(digest)
+                    out[i] = self._queries[digest]
+                elif digest in self._rows:
+                    disk_pos.append(i)
+                    disk_rows.append(self._rows[digest])
+                else:
+                    missing.setdefault(digest, []).append(i)
+            if disk_rows:
+                # 一次花式索引从memmap中取出所有命中的行
+                out[disk_pos] = self._vectors[disk_rows]  # type: ignore
+                if is_query:
+                    for i in disk_pos:
+                        self._remember_query(digests[i], out[i].copy())
+            n_missing = sum(len(positions) for positions in missing.values())
+            self.hits[kind] += len(texts) - n_missing
+            self.misses[kind] += n_missing
+
+        if not missing:
+            return out
+
+        miss_digests = list(missing)
+        vectors = np.asarray(encode_fn([texts[missing[d][0]] for d in miss_digests]), dtype='float32')
+        if out.shape[1] != vectors.shape[1]:
+            # 缓存为空时还不知道向量维度，此时所有文本都未命中
+            out = np.empty((len(texts), vectors.shape[1]), dtype='float32')
+        with self._lock:
+            if self.dim is None:
+                # 只编码过查询的进程不会写入磁盘，也要记下维度，之后从内存LRU取出的查询向量才能放进 out
+                self.dim = int(vectors.shape[1])
+            if not is_query and self._acquire_writer():
+                new = [j for j, digest in enumerate(miss_digests) if digest not in self._rows]
+                if new:
+                    self._append([miss_digests[j] for j in new], vectors[new])
+            for digest, vector in zip(miss_digests, vectors):
+                out[missing[digest]] = vector
+                if is_query:
+                    self._remember_query(digest, vector)
+        return out
+
+    def stats(self):
+        """返回命中/未命中计数以及缓存条目数。"""
+        return {
+            'model_name': self.model_name,
+            'entries': len(self._rows),
+            'query_lru_entries': len(self._queries),
+            'doc_hits': self.hits['doc'],
+            'doc_misses': self.misses['doc'],
+            'query_hits': self.hits['query'],
+            'query_misses': self.misses['query'],
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model_name, cache_dir=EMBED_CACHE_DIR):
+    """返回进程内共享的缓存实例，同一模型和目录只打开一次。"""
+    key = (model_name, str(Path(cache_dir).resolve()))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model_name, cache_dir)
+        return _caches[key]
+
+
+# --- 离线测试 ---
+
+def test(dim=8):
+    """
+    用随机向量代替模型，验证文档向量落盘后可被新实例读取、重复的查询命中内存LRU且不写入磁盘，
+    以及空缓存目录中第一次只编码查询时的情况。
+    """
+    import tempfile
+
+    calls = []
+    def encode_fn(texts):
+        calls.append(len(texts))
+        return np.random.default_rng(len(calls)).random((len(texts), dim), dtype='float32')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 空目录中只编码查询：维度来自第一次编码的结果，第二次编码同一查询从内存LRU取出
+        cache = EmbeddingCache('test-model', tmp)
+        first = cache.encode(['q'], encode_fn, is_query=True)
+        second = cache.encode(['q', ' q '], encode_fn, is_query=True)
+        assert first.shape == (1, dim) and second.shape == (2, dim)
+        assert np.array_equal(second[0], first[0]) and np.array_equal(second[1], first[0])
+        assert calls == [1] and not cache.keys_path.exists(), calls
+        assert cache.stats()['query_hits'] == 2
+
+        docs = [f"doc {i}" for i in range(5)]
+        vectors = cache.encode(docs + ['doc  0'], encode_fn)
+        assert np.array_equal(vectors[0], vectors[5]) and calls == [1, 5], calls
+        assert cache.stats()['entries'] == 5
+        # 释放写锁后由新实例读取磁盘上的行
+        cache._writer_file.close()
+
+        reopened = EmbeddingCache('test-model', tmp)
+        assert np.array_equal(reopened.encode(docs, encode_fn), vectors[:5]) and calls == [1, 5], calls
+        assert np.array_equal(reopened.encode(['doc 3'], encode_fn, is_query=True)[0], vectors[3])
+        assert reopened.stats()['query_lru_entries'] == 1
+    print("测试通过。")
+
+if __name__ == '__main__':
+    test()
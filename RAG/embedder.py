@@ -0,0 +1,322 @@
+"""
+可选择的句向量编码后端。所有后端的 encode 接口与 SentenceTransformer.encode 相同，重量级依赖在第一次加载模型时才导入。
+
+后端（环境变量 RAG_EMBED_BACKEND）:
+    torch      sentence-transformers（PyTorch），默认
+    onnx       ONNX Runtime 运行模型仓库中的 onnx/model.onnx，不导入 torch
+    onnx-int8  同上，首次使用时用 onnxruntime.quantization 做 int8 动态量化，结果保存在 ONNX_DIR
+
+ONNX 后端需要 onnxruntime 和 tokenizers（量化还需要 onnx）。模型文件从 Hugging Face 下载，
+也可以用 RAG_ONNX_PATH 指定本地目录，目录中包含 model.onnx、tokenizer.json，以及可选的
+sentence_bert_config.json、modules.json 和 1_Pooling/config.json（与 sentence-transformers 模型仓库的布局相同）。
+
+不同后端得到的向量略有差异，向量缓存、索引清单和答案缓存都以 embedder_name 区分，切换后端时索引会重新构建。
+"""
+from pathlib import Path
+import json
+import os
+import threading
+
+import numpy as np
+
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
+# 本地 ONNX 模型目录，不设置时从 Hugging Face 下载
+ONNX_PATH = os.getenv("RAG_ONNX_PATH")
+# 量化后的模型保存目录
+ONNX_DIR = Path(os.getenv("RAG_ONNX_DIR", Path(__file__).parent / 'onnx_models'))
+# ONNX Runtime 的推理线程数，0 表示由 onnxruntime 决定
+ONNX_THREADS = int(os.getenv("RAG_ONNX_THREADS", "0"))
+# sentence_bert_config.json 缺失时的最大序列长度
+DEFAULT_MAX_SEQ_LENGTH = 128
+
+
+def embedder_name(model_name, backend=EMBED_BACKEND):
+    """
+    用于向量缓存和索引清单的名称。torch 后端沿用模型名称，已有的缓存和索引保持有效；
+    其他后端加上后缀，例如 'paraphrase-multilingual-MiniLM-L12-v2@onnx-int8'。
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的编码后端 '{backend}'，可选: {', '.join(BACKENDS)}")
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+def load_embedder(model_name, backend=EMBED_BACKEND):
+    """加载 model_name 对应的编码器。"""
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的编码后端 '{backend}'，可选: {', '.join(BACKENDS)}")
+    if backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return OnnxEmbedder(model_name, quantize=backend == 'onnx-int8')
+
+
+# --- ONNX Runtime 后端 ---
+
+def _repo_id(model_name):
+    return model_name if '/' in model_name else f"sentence-transformers/{model_name}"
+
+def _model_file(model_name, name, required=True):
+    """返回模型目录中的文件路径，不存在且 required=False 时返回None。"""
+    if ONNX_PATH:
+        path = Path(ONNX_PATH) / name
+        if path.exists():
+            return path
+        if required:
+            raise FileNotFoundError(f"{ONNX_PATH} 中缺少 {name}")
+        return None
+    from huggingface_hub import hf_hub_download
+    try:
+        return Path(hf_hub_download(_repo_id(model_name), name))
+    except Exception:
+        if required:
+            raise
+        return None
+
+def _read_json(path, default):
+    if path is None:
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def quantized_model(model_name, model_path):
+    """
+    返回 int8 动态量化后的模型路径，不存在时生成。
+    只量化权重，激活值在推理时按批动态量化，不需要校准数据。
+    """
+    out_dir = ONNX_DIR / model_name.replace('/', '__')
+    out_path = out_dir / 'model_int8.onnx'
+    if not out_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        out_dir.mkdir(parents=True, exist_ok=True)
+        print(f"正在生成 int8 量化模型: {out_path}")
+        tmp_path = out_path.with_name(out_path.name + '.tmp')
+        quantize_dynamic(str(model_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, out_path)
+    return out_path
+
+
+class OnnxEmbedder:
+    """
+    用 ONNX Runtime 和 tokenizers 复现 sentence-transformers 的编码流程：
+    分词（截断到 max_seq_length）→ Transformer → 池化（mean / cls / max）→ 可选的L2归一化。
+    进程中不导入 torch，启动时间和内存占用都明显小于 PyTorch 后端。
+
+    onnxruntime 的线程池不能跨 fork 使用，在 fork 出的子进程（serve.py 的工作进程）中第一次编码时重新创建推理会话。
+    """
+    def __init__(self, model_name, quantize=False, threads=ONNX_THREADS):
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        model_path = _model_file(model_name, 'onnx/model.onnx' if not ONNX_PATH else 'model.onnx')
+        if quantize:
+            model_path = quantized_model(model_name, model_path)
+        self.model_path = model_path
+        self.threads = threads
+        self._session_lock = threading.Lock()
+        self._open_session()
+
+        st_config = _read_json(_model_file(model_name, 'sentence_bert_config.json', required=False), {})
+        pooling = _read_json(_model_file(model_name, '1_Pooling/config.json', required=False),
+                             {'pooling_mode_mean_tokens': True})
+        modules = _read_json(_model_file(model_name, 'modules.json', required=False), [])
+        self.max_seq_length = st_config.get('max_seq_length', DEFAULT_MAX_SEQ_LENGTH)
+        if pooling.get('pooling_mode_cls_token'):
+            self.pooling = 'cls'
+        elif pooling.get('pooling_mode_max_tokens'):
+            self.pooling = 'max'
+        else:
+            self.pooling = 'mean'
+        self.normalize = any(m.get('type', '').endswith('Normalize') for m in modules)
+
+        self.tokenizer = Tokenizer.from_file(str(_model_file(model_name, 'tokenizer.json')))
+        self.tokenizer.enable_truncation(self.max_seq_length)
+        pad_token = next((t for t in ('<pad>', '[PAD]') if self.tokenizer.token_to_id(t) is not None), None)
+        if pad_token is None:
+            self.tokenizer.enable_padding()
+        else:
+            self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+        self._dim = None
+
+    def _open_session(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self.session = ort.InferenceSession(str(self.model_path), options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self._pid = os.getpid()
+
+    def _run(self, texts):
+        if self._pid != os.getpid():
+            with self._session_lock:
+                if self._pid != os.getpid():
+                    self._open_session()
+        encodings = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in encodings], dtype='int64')
+        mask = np.array([e.attention_mask for e in encodings], dtype='int64')
+        feeds = {'input_ids': ids, 'attention_mask': mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.array([e.type_ids for e in encodings], dtype='int64')
+        output = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        if output.ndim == 2:
+            # 导出时已包含池化层
+            return output
+        if self.pooling == 'cls':
+            return output[:, 0]
+        weights = mask[:, :, None].astype(output.dtype)
+        if self.pooling == 'max':
+            return np.where(weights > 0, output, -1e9).max(axis=1)
+        return (output * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, normalize_embeddings=False, **kwargs):
+        """
+        与 SentenceTransformer.encode 相同的接口，返回 float32 的 numpy 数组；传入单个字符串时返回一维向量。
+        按长度排序后分批，减少填充带来的无效计算。
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self._dim or 0), dtype='float32')
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), 0), dtype='float32')
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            pooled = self._run([texts[i] for i in batch]).astype('float32')
+            if vectors.shape[1] == 0:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype='float32')
+            vectors[batch] = pooled
+        if self.normalize or normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._dim = vectors.shape[1]
+        return vectors[0] if single else vectors
+
+    def get_sentence_embedding_dimension(self):
+        if self._dim is None:
+            self.encode(['dimension'])
+        return self._dim
+
+
+# --- 后端基准测试 ---
+
+_BACKEND_SCRIPT = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from RAG.embedder import load_embedder
+model = load_embedder({model_name!r}, {backend!r})
+loaded = time.perf_counter() - start
+import numpy as np
+from RAG.perf import memory_usage_mb
+docs = json.load(open({docs!r}, encoding='utf-8'))
+queries = json.load(open({queries!r}, encoding='utf-8'))
+start = time.perf_counter()
+model.encode(queries[:1])
+first = time.perf_counter() - start
+latencies = []
+query_vectors = []
+for query in queries:
+    start = time.perf_counter()
+    query_vectors.append(model.encode([query])[0])
+    latencies.append(time.perf_counter() - start)
+start = time.perf_counter()
+doc_vectors = model.encode(docs, batch_size=64)
+doc_seconds = time.perf_counter() - start
+np.save({out!r} + '.docs.npy', np.asarray(doc_vectors, dtype='float32'))
+np.save({out!r} + '.queries.npy', np.asarray(query_vectors, dtype='float32'))
+print(json.dumps({{'load_s': loaded, 'first_encode_s': first, 'latencies': latencies,
+                  'docs_per_second': len(docs) / doc_seconds, 'torch_imported': 'torch' in sys.modules,
+                  **memory_usage_mb()}}))
+'''
+
+def _top_k(doc_vectors, query_vectors, k):
+    """归一化后按内积精确搜索，与知识库的 flat 索引一致。"""
+    docs = doc_vectors / np.maximum(np.linalg.norm(doc_vectors, axis=1, keepdims=True), 1e-12)
+    scores = query_vectors @ docs.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def benchmark(file_path=None, model_name=None, backends=BACKENDS, n_queries=200, top_k=10):
+    """
+    在各自的子进程中加载每个后端，比较加载时间（包括导入）、RSS、单条查询编码延迟和文档编码吞吐量；
+    再以 torch 后端为基准，统计同一批查询在 flat 内积搜索下前 top_k 个结果的重合率（recall@top_k）
+    和同一文本的向量余弦相似度，检查量化后的检索结果是否稳定。
+    """
+    import subprocess
+    import sys
+    import tempfile
+
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    from RAG.retriever import MODEL_NAME, document_text, load_urls_from_file
+    from tracing import percentile
+
+    model_name = model_name or MODEL_NAME
+    lines = load_urls_from_file(file_path or Path(__file__).parent / 'urls.txt')
+    docs = [document_text(line) for line in lines]
+    rng = np.random.default_rng(0)
+    # 查询取文档描述的前几个词，模拟较短的用户查询
+    queries = [' '.join(docs[i].split()[:4]) for i in rng.integers(0, len(docs), n_queries)]
+
+    workdir = Path(tempfile.mkdtemp(prefix='rag_embedder_'))
+    with open(workdir / 'docs.json', 'w', encoding='utf-8') as f:
+        json.dump(docs, f, ensure_ascii=False)
+    with open(workdir / 'queries.json', 'w', encoding='utf-8') as f:
+        json.dump(queries, f, ensure_ascii=False)
+
+    root = str(Path(__file__).parent.parent)
+    results = {}
+    print(f"{len(docs)} 个文档，{len(queries)} 个查询，模型 {model_name}")
+    print(f"{'backend':<10}{'load s':>8}{'first ms':>10}{'p50 ms':>8}{'p95 ms':>8}{'docs/s':>9}"
+          f"{'RSS MB':>8}{'torch':>7}")
+    for backend in backends:
+        out = str(workdir / backend)
+        script = _BACKEND_SCRIPT.format(root=root, model_name=model_name, backend=backend,
+                                        docs=str(workdir / 'docs.json'), queries=str(workdir / 'queries.json'),
+                                        out=out)
+        proc = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            print(f"{backend:<10}加载失败（返回码 {proc.returncode}）")
+            continue
+        report = json.loads(proc.stdout.strip().splitlines()[-1])
+        values = sorted(s * 1000 for s in report.pop('latencies'))
+        report.update(p50_ms=percentile(values, 0.5), p95_ms=percentile(values, 0.95))
+        report['docs'] = np.load(out + '.docs.npy')
+        report['queries'] = np.load(out + '.queries.npy')
+        results[backend] = report
+        print(f"{backend:<10}{report['load_s']:>8.2f}{report['first_encode_s'] * 1000:>10.1f}"
+              f"{report['p50_ms']:>8.2f}{report['p95_ms']:>8.2f}{report['docs_per_second']:>9.0f}"
+              f"{report['rss'] or 0:>8.0f}{'yes' if report['torch_imported'] else 'no':>7}")
+
+    base = results.get('torch')
+    if base is not None:
+        k = min(top_k, len(docs))
+        truth = _top_k(base['docs'], base['queries'], k)
+        print(f"\n以 torch 为基准的 recall@{k} 和向量余弦相似度（文档的平均值 / 最小值）")
+        for backend, report in results.items():
+            if backend == 'torch':
+                continue
+            found = _top_k(report['docs'], report['queries'], k)
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(truth, found)])
+            top1 = np.mean(truth[:, 0] == found[:, 0])
+            a = base['docs'] / np.linalg.norm(base['docs'], axis=1, keepdims=True)
+            b = report['docs'] / np.linalg.norm(report['docs'], axis=1, keepdims=True)
+            cosine = (a * b).sum(axis=1)
+            report.update(recall=float(recall), top1_agreement=float(top1))
+            print(f"{backend:<10}recall@{k} {recall:.3f}  top1一致 {top1:.3f}  "
+                  f"余弦 {cosine.mean():.4f} / {cosine.min():.4f}")
+    return {backend: {k: v for k, v in report.items() if k not in ('docs', 'queries')}
+            for backend, report in results.items()}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="比较各编码后端的启动时间、内存、延迟和检索结果的一致性")
+    parser.add_argument('file', nargs='?', default=None, help="URL文件，默认 RAG/urls.txt")
+    parser.add_argument('--model', default=None)
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    args = parser.parse_args()
+    benchmark(args.file, args.model, args.backends.split(','), args.queries, args.top_k)
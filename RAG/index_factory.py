@@ -0,0 +1,158 @@
+import sys
+import time
+
+import numpy as np
+
+
+# --- 索引类型与默认参数 ---
+# flat: 精确搜索；ivf: 倒排聚类；hnsw: 图索引；ivfpq / opq: 乘积量化压缩向量
+INDEX_TYPES = ('auto', 'flat', 'ivf', 'hnsw', 'ivfpq', 'opq')
+IVF_TYPES = ('ivf', 'ivfpq', 'opq')
+# auto 模式下的规模阈值：小于 FLAT_MAX 用精确搜索，小于 IVF_MAX 用IVF，更大时用IVF-PQ压缩
+FLAT_MAX = 50_000
+IVF_MAX = 1_000_000
+# PQ每个子量化器训练256个中心，样本太少时无法训练
+PQ_MIN_TRAIN = 256 * 39
+# 训练时每个聚类中心使用的样本数上限
+TRAIN_POINTS_PER_LIST = 256
+HNSW_M = 32
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+
+def mmap_io_flags():
+    """
+    以只读内存映射方式打开索引的 faiss.read_index 标志：IVF倒排表通过 IO_FLAG_MMAP 映射，
+    Flat / HNSW 的向量数据通过 IO_FLAG_MMAP_IFC（faiss>=1.11）零拷贝映射。
+    faiss 在第一次调用时才导入。
+    """
+    import faiss
+    return faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0) | faiss.IO_FLAG_READ_ONLY
+
+def choose_index_type(n, index_type='auto'):
+    """根据向量数量决定实际使用的索引类型。"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"未知的索引类型 '{index_type}'，可选: {', '.join(INDEX_TYPES)}")
+    if index_type == 'auto':
+        if n < FLAT_MAX:
+            return 'flat'
+        return 'ivf' if n < IVF_MAX else 'ivfpq'
+    if index_type in ('ivfpq', 'opq') and n < PQ_MIN_TRAIN:
+        print(f"向量数量 {n} 不足以训练PQ，改用 'ivf'。")
+        return 'ivf'
+    return index_type
+
+def default_nlist(n):
+    """聚类中心数量：经验值为文档数量平方根的4倍，同时保证每个中心至少有39个训练样本。"""
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+def pq_subquantizers(dim):
+    """PQ子量化器数量：每个子向量约8维，且必须整除向量维度。"""
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+def factory_string(index_type, dim, n, nlist=None):
+    """返回 faiss.index_factory 的描述字符串。"""
+    nlist = nlist or default_nlist(n)
+    if index_type == 'flat':
+        return 'IDMap,Flat'
+    if index_type == 'ivf':
+        return f'IVF{nlist},Flat'
+    if index_type == 'hnsw':
+        return f'IDMap,HNSW{HNSW_M},Flat'
+    m = pq_subquantizers(dim)
+    if index_type == 'ivfpq':
+        return f'IVF{nlist},PQ{m}'
+    if index_type == 'opq':
+        return f'OPQ{m},IVF{nlist},PQ{m}'
+    raise ValueError(f"未知的索引类型 '{index_type}'")
+
+def make_index(vectors, index_type='flat', nlist=None):
+    """
+    创建支持 add_with_ids 的内积索引，需要训练时用 vectors 的随机子集训练。
+
+    参数:
+    vectors (np.ndarray): 用于训练的向量，形状 (n, dim)。
+    index_type (str): 已确定的索引类型（不能是 'auto'）。
+    nlist (int): IVF聚类中心数量，默认按 default_nlist 计算。
+    """
+    import faiss
+    n, dim = vectors.shape
+    spec = factory_string(index_type, dim, n, nlist)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        nlist = nlist or default_nlist(n)
+        sample = vectors
+        if n > nlist * TRAIN_POINTS_PER_LIST:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(n, nlist * TRAIN_POINTS_PER_LIST, replace=False)]
+        print(f"正在训练 {spec} 索引（{len(sample)} 个样本）...")
+        index.train(np.ascontiguousarray(sample, dtype='float32'))  # type: ignore
+    return index
+
+def supports_removal(index_type):
+    """HNSW图索引不支持删除向量。"""
+    return index_type != 'hnsw'
+
+def search_params(index_type, nprobe=None, ef_search=None):
+    """
+    返回单次搜索使用的 faiss.SearchParameters。
+    参数随每次调用传入，不修改共享的索引对象，因此并发搜索互不影响。
+    """
+    import faiss
+    if index_type in IVF_TYPES:
+        return faiss.SearchParametersIVF(nprobe=nprobe or DEFAULT_NPROBE)
+    if index_type == 'hnsw':
+        return faiss.SearchParametersHNSW(efSearch=ef_search or DEFAULT_EF_SEARCH)
+    return None
+
+
+# --- 召回率与延迟基准测试 ---
+
+def synthetic_vectors(n, dim, n_clusters=256, seed=0):
+    """生成带聚类结构的归一化随机向量，比纯随机向量更接近真实的句向量分布。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype('float32')
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def benchmark(n=100_000, dim=384, nq=500, top_k=10):
+    """
+    在合成数据上对比各类索引与精确搜索（flat）的 recall@top_k、单条查询延迟和内存占用。
+    """
+    import faiss
+    data = synthetic_vectors(n + nq, dim)
+    xb, xq = data[:n], data[n:]
+    ids = np.arange(n, dtype='int64')
+
+    configs = [('flat', [None])]
+    configs.append(('ivf', [1, 4, 16, 64]))
+    configs.append(('hnsw', [16, 64, 256]))
+    if n >= PQ_MIN_TRAIN:
+        configs.append(('ivfpq', [4, 16, 64]))
+        configs.append(('opq', [4, 16, 64]))
+
+    truth = None
+    print(f"n={n} dim={dim} nq={nq} top_k={top_k}")
+    print(f"{'index':<8}{'param':>8}{'build s':>10}{'ms/query':>10}{'recall':>8}{'MB':>10}")
+    for index_type, settings in configs:
+        start = time.perf_counter()
+        index = make_index(xb, index_type)
+        index.add_with_ids(xb, ids)  # type: ignore
+        build = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+        for setting in settings:
+            params = search_params(index_type, nprobe=setting, ef_search=setting)
+            start = time.perf_counter()
+            _, found = index.search(xq, top_k, params=params)  # type: ignore
+            latency = (time.perf_counter() - start) / nq * 1000
+            if truth is None:
+                truth = found
+            recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(found, truth)])
+            print(f"{index_type:<8}{str(setting or '-'):>8}{build:>10.2f}{latency:>10.3f}{recall:>8.3f}{size_mb:>10.1f}")
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,239 @@
+"""
+流式构建索引：逐块读取URL文件（txt / jsonl，可gzip压缩），按固定大小分块编码并追加到索引，
+定期保存检查点，构建中断后可以从最近的检查点继续。内存占用只与块大小有关，与语料规模无关。
+
+用法:
+    python RAG/ingest.py RAG/urls.txt --chunk-size 10000 --workers 4
+"""
+from pathlib import Path
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+from RAG.embedder import EMBED_BACKEND, embedder_name, load_embedder
+from RAG.index_factory import IVF_TYPES, TRAIN_POINTS_PER_LIST, choose_index_type, default_nlist, make_index
+from RAG.perf import peak_rss_mb
+from RAG.retriever import (
+    MODEL_NAME, SCRAPE, embed_documents, index_file_for, iter_url_lines, line_hash, lock_file_for,
+    save_array, sidecar_for, source_stamp, write_manifest,
+)
+from RAG.url_store import UrlStoreWriter, file_lock, replace_atomically
+
+
+# 每块编码的行数
+CHUNK_SIZE = 10_000
+# 每处理多少块保存一次检查点
+CHECKPOINT_EVERY = 10
+# IVF类索引训练样本的行数上限（至少保证每个聚类中心39个样本）
+TRAIN_MAX_ROWS = 262_144
+
+
+def chunked(iterable, size):
+    """把可迭代对象切成长度为 size 的列表，最后一块可能更短。"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ChunkEncoder:
+    """
+    把文本块编码为向量。不经过向量缓存：缓存每条记录都在内存中保存一个键，并在磁盘上多存一份向量，
+    内存占用会随语料规模增长；流式构建中每行只编码一次，缓存也不会命中。
+    workers > 1 时使用 sentence-transformers 的多进程池，每个工作进程各自加载一份模型；
+    ONNX 后端在单个进程中由 onnxruntime 的线程池使用多个核心，忽略 workers。
+    """
+    def __init__(self, model_name=MODEL_NAME, workers=1, batch_size=64, backend=EMBED_BACKEND):
+        self.model = load_embedder(model_name, backend)
+        self.batch_size = batch_size
+        self.pool = None
+        if workers > 1 and backend != 'torch':
+            print(f"编码后端 {backend} 不使用多进程池，忽略 --workers。")
+        elif workers > 1:
+            self.pool = self.model.start_multi_process_pool(['cpu'] * workers)
+
+    def encode(self, texts):
+        if self.pool is not None:
+            return self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        return self.model.encode(texts, batch_size=self.batch_size)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+def _load_checkpoint(checkpoint_path, source, stamp, model_name, scrape):
+    if not checkpoint_path.exists():
+        return None
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if (checkpoint['source_path'] != str(Path(source).resolve()) or checkpoint['source'] != stamp
+            or checkpoint['model_name'] != model_name or checkpoint.get('scrape', False) != scrape):
+        print("检查点与当前URL文件或模型不匹配，将从头开始构建。")
+        return None
+    return checkpoint
+
+def _save_checkpoint(checkpoint_path, partial_index_path, index, checkpoint):
+    import faiss
+    tmp_path = partial_index_path.with_name(partial_index_path.name + '.tmp')
+    faiss.write_index(index, str(tmp_path))
+    replace_atomically(tmp_path, partial_index_path)
+    tmp_path = checkpoint_path.with_name(checkpoint_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    replace_atomically(tmp_path, checkpoint_path)
+
+
+def ingest(source, index_path=None, model_name=MODEL_NAME, index_type='auto', nlist=None,
+           chunk_size=CHUNK_SIZE, workers=1, checkpoint_every=CHECKPOINT_EVERY, resume=True, scrape=SCRAPE,
+           backend=EMBED_BACKEND):
+    """
+    流式构建 source 对应的索引及其附属文件，结果与 UrlRetriever.build_index 的格式相同，
+    UrlRetriever.load 可以直接打开。
+
+    参数:
+    source (str | Path): URL文件，格式见 retriever.iter_url_lines。
+    index_path (str | Path): 索引文件路径，默认按 index_file_for(source) 决定。
+    index_type (str): 索引类型，'auto' 按总行数选择。
+    nlist (int): IVF类索引的聚类中心数量，默认按总行数计算。
+    chunk_size (int): 每块编码的行数。
+    workers (int): 编码使用的进程数。
+    checkpoint_every (int): 每处理多少块保存一次检查点。
+    resume (bool): 存在匹配的检查点时是否从检查点继续。
+    scrape (bool): 是否抓取网页正文参与计算向量，见 retriever.SCRAPE。
+    backend (str): 编码后端，见 embedder.BACKENDS，需要与使用索引的 UrlRetriever 一致。
+    返回:
+    dict: 行数、耗时、吞吐量和峰值内存。
+    """
+    import faiss
+    source = Path(source)
+    index_path = Path(index_path or index_file_for(source))
+    stamp = source_stamp(source)
+    checkpoint_path = sidecar_for(index_path, 'checkpoint.json')
+    partial_index_path = index_path.with_name(index_path.name + '.partial')
+    hashes_part = sidecar_for(index_path, 'hashes.part')
+    # 检查点和清单记录包含编码后端的名称，与 UrlRetriever 一致
+    name = embedder_name(model_name, backend)
+
+    checkpoint = _load_checkpoint(checkpoint_path, source, stamp, name, scrape) if resume else None
+    if checkpoint is not None:
+        total, target_type, done = checkpoint['total'], checkpoint['index_type'], checkpoint['rows']
+        nlist = checkpoint['nlist']
+        index = faiss.read_index(str(partial_index_path))
+        print(f"从检查点继续：已完成 {done}/{total} 行。")
+    else:
+        print("正在统计行数...")
+        total = sum(1 for _ in iter_url_lines(source))
+        target_type = choose_index_type(total, index_type)
+        nlist = nlist or default_nlist(total)
+        done = 0
+        index = None
+    print(f"共 {total} 行，使用 '{target_type}' 索引。")
+
+    store_writer = UrlStoreWriter(sidecar_for(index_path, 'meta'), resume_rows=done)
+    hashes_file = open(hashes_part, 'r+b' if done else 'wb')
+    hashes_file.truncate(done * 8)
+    hashes_file.seek(done * 8)
+    # 需要训练的索引先缓存开头的若干块，攒够训练样本后再创建索引
+    train_rows = 1
+    if target_type in IVF_TYPES:
+        train_rows = min(total, max(nlist * 39, min(nlist * TRAIN_POINTS_PER_LIST, TRAIN_MAX_ROWS)))
+    pending = []
+
+    encoder = ChunkEncoder(model_name, workers, backend=backend)
+    started = time.perf_counter()
+    rows_this_run = 0
+    try:
+        lines = itertools.islice(iter_url_lines(source), done, None)
+        for chunk_no, chunk in enumerate(chunked(lines, chunk_size), start=1):
+            vectors = embed_documents(chunk, encoder.encode, scrape=scrape)
+            ids = np.arange(done, done + len(chunk), dtype='int64')
+            if index is None:
+                pending.append((ids, vectors))
+                if sum(len(p_ids) for p_ids, _ in pending) >= train_rows:
+                    index = make_index(np.vstack([v for _, v in pending]), target_type, nlist)
+                    for p_ids, p_vectors in pending:
+                        index.add_with_ids(p_vectors, p_ids)  # type: ignore
+                    pending = []
+            else:
+                index.add_with_ids(vectors, ids)  # type: ignore
+            store_writer.append(chunk)
+            hashes_file.write(np.array([line_hash(line) for line in chunk], dtype='uint64').tobytes())
+            done += len(chunk)
+            rows_this_run += len(chunk)
+
+            if index is not None and chunk_no % checkpoint_every == 0:
+                store_writer.flush()
+                hashes_file.flush()
+                os.fsync(hashes_file.fileno())
+                _save_checkpoint(checkpoint_path, partial_index_path, index, {
+                    'source_path': str(source.resolve()), 'source': stamp, 'model_name': name,
+                    'index_type': target_type, 'nlist': nlist, 'total': total, 'rows': done, 'scrape': scrape,
+                })
+                elapsed = time.perf_counter() - started
+                print(f"已完成 {done}/{total} 行，{rows_this_run / elapsed:.0f} 行/秒，"
+                      f"峰值内存 {peak_rss_mb() or 0:.0f} MB")
+    finally:
+        encoder.close()
+        hashes_file.close()
+
+    if pending:
+        index = make_index(np.vstack([v for _, v in pending]), target_type, nlist)
+        for p_ids, p_vectors in pending:
+            index.add_with_ids(p_vectors, p_ids)  # type: ignore
+    if index is None:
+        print("URL文件为空，未生成索引。")
+        return {'rows': 0}
+
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    faiss.write_index(index, str(tmp_path))
+    # 与 UrlRetriever 相同：替换全部文件期间持有排他锁，正在打开索引的服务进程不会看到一半新一半旧的文件
+    with file_lock(lock_file_for(index_path)):
+        store_writer.finish()
+        save_array(sidecar_for(index_path, 'hashes.npy'), np.fromfile(hashes_part, dtype='uint64'))
+        save_array(sidecar_for(index_path, 'ids.npy'), np.arange(done, dtype='int64'))
+        replace_atomically(tmp_path, index_path)
+        write_manifest(index_path, index, name, target_type, done, done, stamp, scrape)
+    os.remove(hashes_part)
+    for path in (checkpoint_path, partial_index_path):
+        if path.exists():
+            os.remove(path)
+
+    elapsed = time.perf_counter() - started
+    report = {
+        'rows': done,
+        'rows_this_run': rows_this_run,
+        'seconds': elapsed,
+        'rows_per_second': rows_this_run / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(f"索引已保存到 '{index_path}'：共 {done} 行，本次 {rows_this_run} 行，"
+          f"{report['rows_per_second']:.0f} 行/秒，峰值内存 {report['peak_rss_mb'] or 0:.0f} MB")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="流式构建URL索引")
+    parser.add_argument('source', help="URL文件（.txt / .jsonl，可加 .gz）")
+    parser.add_argument('--index-path', default=None)
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--backend', default=EMBED_BACKEND, help="编码后端: torch / onnx / onnx-int8")
+    parser.add_argument('--index-type', default='auto')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY)
+    parser.add_argument('--no-resume', action='store_true', help="忽略已有的检查点，从头开始")
+    parser.add_argument('--scrape', action='store_true', default=SCRAPE, help="抓取网页正文参与计算向量")
+    args = parser.parse_args()
+    ingest(args.source, args.index_path, args.model, args.index_type, args.nlist,
+           args.chunk_size, args.workers, args.checkpoint_every, not args.no_resume, args.scrape, args.backend)
@@ -0,0 +1,132 @@
+from pathlib import Path
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def memory_usage_mb():
+    """
+    返回当前进程的内存占用（MB）。
+    rss: 常驻内存，包含与其他进程共享的页；pss: 共享页按共享进程数均摊后的占用；
+    private: 进程独占的页。Linux 下读取 /proc/self/smaps_rollup，其他系统只提供峰值RSS。
+    """
+    usage = {'rss': None, 'pss': None, 'private': None}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[-1] == 'kB'}
+        usage['rss'] = fields['Rss'] / 1024
+        usage['pss'] = fields['Pss'] / 1024
+        usage['private'] = (fields['Private_Clean'] + fields['Private_Dirty']) / 1024
+    except OSError:
+        usage['rss'] = peak_rss_mb()
+    return usage
+
+def peak_rss_mb(children=False):
+    """进程峰值RSS（MB），children=True 时为已退出子进程中的最大值；无法获取时返回None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+# --- 索引存储方式基准测试 ---
+
+_LOAD_SCRIPT = '''
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import numpy as np
+import faiss
+from RAG.perf import memory_usage_mb
+from RAG.index_factory import mmap_io_flags
+from RAG.url_store import UrlStore
+mmap = {storage!r} == 'mmap'
+index = faiss.read_index({index!r}, mmap_io_flags() if mmap else 0)
+store = UrlStore.open({meta!r}, mmap=mmap)
+loaded = time.perf_counter() - start
+q = np.random.default_rng(0).standard_normal((8, index.d)).astype('float32')
+_, found = index.search(q, 3)
+store.record(int(found[0][0]))
+print(json.dumps({{'load_s': loaded, **memory_usage_mb()}}))
+'''
+
+def benchmark_storage(n=1_000_000, dim=384, processes=4, workdir=None):
+    """
+    用 n 个随机向量和对应的URL表，比较 storage='memory' 与 storage='mmap' 下
+    同时启动 processes 个服务进程的加载时间与内存占用（RSS / PSS / 私有页）。
+    """
+    import faiss
+    from RAG.url_store import UrlStore
+
+    workdir = Path(workdir or tempfile.mkdtemp(prefix='rag_storage_'))
+    index_path = workdir / 'index.faiss'
+    meta_prefix = workdir / 'index.meta'
+    if not index_path.exists():
+        print(f"正在生成 {n} 个 {dim} 维向量...")
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        rng = np.random.default_rng(0)
+        for start in range(0, n, 100_000):
+            chunk = rng.standard_normal((min(100_000, n - start), dim)).astype('float32')
+            index.add_with_ids(chunk, np.arange(start, start + len(chunk), dtype='int64'))  # type: ignore
+        faiss.write_index(index, str(index_path))
+        del index
+        UrlStore.from_lines(
+            f"https://example.com/page/{i} synthetic page number {i}" for i in range(n)
+        ).save(meta_prefix)
+
+    root = str(Path(__file__).parent.parent)
+    for storage in ('memory', 'mmap'):
+        script = _LOAD_SCRIPT.format(root=root, storage=storage, index=str(index_path), meta=str(meta_prefix))
+        start = time.perf_counter()
+        procs = [subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, text=True)
+                 for _ in range(processes)]
+        results = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procs]
+        wall = time.perf_counter() - start
+        totals = {key: sum(r[key] for r in results if r[key] is not None) for key in ('rss', 'pss', 'private')}
+        print(f"{storage:<7} {processes} 个进程: 总耗时 {wall:.2f}s, "
+              f"平均加载 {sum(r['load_s'] for r in results) / processes:.2f}s, "
+              f"RSS合计 {totals['rss']:.0f} MB, PSS合计 {totals['pss']:.0f} MB, 私有页合计 {totals['private']:.0f} MB")
+
+# --- URL元数据表基准测试 ---
+
+def benchmark_metadata(n=1_000_000, lookups=100_000):
+    """
+    比较 n 条 "url 描述" 记录以Python字符串列表保存与以 UrlStore 保存时的每条内存占用，
+    以及按行号取出URL的速度（旧做法为 lines[i].split()[0]）。
+    """
+    from RAG.url_store import UrlStore
+
+    lines = [f"https://example.com/page/{i} synthetic page number {i} about topic {i % 97}" for i in range(n)]
+    list_bytes = sys.getsizeof(lines) + sum(sys.getsizeof(line) for line in lines)
+    start = time.perf_counter()
+    store = UrlStore.from_lines(lines)
+    parse = time.perf_counter() - start
+    store_bytes = store.nbytes()
+
+    rows = np.random.default_rng(0).integers(0, n, lookups).tolist()
+    start = time.perf_counter()
+    for i in rows:
+        lines[i].split()[0]
+    split_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in rows:
+        store.url(i)
+    store_time = time.perf_counter() - start
+
+    print(f"{n} 条记录")
+    print(f"Python列表: {list_bytes / n:.1f} 字节/条, 共 {list_bytes / 2**20:.0f} MB")
+    print(f"UrlStore:   {store_bytes / n:.1f} 字节/条, 共 {store_bytes / 2**20:.0f} MB（解析耗时 {parse:.2f}s）")
+    print(f"取URL: split {split_time / lookups * 1e6:.2f} us/次, UrlStore {store_time / lookups * 1e6:.2f} us/次")
+
+if __name__ == '__main__':
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    benchmark_metadata(n)
+    benchmark_storage(n)
@@ -1,116 +1,496 @@
-from typing import Optional, List
+from typing import TYPE_CHECKING, Optional, List
 from pathlib import Path
+from collections import defaultdict
 import os
+import sys
+import gzip
 import json
+import hashlib
 
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
 
+sys.path.append(str(Path(__file__).parent.parent))
+from RAG.embed_cache import get_embedding_cache
+from RAG.embedder import EMBED_BACKEND, embedder_name, load_embedder
+from RAG.index_factory import (
+    IVF_TYPES, choose_index_type, make_index, mmap_io_flags, search_params, supports_removal,
+)
+from RAG.scraper import chunk_text, scrape_urls
+from RAG.url_store import StaleIndexError, UrlStore, file_lock, replace_atomically
+from tracing import span
+
+# faiss 和编码模型（sentence-transformers 会导入 torch）在第一次使用时才导入，只导入本模块的进程不承担加载时间
+if TYPE_CHECKING:
+    import faiss
 
 # --- 全局配置 ---
 # rag_dir = Path('RAG')
 rag_dir = Path(__file__).parent
-# 缓存文件，用于存储已处理的URL内容，避免重复抓取
-CACHE_FILE = rag_dir / 'cache.json'
+# 缓存文件，用于存储已抓取的网页正文（SQLite，zlib压缩），避免重复抓取
+CACHE_FILE = rag_dir / 'cache.sqlite'
 # 向量索引文件，用于存储FAISS索引
 INDEX_FILE = rag_dir / 'index.faiss'
 # sentence-transformer 模型，选择一个强大的多语言模型
 MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+# 索引清单格式版本，格式变化时旧清单失效并触发重建
+MANIFEST_VERSION = 2
+# 索引和URL表的存储方式：memory 读入进程内存；mmap 以只读内存映射方式打开，多个进程共享页缓存
+STORAGE = os.getenv("RAG_STORAGE", "memory")
+# 倒数排名融合（RRF）的平滑常数，常用取值为60
+RRF_K = 60
+# 是否抓取网页正文参与计算向量；关闭时只使用URL文件中的描述
+SCRAPE = os.getenv("RAG_SCRAPE", "0") == "1"
+# 每个网页最多使用的正文块数
+MAX_CHUNKS = 8
 
 # --- 1. 数据加载与网页抓取 ---
 
+def iter_url_lines(file_path):
+    """
+    逐行读取URL文件，返回 "url description" 格式的行的生成器，不把整个文件读入内存。
+    支持纯文本（每行一个URL，可带描述）和JSONL（每行一个含 url / description 字段的对象），
+    两者都可以用 gzip 压缩（.gz 后缀）。
+    """
+    path = Path(file_path)
+    suffixes = path.suffixes
+    opener = gzip.open if suffixes and suffixes[-1] == '.gz' else open
+    is_jsonl = '.jsonl' in suffixes
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if is_jsonl:
+                record = json.loads(line)
+                line = f"{record['url']} {record.get('description') or ''}".strip()
+            yield line
+
 def load_urls_from_file(file_path: str):
-    """从指定的txt文件中加载URL列表。"""
+    """从指定的URL文件中加载URL列表，支持的格式见 iter_url_lines。"""
     assert os.path.exists(file_path), f"文件 {file_path} 不存在。请检查路径是否正确。"
-        
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = [line.strip() for line in f if line.strip()]
-    return lines
+    return list(iter_url_lines(file_path))
 
-def scrape_and_process_url(url_line):
-    """
-    抓取单个URL的内容，并提取文本。
-    能处理 "url" 或 "url description" 格式的行。
-    """
+def document_text(url_line):
+    """由 "url" 或 "url description" 格式的行得到用于计算向量的文本。"""
     parts = url_line.split()
     url = parts[0]
     description = ' '.join(parts[1:])
-
-    print(f"正在处理: {url}")
     return f"{description}: {url}".strip()  # 简化处理，直接使用描述和URL
 
+def document_chunks(url_line, page_text=None, max_chunks=MAX_CHUNKS):
+    """返回一行对应的待编码文本：描述文本，以及网页正文的前 max_chunks 块（如果有）。"""
+    texts = [document_text(url_line)]
+    if page_text:
+        texts.extend(chunk_text(page_text)[:max_chunks])
+    return texts
+
+def embed_documents(url_lines, encode, scrape=False, cache_file=CACHE_FILE):
+    """
+    为每行计算一个文档向量。
+    scrape=False 时只编码描述文本；scrape=True 时并发抓取所有网页，
+    把描述文本和正文各块分别编码后取平均，每行仍对应一个向量。
+
+    参数:
+    encode (callable): 把文本列表编码为向量的函数，通常经过向量缓存。
+    """
+    if not scrape or not url_lines:
+        return np.asarray(encode([document_text(url_line) for url_line in url_lines]), dtype='float32')
+    urls = [UrlStore.parse_line(url_line)[0] for url_line in url_lines]
+    pages = scrape_urls(urls, cache_file)
+    groups = [document_chunks(url_line, pages.get(url)) for url_line, url in zip(url_lines, urls)]
+    vectors = np.asarray(encode([text for texts in groups for text in texts]), dtype='float32')
+    sizes = np.array([len(texts) for texts in groups])
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return np.add.reduceat(vectors, starts, axis=0) / sizes[:, None]
+
+def line_hash(url_line):
+    """URL行内容的64位哈希，用于判断该行是否需要重新计算向量。"""
+    return int.from_bytes(hashlib.blake2b(url_line.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def sidecar_for(index_path, name):
+    """索引的附属文件与索引放在同一目录，例如 index.faiss -> index.manifest.json。"""
+    index_path = Path(index_path)
+    return index_path.with_name(f"{index_path.stem}.{name}")
+
+def manifest_file_for(index_path):
+    return sidecar_for(index_path, 'manifest.json')
+
+def lock_file_for(index_path):
+    """写入索引及其附属文件时持有排他锁、打开时持有共享锁的锁文件。"""
+    return sidecar_for(index_path, 'lock')
+
+def source_stamp(file_path):
+    """URL文件的大小和修改时间，两者都未变化时认为文件内容未变。"""
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def save_array(path, values):
+    """以 .npy 格式写入数组，先写临时文件再替换。"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, values)
+    replace_atomically(tmp_path, path)
+
+def write_manifest(index_path, index, model_name, index_type, next_id, count, source, scrape=False):
+    """
+    写入索引清单。清单在索引和其余附属文件之后写入，作为它们已完整的标志。
+    model_name 为 embedder.embedder_name 的结果，编码后端不同的索引不会被误用。
+    """
+    nlist = None
+    if index_type in IVF_TYPES:
+        import faiss
+        nlist = faiss.extract_index_ivf(index).nlist
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'model_name': model_name,
+        'index_type': index_type,
+        'nlist': nlist,
+        'next_id': next_id,
+        'count': count,
+        'source': source,
+        'scrape': scrape,
+    }
+    manifest_path = manifest_file_for(index_path)
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    replace_atomically(tmp_path, manifest_path)
+
 # --- 2. 检索器核心类 ---
 
 class UrlRetriever:
-    def __init__(self, model_name=MODEL_NAME):
-        print("正在加载 Sentence Transformer 模型...")
-        self.model = SentenceTransformer(model_name)
-        self.index: Optional[faiss.Index] = None 
-        self.url_list = []
+    def __init__(self, model_name=MODEL_NAME, model=None, index_path=INDEX_FILE,
+                 index_type='auto', nlist=None, storage=STORAGE, scrape=SCRAPE, backend=EMBED_BACKEND):
+        """
+        参数:
+        model_name (str): sentence-transformer 模型名称。
+        model: 已加载的编码器（SentenceTransformer 或 embedder.OnnxEmbedder），传入时直接复用，避免重复加载。
+        index_path (str | Path): FAISS索引文件路径。
+        index_type (str): 索引类型，见 index_factory.INDEX_TYPES。'auto' 按文档数量自动选择。
+        nlist (int): IVF类索引的聚类中心数量，默认按文档数量计算。
+        storage (str): 'memory' 或 'mmap'，见 STORAGE。
+        scrape (bool): 是否抓取网页正文参与计算向量，见 SCRAPE。切换后索引会重新构建。
+        backend (str): 编码后端，见 embedder.BACKENDS。切换后索引会重新构建。
+        """
+        self.model_name = model_name
+        self.backend = backend
+        # 向量缓存和索引清单使用的名称，包含编码后端
+        self.embedder_name = embedder_name(model_name, backend)
+        self.index_path = Path(index_path)
+        self.index_type = index_type
+        self.nlist = nlist
+        self.storage = storage
+        self.scrape = scrape
+        # 当前索引实际使用的类型，'auto' 解析后的结果
+        self.active_index_type = None
+        if model is None:
+            print(f"正在加载 Sentence Transformer 模型（{backend}）...")
+            with span('rag.load_model', model=model_name, backend=backend):
+                model = load_embedder(model_name, backend)
+        self.model = model
+        # 文档和查询向量的磁盘缓存，同一模型和后端在进程内共享
+        self.cache = get_embedding_cache(self.embedder_name)
+        self.index: "Optional[faiss.Index]" = None
+        # URL与描述的紧凑元数据表，行号与 self.ids 一一对应
+        self.store = UrlStore.from_lines([])
+        self._set_ids(np.empty(0, dtype='int64'))
+
+    def load(self, file_path, force_rebuild=False):
+        """
+        从URL文件加载索引。
+        文件大小和修改时间与清单记录一致时，直接打开已保存的索引和URL表，不再逐行读取和比对；
+        storage='mmap' 时两者都以只读内存映射方式打开，多个服务进程通过操作系统页缓存共享同一份数据。
+        否则读取文件并调用 build_index 增量更新。
+        """
+        stamp = source_stamp(file_path)
+        manifest = None if force_rebuild else self._load_manifest()
+        if (manifest is not None and manifest.get('source') == stamp and self.index_path.exists()
+                and UrlStore.exists(sidecar_for(self.index_path, 'meta'))):
+            print(f"从 '{self.index_path}' 加载已存在的FAISS索引...")
+            try:
+                with span('rag.load_index', storage=self.storage):
+                    self._open_saved(manifest)
+                print("索引加载成功。")
+                return
+            except StaleIndexError as e:
+                print(f"已保存的索引文件不一致（{e}），将重新读取URL文件...")
+        with span('rag.build_index', storage=self.storage, scrape=self.scrape):
+            self.build_index(load_urls_from_file(file_path), force_rebuild, source=stamp)
 
-    def build_index(self, url_lines, force_rebuild=False):
+    def _open_saved(self, manifest):
+        """
+        按 self.storage 打开已保存的索引、URL表和向量ID。
+        所有文件在共享锁内一次打开，之后被重新构建替换时仍读取打开时的版本；
+        三者的行数不一致时抛出 StaleIndexError，不会用旧的向量ID去读新的URL表。
+        """
+        import faiss
+        mmap = self.storage == 'mmap'
+        with file_lock(lock_file_for(self.index_path), shared=True):
+            index = faiss.read_index(str(self.index_path), mmap_io_flags() if mmap else 0)
+            store = UrlStore.open(sidecar_for(self.index_path, 'meta'), mmap=mmap)
+            ids = np.load(sidecar_for(self.index_path, 'ids.npy'), mmap_mode='r' if mmap else None)
+        if not len(store) == len(ids) == index.ntotal == manifest.get('count', len(ids)):
+            raise StaleIndexError(f"URL表 {len(store)} 行，向量ID {len(ids)} 个，索引 {index.ntotal} 个向量，"
+                                  f"清单记录 {manifest.get('count')} 行")
+        self.index = index
+        self.store = store
+        self._set_ids(ids)
+        self.active_index_type = manifest.get('index_type', 'flat')
+
+    def _set_ids(self, ids):
+        """记录每行的向量ID，并按ID排序以便用二分查找把搜索结果映射回行号。"""
+        self.ids = ids
+        order = np.argsort(ids, kind='stable')
+        self._sorted_ids = np.asarray(ids)[order]
+        self._sorted_pos = order
+
+    def _positions(self, found_ids):
+        """把FAISS返回的向量ID映射为行号，不存在的ID（包括结果不足时的-1）映射为-1。"""
+        if len(self._sorted_ids) == 0:
+            return np.full(len(found_ids), -1)
+        idx = np.minimum(np.searchsorted(self._sorted_ids, found_ids), len(self._sorted_ids) - 1)
+        return np.where(self._sorted_ids[idx] == found_ids, self._sorted_pos[idx], -1)
+
+    def build_index(self, url_lines, force_rebuild=False, source=None):
         """
         为URL列表构建或加载FAISS索引。
-        
+        索引旁保存一个清单文件，记录每行内容的哈希和稳定的向量ID（faiss.IndexIDMap）。
+        加载时与当前URL列表比对，只为新增或修改的行计算向量，并从索引中删除已移除的行，
+        保证索引中的ID始终与 self.store 的行对应。
+
         参数:
         url_lines (list): 从文件中加载的URL行列表。
         force_rebuild (bool): 是否强制重新抓取和构建索引，忽略缓存。
+        source (dict): URL文件的 source_stamp，保存到清单中供 load() 判断文件是否变化。
         """
-        self.url_list = url_lines
-        
-        # 如果索引文件存在且不强制重建，则直接加载
-        if os.path.exists(INDEX_FILE) and not force_rebuild:
-            print(f"从 '{INDEX_FILE}' 加载已存在的FAISS索引...")
-            self.index = faiss.read_index(str(INDEX_FILE))
+        import faiss
+        self.store = UrlStore.from_lines(url_lines)
+        hashes = [line_hash(url_line) for url_line in url_lines]
+
+        manifest = None
+        if os.path.exists(self.index_path) and not force_rebuild:
+            manifest = self._load_manifest()
+            if manifest is None:
+                print(f"'{self.index_path}' 缺少匹配的清单文件，将重新构建索引...")
+
+        if manifest is not None:
+            print(f"从 '{self.index_path}' 加载已存在的FAISS索引...")
+            with file_lock(lock_file_for(self.index_path), shared=True):
+                self.index = faiss.read_index(str(self.index_path))
+                manifest['hashes'], manifest['ids'] = self._load_line_ids()
+            if self.index.ntotal != len(manifest['ids']):
+                print("索引与清单记录的向量数量不一致，将重新构建索引...")
+                manifest = None
+        if manifest is None:
+            print("正在构建新的FAISS索引...")
+            self.index = None
+            manifest = {'hashes': [], 'ids': [], 'next_id': 0}
+
+        # 按内容哈希比对：未变化的行沿用原ID，其余行分配新ID，剩下的旧ID即为被删除的行
+        unused = defaultdict(list)
+        for h, vec_id in zip(manifest['hashes'], manifest['ids']):
+            unused[h].append(vec_id)
+        next_id = manifest['next_id']
+        ids = np.empty(len(url_lines), dtype='int64')
+        added = []
+        for pos, h in enumerate(hashes):
+            if unused[h]:
+                ids[pos] = unused[h].pop()
+            else:
+                ids[pos] = next_id
+                next_id += 1
+                added.append(pos)
+        removed = [vec_id for vec_ids in unused.values() for vec_id in vec_ids]
+
+        # 索引类型变化（例如 auto 模式下文档数量越过阈值）或索引不支持删除时，
+        # 用所有行重新构建索引；未变化的行可以直接从向量缓存中取出，不需要重新编码
+        target_type = choose_index_type(len(url_lines), self.index_type)
+        if self.index is not None and (
+            manifest.get('index_type', 'flat') != target_type
+            or (self.nlist and manifest.get('nlist') != self.nlist)
+            or (removed and not supports_removal(target_type))
+        ):
+            print(f"索引类型需要变为 '{target_type}'，正在重新构建索引...")
+            self.index = None
+            added = list(range(len(url_lines)))
+            removed = []
+        self.active_index_type = manifest.get('index_type', 'flat') if self.index is not None else target_type
+
+        self._set_ids(ids)
+        if not added and not removed:
+            # 内容未变化，只在文件时间戳变化或URL表缺失时更新附属文件
+            if self.index is not None and ((source is not None and manifest.get('source') != source)
+                                           or not UrlStore.exists(sidecar_for(self.index_path, 'meta'))):
+                self._save_metadata(hashes, ids, next_id, source)
+            if self.storage == 'mmap' and self.index is not None:
+                self._reopen_saved(manifest)
             print("索引加载成功。")
             return
 
-        print("正在构建新的FAISS索引...")
-        all_texts = []
-        for url_line in self.url_list:
-            text = scrape_and_process_url(url_line)
-            all_texts.append(text)
-            
-        print(f"正在将 {len(all_texts)} 个文档转换为向量...")
-        embeddings = self.model.encode(all_texts, show_progress_bar=True)
-        
-        # 创建FAISS索引
-        embedding_dim = embeddings.shape[1]
-        # self.index = faiss.IndexFlatL2(embedding_dim) # L2距离索引
-        self.index = faiss.IndexFlatIP(embedding_dim) # 内积索引
+        print(f"URL列表有变化：新增 {len(added)} 行，删除 {len(removed)} 行。")
+        if removed and self.index is not None:
+            self.index.remove_ids(np.array(removed, dtype='int64'))
+        if added:
+            print(f"正在将 {len(added)} 个文档转换为向量...")
+            embeddings = embed_documents(
+                [url_lines[pos] for pos in added],
+                lambda texts: self.cache.encode(texts, lambda t: self.model.encode(t, show_progress_bar=True)),
+                scrape=self.scrape,
+            )
+            stats = self.cache.stats()
+            print(f"向量缓存：命中 {stats['doc_hits']} 次，未命中 {stats['doc_misses']} 次。")
+            if self.index is None:
+                # 创建内积索引，所有类型都通过 add_with_ids 维护稳定的向量ID
+                self.index = make_index(embeddings, target_type, self.nlist)
+            self.index.add_with_ids(np.array(embeddings, dtype='float32'), ids[added]) # type: ignore
 
-        # nlist: 定义要创建多少个“分区”或“聚类中心”。一个经验法则是设为文档数量的平方根的4倍左右。
-        # nlist = int(4 * np.sqrt(embeddings.shape[0]))
-        # quantizer = faiss.IndexFlatIP(embedding_dim)  # 使用内积索引作为量化器
-        # self.index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist, faiss.METRIC_INNER_PRODUCT) # 使用内积作为距离度量
+        print(f"索引更新完成，共 {self.index.ntotal} 个向量。") # type: ignore
+        # 先写临时文件再替换，其他进程映射着的旧索引不受影响；排他锁保证其他进程不会打开到一半新一半旧的文件
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        faiss.write_index(self.index, str(tmp_path))
+        with file_lock(lock_file_for(self.index_path)):
+            replace_atomically(tmp_path, self.index_path)
+            self._write_metadata(hashes, ids, next_id, source)
+        print(f"索引已保存到 '{self.index_path}'。")
+        if self.storage == 'mmap':
+            self._reopen_saved(self._load_manifest())
 
-        self.index.add(np.array(embeddings, dtype='float32')) # type: ignore
-        print(f"索引构建完成，共 {self.index.ntotal} 个向量。")
-        faiss.write_index(self.index, str(INDEX_FILE))
-        print(f"索引已保存到 '{INDEX_FILE}'。")
+    def _reopen_saved(self, manifest):
+        """构建完成后以内存映射方式重新打开；期间文件已被其他进程替换时继续使用刚构建的内存中的索引。"""
+        try:
+            self._open_saved(manifest or {})
+        except StaleIndexError as e:
+            print(f"索引文件已被其他进程更新（{e}），继续使用内存中的索引。")
 
-    def search(self, query, top_k=3):
+    def _load_manifest(self):
+        """
+        读取清单文件，不存在或版本、模型不匹配时返回None。
+        每行的哈希和向量ID保存在单独的 .npy 文件中，按需读取。
+        """
+        manifest_path = manifest_file_for(self.index_path)
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('model_name') != self.embedder_name:
+            return None
+        if manifest.get('scrape', False) != self.scrape:
+            return None
+        if not all(sidecar_for(self.index_path, name).exists() for name in ('hashes.npy', 'ids.npy')):
+            return None
+        return manifest
+
+    def _load_line_ids(self):
+        """返回清单记录的 (每行哈希列表, 每行向量ID列表)。"""
+        hashes = np.load(sidecar_for(self.index_path, 'hashes.npy'))
+        ids = np.load(sidecar_for(self.index_path, 'ids.npy'))
+        return hashes.tolist(), ids.tolist()
+
+    def _save_metadata(self, hashes, ids, next_id, source):
+        with file_lock(lock_file_for(self.index_path)):
+            self._write_metadata(hashes, ids, next_id, source)
+
+    def _write_metadata(self, hashes, ids, next_id, source):
+        """保存每行哈希、向量ID、URL元数据表和清单。清单最后写入，作为其余文件已完整的标志。调用方持有排他锁。"""
+        save_array(sidecar_for(self.index_path, 'hashes.npy'), np.array(hashes, dtype='uint64'))
+        save_array(sidecar_for(self.index_path, 'ids.npy'), ids)
+        self.store.save(sidecar_for(self.index_path, 'meta'))
+        write_manifest(self.index_path, self.index, self.embedder_name, self.active_index_type,
+                       next_id, len(self.store), source, self.scrape)
+
+    def search(self, query, top_k=3, nprobe=None, ef_search=None):
         """
         根据查询，在FAISS索引中搜索最相关的URL。
+
+        参数:
+        nprobe (int): IVF类索引每次搜索访问的聚类数量，越大召回越高、速度越慢。
+        ef_search (int): HNSW索引的搜索宽度。
         """
         if self.index is None:
             return ["索引尚未构建，请先调用 build_index()。"]
         
         print(f"\n正在执行搜索，查询: '{query}'")
-        query_embedding = self.model.encode([query])
+        return [self.store.url(pos) for pos, _ in self._search_rows([query], top_k, nprobe, ef_search)[0]]
+
+    def search_batch(self, queries, top_k=3, nprobe=None, ef_search=None, fuse=False):
+        """
+        批量搜索多个查询：所有查询一次编码，并在一次FAISS搜索中完成。
+
+        参数:
+        queries (list): 查询列表，例如同一问题的多种改写。
+        fuse (bool): 为True时用倒数排名融合（RRF）把各查询的结果合并成一个列表。
+        返回:
+        fuse=False 时为每个查询的URL列表组成的列表，fuse=True 时为合并后的前 top_k 个URL。
+        """
+        if self.index is None:
+            return ["索引尚未构建，请先调用 build_index()。"]
+        if not queries:
+            return []
+
+        print(f"\n正在执行批量搜索，共 {len(queries)} 个查询")
+        results = [[self.store.url(pos) for pos, _ in rows]
+                   for rows in self._search_rows(queries, top_k, nprobe, ef_search)]
+        if fuse:
+            return reciprocal_rank_fusion(results, top_k)
+        return results
+
+    def search_records(self, queries, top_k=3, nprobe=None, ef_search=None):
+        """
+        批量搜索并返回完整记录，每个查询对应一个列表，元素为 {'url', 'description', 'score'}。
+        URL和描述直接从元数据表按行号取出，不再解析原始行。索引尚未构建时抛出 RuntimeError。
+        """
+        if self.index is None:
+            raise RuntimeError("索引尚未构建，请先调用 build_index()。")
+        if not queries:
+            return []
+        results = []
+        for rows in self._search_rows(queries, top_k, nprobe, ef_search):
+            results.append([{**self.store.record(pos), 'score': score} for pos, score in rows])
+        return results
+
+    def _search_rows(self, queries, top_k, nprobe=None, ef_search=None):
+        """返回每个查询命中的 (行号, 得分) 列表。"""
+        with span('rag.encode', queries=len(queries)) as s:
+            hits = self.cache.hits['query']
+            query_embeddings = self.cache.encode(queries, self.model.encode, is_query=True)
+            s.set('cache_hits', self.cache.hits['query'] - hits)
+            s.set('cache_hit', self.cache.hits['query'] - hits == len(queries))
         
-        # 在FAISS索引中搜索
-        distances, indices = self.index.search(np.array(query_embedding, dtype='float32'), top_k) # type: ignore
+        # 在FAISS索引中搜索，每行对应一个查询
+        params = search_params(self.active_index_type, nprobe, ef_search)
+        with span('rag.faiss_search', index_type=self.active_index_type, queries=len(queries), top_k=top_k):
+            distances, indices = self.index.search(np.array(query_embeddings, dtype='float32'), top_k, params=params) # type: ignore
         
         results = []
-        for i in indices[0]:
-            if i != -1: # FAISS在结果不足时会返回-1
-                # 只返回URL部分
-                results.append(self.url_list[i].split()[0])
+        for scores, row in zip(distances, indices):
+            positions = self._positions(row) # FAISS在结果不足时会返回-1
+            results.append([(int(pos), float(score)) for pos, score in zip(positions, scores) if pos >= 0])
         
         return results
 
+def reciprocal_rank_fusion(result_lists, top_k, k=RRF_K):
+    """
+    倒数排名融合：每个URL的得分为它在各列表中排名的 1 / (k + rank) 之和，
+    按得分从高到低返回前 top_k 个URL。
+    """
+    scores = defaultdict(float)
+    for urls in result_lists:
+        for rank, url in enumerate(urls, start=1):
+            scores[url] += 1.0 / (k + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+
+def index_file_for(file_path):
+    """
+    返回URL文件对应的索引文件路径。
+    默认的 RAG/urls.txt 沿用 INDEX_FILE，其他文件在同目录下使用 "<文件名>.index.faiss"，
+    避免不同URL文件共用同一个索引。
+    """
+    path = Path(file_path).resolve()
+    if path == (rag_dir / 'urls.txt').resolve():
+        return INDEX_FILE
+    return path.with_name(f"{path.stem}.index.faiss")
+
 def load_urls_build_index_search(file_path, query, top_k=3, force_rebuild=False):
     """
     辅助函数：加载URL，构建索引并执行搜索。
@@ -121,9 +501,8 @@ def load_urls_build_index_search(file_path, query, top_k=3, force_rebuild=False)
     top_k (int): 返回的最相关URL数量。
     force_rebuild (bool): 是否强制重新抓取和构建索引。
     """
-    retriever = UrlRetriever()
-    urls = load_urls_from_file(file_path)
-    retriever.build_index(urls, force_rebuild)
+    retriever = UrlRetriever(index_path=index_file_for(file_path))
+    retriever.load(file_path, force_rebuild)
     return retriever.search(query, top_k)
 
 # --- 主程序入口 ---
@@ -0,0 +1,354 @@
+"""
+网页内容抓取：用 httpx 异步连接池并发抓取网页，按主机限制并发数，复用连接，
+通过条件请求（ETag / Last-Modified）避免重复下载未变化的网页。
+提取出的正文经 zlib 压缩后保存在本地 SQLite 缓存中，重新构建索引时直接复用。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urlsplit
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+import httpx
+
+
+# --- 抓取参数，可通过环境变量调整 ---
+MAX_CONNECTIONS = int(os.getenv("RAG_SCRAPE_MAX_CONNECTIONS", "64"))
+PER_HOST = int(os.getenv("RAG_SCRAPE_PER_HOST", "4"))
+TIMEOUT = float(os.getenv("RAG_SCRAPE_TIMEOUT", "10"))
+# 在此时间（秒）内抓取过的网页直接使用缓存，不发送请求；超过后发送条件请求
+MAX_AGE = float(os.getenv("RAG_SCRAPE_MAX_AGE", str(24 * 3600)))
+# 单个网页最多读取的字节数
+MAX_BYTES = 2 * 2**20
+USER_AGENT = "rag-mcp-agent/0.1 (+https://github.com/DuskSwan/rag-mcp-agent)"
+# 正文分块的长度和相邻块的重叠（字符数）
+CHUNK_CHARS = 1000
+CHUNK_OVERLAP = 200
+
+
+# --- 正文提取与分块 ---
+
+class _TextExtractor(HTMLParser):
+    SKIP = {'script', 'style', 'noscript', 'template', 'svg', 'iframe'}
+    BLOCK = {'p', 'div', 'br', 'li', 'tr', 'section', 'article', 'header', 'footer',
+             'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'table'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.title = []
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        (self.title if self._in_title else self.parts).append(data)
+
+def extract_text(html):
+    """从HTML中提取标题和正文，去掉脚本、样式等不可见内容，并压缩空白。"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (' '.join(line.split()) for line in ''.join(parser.parts).splitlines())
+    body = '\n'.join(line for line in lines if line)
+    title = ' '.join(''.join(parser.title).split())
+    return f"{title}\n{body}".strip()
+
+def chunk_text(text, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """
+    按词把文本切成约 chunk_chars 个字符的块，相邻块重叠约 overlap 个字符。
+    没有空格的长串（例如中文）按 chunk_chars 硬切。
+    """
+    words = [w[i:i + chunk_chars] for w in text.split() for i in range(0, len(w), chunk_chars)]
+    chunks, current, length = [], [], 0
+    for word in words:
+        if current and length + len(word) > chunk_chars:
+            chunks.append(' '.join(current))
+            # 保留末尾约 overlap 个字符作为下一块的开头
+            keep, kept = [], 0
+            for w in reversed(current):
+                if kept + len(w) + 1 > overlap:
+                    break
+                keep.append(w)
+                kept += len(w) + 1
+            current, length = keep[::-1], kept
+        current.append(word)
+        length += len(word) + 1
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+# --- 内容缓存 ---
+
+class ContentCache:
+    """
+    网页内容的磁盘缓存（SQLite），每个URL一行：状态码、ETag、Last-Modified、抓取时间和
+    zlib压缩后的正文。抓取失败的URL也会记录（正文为空），在 MAX_AGE 内不再重复请求。
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, status INTEGER, etag TEXT, last_modified TEXT, "
+                "fetched_at REAL, text BLOB)"
+            )
+
+    def get(self, url):
+        """返回缓存记录 {'status', 'etag', 'last_modified', 'fetched_at', 'text'}，不存在时返回None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, etag, last_modified, fetched_at, text FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, etag, last_modified, fetched_at, blob = row
+        text = zlib.decompress(blob).decode('utf-8') if blob is not None else None
+        return {'status': status, 'etag': etag, 'last_modified': last_modified,
+                'fetched_at': fetched_at, 'text': text}
+
+    def text(self, url):
+        record = self.get(url)
+        return record['text'] if record else None
+
+    def put(self, url, status, etag=None, last_modified=None, text=None):
+        blob = zlib.compress(text.encode('utf-8'), 6) if text is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, status, etag, last_modified, time.time(), blob),
+            )
+
+    def touch(self, url):
+        """网页未变化（304）时只更新抓取时间。"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def stats(self):
+        with self._lock:
+            entries, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM pages"
+            ).fetchone()
+        return {'entries': entries, 'compressed_bytes': stored}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- 异步抓取 ---
+
+class PageFetcher:
+    """
+    异步网页抓取器，需在 async with 中使用。所有请求共用一个 httpx.AsyncClient 连接池，
+    总连接数不超过 max_connections，同一主机的并发请求不超过 per_host。
+    """
+    def __init__(self, cache, max_connections=MAX_CONNECTIONS, per_host=PER_HOST, timeout=TIMEOUT,
+                 max_age=MAX_AGE, transport=None):
+        self.cache = cache
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_age = max_age
+        self.transport = transport
+        self.client: "httpx.AsyncClient | None" = None
+        self._hosts = {}
+        self.counts = {'fresh': 0, 'fetched': 0, 'not_modified': 0, 'errors': 0}
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.timeout),
+            follow_redirects=True,
+            headers={'User-Agent': USER_AGENT},
+            transport=self.transport,
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()  # type: ignore
+        self.client = None
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    async def fetch(self, url):
+        """返回网页正文；无法获取时返回缓存中的旧正文，没有缓存则返回None。"""
+        cached = self.cache.get(url)
+        if cached is not None and time.time() - cached['fetched_at'] < self.max_age:
+            self.counts['fresh'] += 1
+            return cached['text']
+        headers = {}
+        if cached is not None and cached['text'] is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        old_text = cached['text'] if cached is not None else None
+
+        async with self._host_limit(url):
+            try:
+                async with self.client.stream('GET', url, headers=headers) as response:  # type: ignore
+                    if response.status_code == 304 and old_text is not None:
+                        self.cache.touch(url)
+                        self.counts['not_modified'] += 1
+                        return old_text
+                    if response.status_code != 200:
+                        self.counts['errors'] += 1
+                        if old_text is None:
+                            self.cache.put(url, response.status_code)
+                        return old_text
+                    body = bytearray()
+                    async for part in response.aiter_bytes():
+                        body += part
+                        if len(body) >= MAX_BYTES:
+                            break
+                    text = page_text(bytes(body[:MAX_BYTES]), response)
+            except httpx.HTTPError as e:
+                print(f"抓取失败: {url} ({type(e).__name__})")
+                self.counts['errors'] += 1
+                return old_text
+
+        self.cache.put(url, 200, response.headers.get('etag'), response.headers.get('last-modified'), text)
+        self.counts['fetched'] += 1
+        return text
+
+    async def fetch_all(self, urls):
+        """并发抓取所有URL（重复的只抓一次），返回 {url: 正文或None}。"""
+        unique = list(dict.fromkeys(urls))
+        texts = await asyncio.gather(*(self.fetch(url) for url in unique))
+        return dict(zip(unique, texts))
+
+def page_text(body, response):
+    """按响应的内容类型解码并提取正文，不支持的类型返回None。"""
+    content_type = response.headers.get('content-type', 'text/html').lower()
+    if 'html' not in content_type and not content_type.startswith('text/'):
+        return None
+    text = body.decode(response.encoding or 'utf-8', errors='replace')
+    return extract_text(text) if 'html' in content_type else ' '.join(text.split())
+
+def run_sync(coro):
+    """在同步代码中运行协程；当前线程已有事件循环时（例如在MCP工具中调用）改在新线程中运行。"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+def scrape_urls(urls, cache_path, **options):
+    """
+    同步接口：抓取一组URL并返回 {url: 正文或None}。
+
+    参数:
+    urls (list): URL列表。
+    cache_path (str | Path): 内容缓存文件路径。
+    options: 传给 PageFetcher 的参数，例如 per_host、timeout、max_age。
+    """
+    cache = ContentCache(cache_path)
+
+    async def run():
+        async with PageFetcher(cache, **options) as fetcher:
+            pages = await fetcher.fetch_all(urls)
+        print(f"网页抓取完成：{len(pages)} 个URL，{fetcher.counts}")
+        return pages
+
+    try:
+        return run_sync(run())
+    finally:
+        cache.close()
+
+
+# --- 离线测试 ---
+
+def test(n_pages=20):
+    """
+    在本地启动一个模拟网站，验证正文提取、分块、按主机限流以及第二次抓取走条件请求（304）。
+    """
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    requests = {'total': 0, 'not_modified': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests['total'] += 1
+            page = self.path.strip('/')
+            etag = f'"{page}-v1"'
+            if self.headers.get('If-None-Match') == etag:
+                requests['not_modified'] += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = (f"<html><head><title>Page {page}</title><style>p{{}}</style></head>"
+                    f"<body><script>var x = 1;</script><p>Content of page {page}.</p>"
+                    f"<p>{'lorem ipsum ' * 200}</p></body></html>").encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/{i}" for i in range(n_pages)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = Path(tmp) / 'cache.sqlite'
+            start = time.perf_counter()
+            first = scrape_urls(urls, cache_path, max_age=0)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            second = scrape_urls(urls, cache_path, max_age=0)
+            warm = time.perf_counter() - start
+            third = scrape_urls(urls, cache_path)
+    finally:
+        server.shutdown()
+
+    assert first == second == third
+    text = first[urls[0]]
+    assert text.startswith('Page 0') and 'var x' not in text, text[:80]
+    assert len(chunk_text(text)) > 1
+    assert requests == {'total': 2 * n_pages, 'not_modified': n_pages}, requests
+    print(f"首次抓取 {cold:.3f}s，条件请求 {warm:.3f}s，缓存命中无请求；每页 {len(chunk_text(text))} 块。")
+    print("测试通过。")
+
+if __name__ == '__main__':
+    sys.path.append(str(Path(__file__).parent.parent))
+    test()
@@ -0,0 +1,250 @@
+from contextlib import contextmanager
+from pathlib import Path
+import os
+
+import numpy as np
+
+
+def replace_atomically(tmp_path, path):
+    """
+    写完临时文件后再替换目标文件。其他进程若正以内存映射方式打开旧文件，
+    仍会继续读取旧文件的内容，不会读到写了一半的数据。
+    """
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    用 flock 锁住 path（不存在时创建）：写入方持有排他锁，读取方持有共享锁，
+    保证多个进程看到的是同一次写入的全部文件。没有 fcntl 的平台（Windows）上不加锁。
+    同一进程内不要嵌套获取同一个文件的锁。
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a+b') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class StaleIndexError(RuntimeError):
+    """打开的索引、向量ID和URL表不属于同一次构建（打开期间被其他进程或重新加载替换）。"""
+
+
+class StringColumn:
+    """
+    紧凑的字符串列：所有字符串按UTF-8编码后连续存放在一个缓冲区中，
+    offsets[i]:offsets[i+1] 为第 i 个字符串的字节范围。
+
+    磁盘上对应两个文件：<prefix>.bin（缓冲区）和 <prefix>.off.npy（int64偏移量），
+    以内存映射方式打开时不会把内容读入进程堆，多个进程通过页缓存共享同一份数据。
+    """
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @staticmethod
+    def paths(prefix):
+        prefix = Path(prefix)
+        return prefix.with_name(prefix.name + '.bin'), prefix.with_name(prefix.name + '.off.npy')
+
+    @classmethod
+    def exists(cls, prefix):
+        return all(path.exists() for path in cls.paths(prefix))
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype='int64')
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype='uint8'))
+
+    @classmethod
+    def open(cls, prefix, mmap=True):
+        data_path, offsets_path = cls.paths(prefix)
+        offsets = np.load(offsets_path, mmap_mode='r' if mmap else None)
+        if os.path.getsize(data_path) == 0:
+            # 空文件无法被内存映射
+            data = np.empty(0, dtype='uint8')
+        elif mmap:
+            data = np.memmap(data_path, dtype='uint8', mode='r')
+        else:
+            data = np.fromfile(data_path, dtype='uint8')
+        if len(offsets) == 0 or int(offsets[-1]) != len(data):
+            # 两个文件之间被重新构建替换，偏移量与缓冲区来自不同版本
+            raise StaleIndexError(f"{data_path} 与 {offsets_path} 不属于同一版本")
+        return cls(offsets, data)
+
+    def save(self, prefix):
+        data_path, offsets_path = self.paths(prefix)
+        tmp_data = data_path.with_name(data_path.name + '.tmp')
+        tmp_offsets = offsets_path.with_name(offsets_path.name + '.tmp')
+        np.asarray(self.data, dtype='uint8').tofile(tmp_data)
+        with open(tmp_offsets, 'wb') as f:
+            np.save(f, np.asarray(self.offsets, dtype='int64'))
+        replace_atomically(tmp_data, data_path)
+        replace_atomically(tmp_offsets, offsets_path)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class UrlStore:
+    """
+    URL元数据表：把 "url 描述" 格式的行一次性解析为URL列和描述列两个 StringColumn。
+    与Python字符串列表相比，每条记录只占偏移量加UTF-8字节，搜索时直接按行号取出URL和描述，
+    不再重复 split。
+
+    保存在 <prefix>.urls.* 和 <prefix>.desc.* 四个文件中；open() 立即打开所有列（默认内存映射），
+    之后这些文件被重新构建替换时，已打开的 UrlStore 仍读取旧文件，与同时加载的索引保持一致。
+    """
+    COLUMNS = ('urls', 'desc')
+
+    def __init__(self, columns):
+        self._columns = dict(columns)
+
+    @staticmethod
+    def parse_line(url_line):
+        """把一行拆成 (url, 描述)，描述可以为空。"""
+        parts = url_line.split(maxsplit=1)
+        if not parts:
+            return '', ''
+        return parts[0], ' '.join(parts[1].split()) if len(parts) > 1 else ''
+
+    @classmethod
+    def from_lines(cls, url_lines):
+        parsed = [cls.parse_line(line) for line in url_lines]
+        return cls({
+            'urls': StringColumn.from_strings(url for url, _ in parsed),
+            'desc': StringColumn.from_strings(desc for _, desc in parsed),
+        })
+
+    @classmethod
+    def column_prefix(cls, prefix, name):
+        prefix = Path(prefix)
+        return prefix.with_name(f"{prefix.name}.{name}")
+
+    @classmethod
+    def exists(cls, prefix):
+        return all(StringColumn.exists(cls.column_prefix(prefix, name)) for name in cls.COLUMNS)
+
+    @classmethod
+    def open(cls, prefix, mmap=True):
+        return cls({name: StringColumn.open(cls.column_prefix(prefix, name), mmap=mmap) for name in cls.COLUMNS})
+
+    def save(self, prefix):
+        for name in self.COLUMNS:
+            self._column(name).save(self.column_prefix(prefix, name))
+
+    def _column(self, name):
+        return self._columns[name]
+
+    def __len__(self):
+        return len(self._column('urls'))
+
+    def url(self, i):
+        return self._column('urls')[i]
+
+    def description(self, i):
+        return self._column('desc')[i]
+
+    def record(self, i):
+        return {'url': self.url(i), 'description': self.description(i)}
+
+    def __getitem__(self, i):
+        """还原为 "url 描述" 格式的行。"""
+        return f"{self.url(i)} {self.description(i)}".strip()
+
+    def nbytes(self):
+        """各列的偏移量与数据所占字节数。"""
+        return sum(column.offsets.nbytes + column.data.nbytes
+                   for column in (self._column(name) for name in self.COLUMNS))
+
+
+class StringColumnWriter:
+    """
+    以追加方式流式写入 StringColumn，适合无法一次放进内存的大文件。
+    写入过程中数据保存在 <prefix>.bin.part 和 <prefix>.off.part（每行结束位置，原始int64），
+    finish() 时转换为 StringColumn 的正式文件。可以从已写入的前 rows 行继续写入。
+    """
+    def __init__(self, prefix, resume_rows=0):
+        data_path, offsets_path = StringColumn.paths(prefix)
+        self.data_path, self.offsets_path = data_path, offsets_path
+        self.data_part = data_path.with_name(data_path.name + '.part')
+        self.offsets_part = offsets_path.with_name(offsets_path.name + '.part')
+        end = 0
+        if resume_rows:
+            # 截掉上次检查点之后写入的内容
+            with open(self.offsets_part, 'r+b') as f:
+                f.truncate(resume_rows * 8)
+                f.seek((resume_rows - 1) * 8)
+                end = int(np.frombuffer(f.read(8), dtype='int64')[0])
+            with open(self.data_part, 'r+b') as f:
+                f.truncate(end)
+        else:
+            open(self.offsets_part, 'wb').close()
+            open(self.data_part, 'wb').close()
+        self.rows = resume_rows
+        self.end = end
+        self._data = open(self.data_part, 'ab')
+        self._offsets = open(self.offsets_part, 'ab')
+
+    def append(self, strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        ends = self.end + np.cumsum([len(b) for b in encoded], dtype='int64')
+        self._data.write(b''.join(encoded))
+        self._offsets.write(ends.tobytes())
+        self.rows += len(encoded)
+        if len(ends):
+            self.end = int(ends[-1])
+
+    def flush(self):
+        for f in (self._data, self._offsets):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def finish(self):
+        self._data.close()
+        self._offsets.close()
+        ends = np.fromfile(self.offsets_part, dtype='int64')
+        offsets = np.zeros(len(ends) + 1, dtype='int64')
+        offsets[1:] = ends
+        tmp_offsets = self.offsets_path.with_name(self.offsets_path.name + '.tmp')
+        with open(tmp_offsets, 'wb') as f:
+            np.save(f, offsets)
+        replace_atomically(self.data_part, self.data_path)
+        replace_atomically(tmp_offsets, self.offsets_path)
+        os.remove(self.offsets_part)
+
+
+class UrlStoreWriter:
+    """流式写入 UrlStore 的URL列和描述列，接口与 StringColumnWriter 相同。"""
+    def __init__(self, prefix, resume_rows=0):
+        self.writers = {name: StringColumnWriter(UrlStore.column_prefix(prefix, name), resume_rows)
+                        for name in UrlStore.COLUMNS}
+
+    def append(self, url_lines):
+        parsed = [UrlStore.parse_line(line) for line in url_lines]
+        self.writers['urls'].append(url for url, _ in parsed)
+        self.writers['desc'].append(desc for _, desc in parsed)
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+
+    def finish(self):
+        for writer in self.writers.values():
+            writer.finish()
@@ -2,28 +2,39 @@
 
 '''
 Brave Search是一个隐私保护的搜索引擎，提供API接口供开发者使用。官网 https://brave.com/search/api/
-采用langchain提供的接口工具来调用Brave Search，相关文档见 
-  https://python.langchain.com/docs/integrations/tools/brave_search/
-  https://python.langchain.com/api_reference/community/tools/langchain_community.tools.brave_search.tool.BraveSearch.html
+直接调用 Brave 的网页搜索接口，所有请求共用一个客户端（见 brave_client.py）：
+复用连接池，结果按 (query, country, search_lang, count, safesearch) 缓存，相同的并发请求只调用一次接口。
+设置环境变量 BRAVE_API_URL 可以指向本地的模拟服务（MockBrave.py）。
+上游请求经过限流器（rate_limit.py）：令牌桶、有界队列、429/5xx 退避重试和按月额度统计，
+失败时返回带错误类型和建议重试时间的JSON。
+响应直接解析为 WebResult 列表，工具输出为紧凑JSON，或只包含URL的纯文本（output="urls"）。
 
 '''
-import ast
-from langchain_community.tools import BraveSearch
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
 
 import os
 from dotenv import load_dotenv
 load_dotenv()
 BRAVE_API_KEY = str(os.getenv("BRAVE_API_KEY"))
 
+sys.path.append(str(Path(__file__).parent.parent))
+from Servers.brave_client import BRAVE_API_URL, flush_quotas, format_results, get_client
+from Servers.rate_limit import UpstreamLimitError
+
 from fastmcp import FastMCP
 mcp = FastMCP("web-search-server")
 
 @mcp.tool()
-def brave_search(query: str, 
+async def brave_search(query: str, 
                  country: str = "ALL",
                  search_lang: str = "en",
                  count: int = 3,
                  safesearch: str = "off",
+                 output: str = "json",
                 ) -> str:
     '''
     search queries through Brave Search API
@@ -34,40 +45,52 @@ def brave_search(query: str,
         search_lang: str, search language, default "en". For Chinese use "zh-hans" or "zh-hant".
         count: int, number of results to return, default 3
         safesearch: str, filters search results for adult content. Available value: "off", "moderate", "strict".
+        output: str, "json" for a compact JSON list of {"title", "link", "snippet"}; "urls" for one URL per line, use it when only links are needed.
     
     return:
-        response: str, search result or error message. Search result is string of a list of dicts, each dict contains a web page result.
+        response: str, search result, or a JSON error object {"error": {"type", "message", "retryable", "retry_after"}}.
+            Only retry when "retryable" is true, and wait "retry_after" seconds first.
     '''
     try:
-        response = search_query(
+        response = await search_query(
             query, 
             country=country,
             search_lang=search_lang,
             count=count,
             safesearch=safesearch,
+            output=output,
+            show_results=False,
         )
         return response
+    except UpstreamLimitError as e:
+        return json.dumps(e.to_dict(), ensure_ascii=False)
+    except ValueError as e:
+        return json.dumps({'error': {'type': 'invalid_argument', 'message': str(e), 'retryable': False,
+                                     'retry_after': None}}, ensure_ascii=False)
     except Exception as e:
-        return f"Error: {e}"
-
-
-def search_query(query, country="ALL", search_lang="en", count=3, safesearch="off", show_results=True):
-    params = {
-        "country": country,
-        "search_lang": search_lang,
-        "count": count,
-        "safesearch": safesearch,
-    }
-    tool = BraveSearch.from_api_key(
-        api_key=BRAVE_API_KEY, 
-        search_kwargs=params,
-    )
+        return json.dumps({'error': {'type': 'internal_error', 'message': f"{type(e).__name__}: {e}",
+                                     'retryable': False, 'retry_after': None}}, ensure_ascii=False)
+
 
-    response = tool.run(query)
-    response = response.encode('utf-8').decode('unicode_escape') # transform unicode to utf-8
+@mcp.tool()
+def stats_of_brave_search() -> str:
     '''
-    result format: string of a list of dicts
-    each dict contains:
+    Report result-cache hit rate, upstream call count and latency, how many concurrent identical requests were coalesced,
+    and rate-limiter metrics (queue wait, retries, 429s, rejections, monthly quota used).
+
+    return:
+        response: str, JSON object with the statistics.
+    '''
+    return json.dumps(get_client(BRAVE_API_KEY, BRAVE_API_URL).stats())
+
+
+async def search_query(query, country="ALL", search_lang="en", count=3, safesearch="off", output="json",
+                       show_results=True):
+    results = await get_client(BRAVE_API_KEY, BRAVE_API_URL).search(
+        query, country=country, search_lang=search_lang, count=count, safesearch=safesearch,
+    )
+    '''
+    results: list of WebResult, each contains:
         title: str, title of the result
         link: str, link to the result
         snippet: str, snippet of the result
@@ -75,28 +98,123 @@ def search_query(query, country="ALL", search_lang="en", count=3, safesearch="of
     
     if show_results:
         print("Brave Search Results:")
-        res_dicts = ast.literal_eval(response)
-        for i, res in enumerate(res_dicts):
+        for i, res in enumerate(results):
             print("-" * 80)
             print(f"Result {i+1}:")
-            print(f"Title: {res['title']}")
-            print(f"Link: {res['link']}")
-            print(f"Snippet: {res['snippet']}")
+            print(f"Title: {res.title}")
+            print(f"Link: {res.link}")
+            print(f"Snippet: {res.snippet}")
             print("-" * 80)
-    return response
+    return format_results(results, output)
+
+def shutdown():
+    '''serve.py 的工作进程退出前调用。工作进程不执行 atexit，在这里写入批量累积的额度增量。'''
+    flush_quotas()
 
 def test():
-    res = search_query("奥巴马生平", count=3, show_results=True)
+    res = asyncio.run(search_query("奥巴马生平", count=3, show_results=True))
     print(res)
     # zhres = res.encode().decode('unicode_escape')
     # print(zhres)
 
+def test_offline(concurrency=20):
+    '''
+    用本地模拟服务测试：并发的相同查询只调用一次上游接口，之后的查询命中缓存。
+    '''
+    from Servers.brave_client import BraveClient, TTLCache
+    from Servers.MockBrave import start_mock
+    from Servers.rate_limit import QuotaStore, UpstreamGovernor
+
+    server, url, counts = start_mock(latency_ms=50)
+    client = BraveClient("test-key", url, cache=TTLCache(),
+                         governor=UpstreamGovernor(rate=100, burst=10, quota=QuotaStore(path=None)))
+
+    async def run():
+        start = time.perf_counter()
+        first = await asyncio.gather(*(client.search("奥巴马生平") for _ in range(concurrency)))
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        second = await client.search("奥巴马生平")
+        warm = time.perf_counter() - start
+        await client.search("其他查询", count=5)
+        await client.aclose()
+        return first, second, cold, warm
+
+    try:
+        first, second, cold, warm = asyncio.run(run())
+    finally:
+        server.shutdown()
+    assert all(r == second for r in first) and len(second) == 3
+    assert counts['requests'] == 2, counts
+    assert client.coalesced == concurrency - 1
+    print(f"{concurrency} 个并发相同查询耗时 {cold * 1000:.1f} ms，缓存命中耗时 {warm * 1000:.3f} ms")
+    print(json.dumps(client.stats(), indent=2))
+    print("测试通过。")
+
+def benchmark(n_results=20, rounds=2000):
+    '''
+    对比旧的结果处理流程与当前流程的解析耗时和输出大小。
+    旧流程: 解析JSON -> json.dumps（非ASCII转义为\\u）-> unicode_escape 解码 -> ast.literal_eval 用于打印；
+    当前流程: 从原始字节解析为 WebResult -> 紧凑JSON或URL列表。
+    '''
+    import ast
+    from Servers.brave_client import parse_results
+    from Servers.MockBrave import mock_payload
+
+    body = json.dumps(mock_payload("奥巴马生平 Obama biography", n_results)).encode('utf-8')
+
+    def legacy():
+        items = json.loads(body.decode('utf-8'))['web']['results']
+        response = json.dumps([{'title': r['title'], 'link': r['url'], 'snippet': r['description']} for r in items])
+        response = response.encode('utf-8').decode('unicode_escape')
+        ast.literal_eval(response)
+        return response
+
+    def current(output):
+        return format_results(parse_results(body), output)
+
+    print(f"响应 {len(body)} 字节，{n_results} 条结果，每种流程运行 {rounds} 次")
+    for name, fn in [('legacy', legacy), ('json', lambda: current('json')), ('urls', lambda: current('urls'))]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            out = fn()
+        elapsed = (time.perf_counter() - start) / rounds * 1e6
+        print(f"{name:<7} {elapsed:>8.1f} us/次, 输出 {len(out):>6} 字符 / {len(out.encode('utf-8')):>6} 字节")
+
+def test_rate_limit(n_queries=20, upstream_rate=5):
+    '''
+    模拟服务每秒只接受 upstream_rate 个请求。限流器速率不超过上游时不应出现429；
+    速率过高时出现429，但经退避重试后所有查询仍然成功。
+    '''
+    from Servers.brave_client import BraveClient, TTLCache
+    from Servers.MockBrave import start_mock
+    from Servers.rate_limit import QuotaStore, UpstreamGovernor
+
+    for rate in (upstream_rate - 1, upstream_rate * 10):
+        server, url, counts = start_mock(rate_limit=upstream_rate)
+        client = BraveClient("test-key", url, cache=TTLCache(), governor=UpstreamGovernor(
+            rate=rate, burst=1, max_concurrency=8, max_retries=5, quota=QuotaStore(path=None, limit=1000)))
+
+        async def run():
+            results = await asyncio.gather(*(client.search(f"query {i}") for i in range(n_queries)))
+            await client.aclose()
+            return results
+
+        start = time.perf_counter()
+        try:
+            results = asyncio.run(run())
+        finally:
+            server.shutdown()
+        assert all(len(r) == 3 for r in results)
+        stats = client.governor.stats()
+        print(f"限流 {rate}/s: {n_queries} 个查询耗时 {time.perf_counter() - start:.2f}s，"
+              f"429 {counts['throttled']} 次，重试 {stats['retries']} 次，"
+              f"平均排队 {stats['avg_queue_wait_ms']:.0f} ms，额度已用 {stats['quota_used']}")
+        if rate < upstream_rate:
+            assert counts['throttled'] == 0, counts
+    print("测试通过。")
+
 if __name__ == "__main__":
-    # mcp.run(
-    #     transport="streamable-http",
-    #     host="127.0.0.1",
-    #     port=8888,
-    #     path="/mcp",
-    # )
+    # 多个agent应用共享一个常驻部署时，使用 streamable-HTTP 方式运行，见 serve.py
     mcp.run(transport="stdio")
     # test()
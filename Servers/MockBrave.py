@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+'''
+Brave Search 网页搜索接口的本地模拟服务，用于离线测试和压测，不消耗真实API额度。
+返回与真实接口结构相同的JSON（web.results 中包含 title / url / description），结果由查询内容确定。
+
+用法:
+    python Servers/MockBrave.py --port 8765 --latency-ms 50 --rate-limit 1
+    BRAVE_API_URL=http://127.0.0.1:8765/res/v1/web/search python Servers/BraveSearch.py
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import hashlib
+import json
+import threading
+import time
+
+SEARCH_PATH = '/res/v1/web/search'
+
+
+def mock_payload(query, count=3):
+    '''按查询生成确定的搜索结果。'''
+    digest = hashlib.md5(query.encode('utf-8')).hexdigest()[:8]
+    results = []
+    for i in range(count):
+        results.append({
+            'title': f"{query} - 结果 {i + 1}",
+            'url': f"https://example.com/{digest}/{i + 1}",
+            'description': f"关于 <strong>{query}</strong> 的第 {i + 1} 条模拟结果。",
+            'extra_snippets': [f"更多关于 {query} 的内容。"],
+        })
+    return {'type': 'search', 'query': {'original': query}, 'web': {'type': 'search', 'results': results}}
+
+
+class MockBraveHandler(BaseHTTPRequestHandler):
+    # 由 start_mock / main 设置
+    latency = 0.0
+    # 每秒允许的请求数，超过时返回429；0 表示不限制
+    rate_limit = 0
+    counts = None
+    window = None
+    lock = threading.Lock()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/stats':
+            self._send(200, dict(self.counts))  # type: ignore
+            return
+        if parts.path != SEARCH_PATH:
+            self._send(404, {'error': 'not found'})
+            return
+        with self.lock:
+            self.counts['requests'] += 1  # type: ignore
+            second = int(time.time())
+            if self.window[0] != second:  # type: ignore
+                self.window[:] = [second, 0]  # type: ignore
+            self.window[1] += 1  # type: ignore
+            limited = self.rate_limit and self.window[1] > self.rate_limit  # type: ignore
+            if limited:
+                self.counts['throttled'] += 1  # type: ignore
+        if limited:
+            self._send(429, {'error': 'rate limited'}, {'Retry-After': '1'})
+            return
+        if not self.headers.get('X-Subscription-Token'):
+            self._send(401, {'error': 'missing X-Subscription-Token'})
+            return
+        params = parse_qs(parts.query)
+        query = params.get('q', [''])[0]
+        count = int(params.get('count', ['3'])[0])
+        if self.latency:
+            time.sleep(self.latency)
+        self._send(200, mock_payload(query, count))
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_mock(port=0, latency_ms=0.0, rate_limit=0):
+    '''
+    在后台线程中启动模拟服务。
+    返回 (server, base_url, counts)，counts['requests'] 为收到的搜索请求数，counts['throttled'] 为返回429的次数；
+    用完后调用 server.shutdown()。
+    '''
+    counts = {'requests': 0, 'throttled': 0}
+    handler = type('Handler', (MockBraveHandler,), {
+        'latency': latency_ms / 1000, 'rate_limit': rate_limit, 'counts': counts, 'window': [0, 0],
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{SEARCH_PATH}", counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Brave Search 模拟服务")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=0, help="每秒允许的请求数，超过时返回429")
+    args = parser.parse_args()
+    server, url, _ = start_mock(args.port, args.latency_ms, args.rate_limit)
+    print(f"模拟服务已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
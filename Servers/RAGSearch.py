@@ -1,19 +1,136 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import json
+import asyncio
+import time
+import threading
+from pathlib import Path
 
 from fastmcp import FastMCP
 mcp = FastMCP("rag-search-server")
 
-sys.path.append('.')
-from RAG.retriever import load_urls_build_index_search
+sys.path.append(str(Path(__file__).parent.parent))
+from RAG.batcher import MicroBatcher
+from RAG.retriever import (
+    MODEL_NAME,
+    UrlRetriever,
+    index_file_for,
+    load_urls_build_index_search,
+)
+
+# 工具默认使用的URL文件，可通过环境变量指定其他文件
+DEFAULT_FILE = os.getenv("RAG_URLS_FILE", 'RAG/urls.txt')
+# 新加载的知识库默认使用的索引类型，见 RAG/index_factory.py
+DEFAULT_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "auto")
+
+
+class RetrieverRegistry:
+    '''
+    常驻内存的检索器注册表，按 (file_path, model_name) 缓存已加载的 UrlRetriever。
+    同一模型只加载一次并在多个URL文件间共享，重复查询只需要编码查询和一次FAISS搜索。
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        # register_model 指定的编码器，evict 时不释放
+        self._registered = {}
+        self._retrievers = {}
+        self._batchers = {}
+        # 批处理器单独加锁：在事件循环中获取批处理器时不能被正在加载索引的线程阻塞
+        self._batchers_lock = threading.Lock()
+
+    @staticmethod
+    def _key(file_path, model_name):
+        return (str(Path(file_path).resolve()), model_name)
+
+    def register_model(self, model_name, model):
+        '''
+        用 model 作为 model_name 的编码器（例如基准测试中不需要下载模型的替身），之后加载的检索器都使用它，
+        evict 后重新加载时也不会换回真实模型。需要在加载该模型的检索器之前调用。
+        '''
+        with self._lock:
+            self._registered[model_name] = model
+            self._models[model_name] = model
+
+    def _load(self, file_path, model_name, force_rebuild=False, index_type=DEFAULT_INDEX_TYPE, nlist=None):
+        model = self._models.get(model_name, self._registered.get(model_name))
+        retriever = UrlRetriever(model_name, model=model, index_path=index_file_for(file_path),
+                                 index_type=index_type, nlist=nlist)
+        self._models[model_name] = retriever.model
+        retriever.load(file_path, force_rebuild)
+        return retriever
+
+    def get(self, file_path=DEFAULT_FILE, model_name=MODEL_NAME):
+        '''返回已加载的检索器，不存在时加载并缓存。'''
+        key = self._key(file_path, model_name)
+        retriever = self._retrievers.get(key)
+        if retriever is not None:
+            return retriever
+        with self._lock:
+            if key not in self._retrievers:
+                self._retrievers[key] = self._load(file_path, model_name)
+            return self._retrievers[key]
+
+    def reload(self, file_path=DEFAULT_FILE, model_name=MODEL_NAME, force_rebuild=False, index_type=None, nlist=None):
+        '''
+        重新读取URL文件并加载索引。新检索器构建完成后才替换旧的，
+        正在使用旧检索器的查询不受影响。未指定 index_type / nlist 时沿用当前检索器的设置。
+        '''
+        key = self._key(file_path, model_name)
+        with self._lock:
+            current = self._retrievers.get(key)
+            if index_type is None:
+                index_type = current.index_type if current is not None else DEFAULT_INDEX_TYPE
+            if nlist is None and current is not None:
+                nlist = current.nlist
+            retriever = self._load(file_path, model_name, force_rebuild, index_type, nlist)
+            self._retrievers[key] = retriever
+            return retriever
+
+    def evict(self, file_path=DEFAULT_FILE, model_name=MODEL_NAME):
+        '''移除缓存的检索器，该模型不再被任何检索器使用时一并释放。'''
+        key = self._key(file_path, model_name)
+        with self._lock:
+            removed = self._retrievers.pop(key, None) is not None
+            if all(name != model_name for _, name in self._retrievers):
+                self._models.pop(model_name, None)
+            return removed
+
+    def batcher(self, file_path=DEFAULT_FILE, model_name=MODEL_NAME):
+        '''返回该知识库的查询微批处理器，并发的 search_in_RAG 调用通过它合并成批。'''
+        key = self._key(file_path, model_name)
+        with self._batchers_lock:
+            if key not in self._batchers:
+                self._batchers[key] = MicroBatcher(lambda: self.get(file_path, model_name))
+            return self._batchers[key]
+
+    def loaded(self):
+        return [{'file_path': path, 'model_name': name} for path, name in self._retrievers]
+
+    def stats(self):
+        '''返回已加载的检索器及其向量缓存的命中统计。'''
+        return [
+            {'file_path': key[0], 'vectors': retriever.index.ntotal if retriever.index is not None else 0,
+             'index_type': retriever.active_index_type, 'cache': retriever.cache.stats(),
+             'batcher': self._batchers[key].stats() if key in self._batchers else None}
+            for key, retriever in list(self._retrievers.items())
+        ]
+
+
+registry = RetrieverRegistry()
+
 
 @mcp.tool()
-def search_in_RAG(
+async def search_in_RAG(
     query: str,
-    file_path: str ='RAG/urls.txt',
+    file_path: str = DEFAULT_FILE,
     top_k: int = 3,
-    force_rebuild: bool = False
+    force_rebuild: bool = False,
+    nprobe: int = 0,
+    ef_search: int = 0,
+    details: bool = False,
 ) -> str:
     '''
     search relevant URLs from RAG index.
@@ -22,20 +139,105 @@ def search_in_RAG(
         file_path (str): Path to the file containing URLs.
         top_k (int): Number of top results to return, default is 3.
         force_rebuild (bool): If True, will ignore cache and rebuild index from scratch.
+        nprobe (int): Clusters visited by IVF indexes; higher is more accurate but slower. 0 uses the default.
+        ef_search (int): Search width of HNSW indexes. 0 uses the default.
+        details (bool): If True, return a JSON list of {"url", "description", "score"} objects instead.
     Returns:
         str: A string containing the top-k relevant URLs, joined by newline characters.
     '''
     try:
-        urls =  load_urls_build_index_search(
-            file_path=file_path,
-            query=query,
-            top_k=top_k,
-            force_rebuild=force_rebuild
+        if force_rebuild:
+            await asyncio.to_thread(registry.reload, file_path, force_rebuild=True)
+        # 并发到达的查询由微批处理器合并，在工作线程中一次编码、一次搜索
+        records = await registry.batcher(file_path).search(
+            query, top_k, nprobe=nprobe or None, ef_search=ef_search or None
         )
-        return '\n'.join(urls)
+        if details:
+            return json.dumps(records, ensure_ascii=False)
+        return '\n'.join(record['url'] for record in records)
     except Exception as e:
         return f"Error: {e}"
 
+@mcp.tool()
+async def search_in_RAG_batch(
+    queries: list[str],
+    file_path: str = DEFAULT_FILE,
+    top_k: int = 3,
+    fuse: bool = True,
+    nprobe: int = 0,
+    ef_search: int = 0,
+) -> str:
+    '''
+    search relevant URLs for several queries (e.g. reformulations of one question) in a single call.
+    Parameters:
+        queries (list[str]): The search queries.
+        file_path (str): Path to the file containing URLs.
+        top_k (int): Number of top results to return, default is 3.
+        fuse (bool): If True, merge all result lists with reciprocal-rank fusion into one top-k list.
+        nprobe (int): Clusters visited by IVF indexes. 0 uses the default.
+        ef_search (int): Search width of HNSW indexes. 0 uses the default.
+    Returns:
+        str: If fuse is True, the fused top-k URLs joined by newline characters.
+             Otherwise a JSON object mapping each query to its list of URLs.
+    '''
+    try:
+        # 加载检索器和搜索都在工作线程中进行，不阻塞事件循环上的其他请求
+        def run():
+            return registry.get(file_path).search_batch(queries, top_k, nprobe=nprobe or None,
+                                                        ef_search=ef_search or None, fuse=fuse)
+        results = await asyncio.to_thread(run)
+        if fuse:
+            return '\n'.join(results)
+        return json.dumps(dict(zip(queries, results)), ensure_ascii=False)
+    except Exception as e:
+        return f"Error: {e}"
+
+@mcp.tool()
+async def reload_RAG(
+    file_path: str = DEFAULT_FILE,
+    force_rebuild: bool = False,
+    index_type: str = '',
+    nlist: int = 0,
+) -> str:
+    '''
+    reload the URL file and its index into the resident retriever, e.g. after urls.txt was edited.
+    Parameters:
+        file_path (str): Path to the file containing URLs.
+        force_rebuild (bool): If True, will rebuild the index from scratch.
+        index_type (str): One of "auto", "flat", "ivf", "hnsw", "ivfpq", "opq". Empty keeps the current type.
+        nlist (int): Number of IVF clusters. 0 keeps the current value or picks one from the corpus size.
+    Returns:
+        str: A short status message.
+    '''
+    try:
+        retriever = await asyncio.to_thread(registry.reload, file_path, force_rebuild=force_rebuild,
+                                            index_type=index_type or None, nlist=nlist or None)
+        return f"Reloaded {file_path}: {retriever.index.ntotal} vectors, {retriever.active_index_type} index."  # type: ignore
+    except Exception as e:
+        return f"Error: {e}"
+
+@mcp.tool()
+def evict_RAG(file_path: str = DEFAULT_FILE) -> str:
+    '''
+    drop the resident retriever of a URL file to free memory. It is loaded again on the next search.
+    Parameters:
+        file_path (str): Path to the file containing URLs.
+    Returns:
+        str: A short status message.
+    '''
+    if registry.evict(file_path):
+        return f"Evicted {file_path}."
+    return f"{file_path} was not loaded."
+
+@mcp.tool()
+def stats_of_RAG() -> str:
+    '''
+    report the resident retrievers and their embedding cache hit/miss counters.
+    Returns:
+        str: A JSON string with one entry per loaded URL file.
+    '''
+    return json.dumps(registry.stats(), ensure_ascii=False)
+
 
 def test():
     res = load_urls_build_index_search(
@@ -48,12 +250,103 @@ def test():
     # zhres = res.encode().decode('unicode_escape')
     # print(zhres)
 
+def benchmark(query="where can I learn to code for free?", rounds=5):
+    '''对比每次调用都重新加载（旧路径）与常驻检索器的单次查询延迟。'''
+    cold = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        load_urls_build_index_search(file_path=DEFAULT_FILE, query=query, top_k=3)
+        cold.append(time.perf_counter() - start)
+
+    bench_registry = RetrieverRegistry()
+    start = time.perf_counter()
+    bench_registry.get(DEFAULT_FILE)
+    warmup = time.perf_counter() - start
+    warm = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        bench_registry.get(DEFAULT_FILE).search(query, 3)
+        warm.append(time.perf_counter() - start)
+
+    print(f"warm-up: {warmup * 1000:.1f} ms")
+    print(f"cold call: avg {sum(cold) / rounds * 1000:.1f} ms, min {min(cold) * 1000:.1f} ms")
+    print(f"warm call: avg {sum(warm) / rounds * 1000:.1f} ms, min {min(warm) * 1000:.1f} ms")
+
+def benchmark_batch(n_queries=32, rounds=3):
+    '''对比 n_queries 次单独搜索与一次批量搜索的吞吐量。每轮使用不同的查询，避免命中查询缓存。'''
+    retriever = registry.get(DEFAULT_FILE)
+    store = retriever.store
+    descriptions = [store.description(i) or store.url(i) for i in range(len(store))]
+    sequential, batched = [], []
+    for r in range(rounds):
+        queries = [f"{descriptions[i % len(descriptions)]} #{r}-{i}" for i in range(n_queries)]
+        start = time.perf_counter()
+        for query in queries:
+            retriever.search(query, 3)
+        sequential.append(time.perf_counter() - start)
+
+        queries = [f"{query} batch" for query in queries]
+        start = time.perf_counter()
+        retriever.search_batch(queries, 3)
+        batched.append(time.perf_counter() - start)
+
+    print(f"sequential: {n_queries * rounds / sum(sequential):.1f} queries/s")
+    print(f"batched:    {n_queries * rounds / sum(batched):.1f} queries/s")
+
+def benchmark_concurrency(clients=64, queries_per_client=4):
+    '''
+    模拟 clients 个并发调用方，对比每个请求单独在线程中搜索与经过微批处理器的吞吐量和延迟分位数。
+    '''
+    retriever = registry.get(DEFAULT_FILE)
+    store = retriever.store
+    descriptions = [store.description(i) or store.url(i) for i in range(len(store))]
+
+    async def run(mode):
+        latencies = []
+
+        async def client(c):
+            for i in range(queries_per_client):
+                # 每个查询都不同，避免命中查询缓存
+                query = f"{descriptions[(c + i) % len(descriptions)]} {mode} #{c}-{i}"
+                start = time.perf_counter()
+                if mode == 'batched':
+                    await registry.batcher(DEFAULT_FILE).search(query, 3)
+                else:
+                    await asyncio.to_thread(retriever.search, query, 3)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(c) for c in range(clients)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000
+        print(f"{mode:<10} {len(latencies) / elapsed:8.1f} queries/s  p50 {p50:.1f} ms  p95 {p95:.1f} ms")
+
+    print(f"{clients} concurrent clients x {queries_per_client} queries")
+    asyncio.run(run('unbatched'))
+    asyncio.run(run('batched'))
+    print(json.dumps(registry.batcher(DEFAULT_FILE).stats(), indent=2))
+
+def preload():
+    '''加载模型和默认知识库。HTTP 部署（serve.py）在 fork 工作进程之前调用，各工作进程共享加载好的模型和索引。'''
+    registry.get(DEFAULT_FILE)
+
+def warmup():
+    '''执行一次搜索，初始化编码和FAISS搜索的运行时状态，第一次工具调用不再承担这部分时间。'''
+    registry.get(DEFAULT_FILE).search("warmup", 1)
+
+def reload_index():
+    '''重新读取默认URL文件并加载索引，serve.py 收到 SIGHUP 时调用。'''
+    registry.reload(DEFAULT_FILE)
+
 if __name__ == "__main__":
-    # mcp.run(
-    #     transport="streamable-http",
-    #     host="127.0.0.1",
-    #     port=8888,
-    #     path="/mcp",
-    # )
+    # 启动时预热默认知识库，第一次工具调用不再承担模型和索引的加载时间
+    if os.getenv("RAG_WARMUP", "1") != "0":
+        preload()
+    # 多个agent应用共享一个常驻部署时，使用 streamable-HTTP 方式运行，见 serve.py
     mcp.run(transport="stdio")
     # test()
+    # benchmark()
+    # benchmark_batch()
+    # benchmark_concurrency()
@@ -0,0 +1,275 @@
+'''
+Brave Search API 的共享客户端：复用 httpx 连接池，对结果做 TTL + LRU 缓存（可保存到 SQLite），
+并把同时到达的相同请求合并为一次上游调用。API文档见 https://api-dashboard.search.brave.com/app/documentation/web-search
+'''
+from collections import OrderedDict
+from html import unescape
+from pathlib import Path
+from typing import NamedTuple
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+
+import httpx
+
+from Servers.rate_limit import UpstreamGovernor, UpstreamLimitError
+from tracing import span
+
+
+BRAVE_API_URL = os.getenv("BRAVE_API_URL", "https://api.search.brave.com/res/v1/web/search")
+# 结果缓存的有效期（秒）和最大条数
+CACHE_TTL = float(os.getenv("BRAVE_CACHE_TTL", "3600"))
+CACHE_SIZE = int(os.getenv("BRAVE_CACHE_SIZE", "1024"))
+# 缓存文件（SQLite），设为空字符串时不保存到磁盘
+CACHE_FILE = os.getenv("BRAVE_CACHE_FILE", str(Path(__file__).parent / 'brave_cache.sqlite'))
+TIMEOUT = float(os.getenv("BRAVE_TIMEOUT", "10"))
+MAX_CONNECTIONS = 20
+
+
+class TTLCache:
+    '''
+    带过期时间的LRU缓存。过期时间使用墙上时间。
+    指定 path 时同时保存在 SQLite 中：每次写入只插入一行，不再重写整个缓存文件；
+    内存中未命中时查找数据库，重启后或其他进程（例如 serve.py 的工作进程）写入的结果仍然有效。
+    '''
+    # 每写入多少次清理一次数据库中过期和超出容量的行
+    PRUNE_EVERY = 256
+
+    def __init__(self, ttl=CACHE_TTL, max_size=CACHE_SIZE, path=None, decode=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.path = Path(path) if path else None
+        # 从数据库读取时把JSON值还原为原来的类型
+        self.decode = decode or (lambda value: value)
+        self._entries = OrderedDict()  # key -> (过期时间, 值)
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._conn = None
+        if self.path is not None:
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+
+    @staticmethod
+    def _db_key(key):
+        return json.dumps(list(key), ensure_ascii=False)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self._conn is not None:
+            row = self._conn.execute("SELECT expires, value FROM results WHERE key = ?", (self._db_key(key),)).fetchone()
+            if row is not None and row[0] >= time.time():
+                entry = (row[0], self.decode(json.loads(row[1])))
+                self._remember(key, entry)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def put(self, key, value):
+        entry = (time.time() + self.ttl, value)
+        self._remember(key, entry)
+        if self._conn is None:
+            return
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                               (self._db_key(key), entry[0], json.dumps(value, ensure_ascii=False)))
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM results WHERE expires < ?", (time.time(),))
+                self._conn.execute("DELETE FROM results WHERE key NOT IN "
+                                   "(SELECT key FROM results ORDER BY expires DESC LIMIT ?)", (self.max_size,))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class WebResult(NamedTuple):
+    '''一条网页搜索结果。'''
+    title: str
+    link: str
+    snippet: str
+
+
+_TAG = re.compile(r'<[^>]+>')
+
+def clean_html(text):
+    '''去掉 Brave 在标题和摘要中用于高亮的HTML标签，并还原HTML实体。'''
+    return unescape(_TAG.sub('', text)) if '<' in text or '&' in text else text
+
+def parse_results(body):
+    '''
+    从 Brave 响应的原始字节中解析网页结果，只保留标题、链接和摘要（description 与 extra_snippets）。
+    '''
+    payload = json.loads(body)
+    results = []
+    for item in (payload.get('web') or {}).get('results', []):
+        snippet = ' '.join(filter(None, [item.get('description'), *item.get('extra_snippets', [])]))
+        results.append(WebResult(clean_html(item.get('title', '')), item.get('url', ''), clean_html(snippet)))
+    return results
+
+def decode_results(value):
+    return [WebResult(*item) for item in value]
+
+OUTPUT_FORMATS = ('json', 'urls')
+
+def format_results(results, output='json'):
+    '''
+    把结果转换为工具输出。
+    json: 紧凑的JSON数组，每个元素为 {"title", "link", "snippet"}，非ASCII字符不转义；
+    urls: 每行一个URL，只需要链接时可以大幅减少发送给模型的token。
+    '''
+    if output == 'urls':
+        return '\n'.join(r.link for r in results)
+    if output == 'json':
+        return json.dumps([{'title': r.title, 'link': r.link, 'snippet': r.snippet} for r in results],
+                          ensure_ascii=False, separators=(',', ':'))
+    raise ValueError(f"未知的输出格式 '{output}'，可选: {', '.join(OUTPUT_FORMATS)}")
+
+
+class BraveClient:
+    '''
+    Brave Search 异步客户端。同一进程内通过 get_client 共享，所有请求共用一个连接池。
+
+    参数:
+    api_key (str): Brave Search API密钥。
+    base_url (str): 网页搜索接口地址，测试时可指向本地的模拟服务（见 MockBrave.py）。
+    cache (TTLCache): 结果缓存，键为 (query, country, search_lang, count, safesearch)。
+    governor (UpstreamGovernor): 上游请求的限流、排队、重试和额度控制。
+    '''
+    def __init__(self, api_key, base_url=BRAVE_API_URL, cache=None, timeout=TIMEOUT, transport=None, governor=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache if cache is not None else TTLCache(path=CACHE_FILE or None, decode=decode_results)
+        self.governor = governor if governor is not None else UpstreamGovernor()
+        self.timeout = timeout
+        self.transport = transport
+        self._loop = None
+        self._client: "httpx.AsyncClient | None" = None
+        self._inflight = {}
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.coalesced = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _ensure_client(self):
+        '''httpx.AsyncClient 绑定创建它的事件循环，事件循环变化时重新创建。'''
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._inflight = {}
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+                timeout=httpx.Timeout(self.timeout),
+                headers={'Accept': 'application/json', 'X-Subscription-Token': self.api_key},
+                transport=self.transport,
+            )
+        return self._client
+
+    async def search(self, query, country="ALL", search_lang="en", count=3, safesearch="off"):
+        '''返回 WebResult 列表。相同参数的并发请求只调用一次上游接口。'''
+        key = (query, country, search_lang, count, safesearch)
+        with span('brave.search', count=count) as s:
+            results = self.cache.get(key)
+            s.set('cache_hit', results is not None)
+            if results is not None:
+                return results
+            client = self._ensure_client()
+            task = self._inflight.get(key)
+            s.set('coalesced', task is not None)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = asyncio.ensure_future(self._fetch(client, key))
+                self._inflight[key] = task
+                task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            # shield: 某个调用方被取消时不影响其他等待同一请求的调用方
+            return await asyncio.shield(task)
+
+    async def _fetch(self, client, key):
+        query, country, search_lang, count, safesearch = key
+        params = {'q': query, 'country': country, 'search_lang': search_lang,
+                  'count': count, 'safesearch': safesearch}
+        start = time.perf_counter()
+        self.upstream_calls += 1
+        with span('brave.upstream') as s:
+            retries = self.governor.retries
+            try:
+                response = await self.governor.call(lambda: client.get(self.base_url, params=params))
+            except UpstreamLimitError:
+                self.upstream_errors += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                self.latency_total += elapsed
+                self.latency_max = max(self.latency_max, elapsed)
+                s.set('retries', self.governor.retries - retries)
+            s.set('http.status_code', response.status_code)
+            s.set('payload.response_bytes', len(response.content))
+        results = parse_results(response.content)
+        self.cache.put(key, results)
+        return results
+
+    def stats(self):
+        '''缓存命中率、上游调用次数和延迟、合并的请求数。'''
+        return {
+            'cache': self.cache.stats(),
+            'upstream_calls': self.upstream_calls,
+            'upstream_errors': self.upstream_errors,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+            'avg_upstream_ms': self.latency_total / self.upstream_calls * 1000 if self.upstream_calls else 0.0,
+            'max_upstream_ms': self.latency_max * 1000,
+            'governor': self.governor.stats(),
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_clients = {}
+
+def get_client(api_key, base_url=BRAVE_API_URL):
+    '''返回 (api_key, base_url) 对应的共享客户端，不存在时创建。'''
+    key = (api_key, base_url)
+    if key not in _clients:
+        _clients[key] = BraveClient(api_key, base_url)
+    return _clients[key]
+
+def flush_quotas():
+    '''把各共享客户端尚未写入的额度增量写入数据库，没有创建过客户端时什么也不做。'''
+    for client in _clients.values():
+        client.governor.quota.flush()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+'''
+HTTP 部署（serve.py）的压力测试：多个并发 MCP 客户端各自建立会话，在指定时间内反复调用同一个部署的工具，
+统计吞吐量、延迟分位数和失败数。--reload-after 在测试中途向部署的主进程发送 SIGHUP，
+验证平滑重新加载期间没有失败的请求。
+
+用法:
+    python Servers/load_test.py --url http://127.0.0.1:8001/mcp --clients 32 --duration 30
+    # 自行启动部署（4个工作进程），第10秒重新加载，结束后停止
+    python Servers/load_test.py --spawn rag --workers 4 --clients 64 --duration 30 --reload-after 10
+    # 不需要下载模型的离线版本
+    RAG_EMBED_CACHE_DIR=/tmp/emb RAG_URLS_FILE=/tmp/urls.txt python Servers/load_test.py --spawn Bench.rag_server
+'''
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from fastmcp import Client
+
+sys.path.append(str(Path(__file__).parent.parent))
+from Bench.make_urls import make_queries
+from tracing import percentile
+
+# 各服务器默认压测的工具和参数，{query} 替换为查询
+DEFAULT_TOOLS = {
+    'search_in_RAG': {'query': '{query}', 'top_k': 3},
+    'brave_search': {'query': '{query}', 'output': 'urls'},
+}
+
+
+def wait_ready(base_url, timeout=180.0, process=None):
+    '''轮询 /ready 直到返回200。'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"部署进程已退出，返回码 {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/ready", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{base_url} 在 {timeout}s 内未就绪")
+
+def spawn_deployment(server, port, workers):
+    command = [sys.executable, str(Path(__file__).parent / 'serve.py'), server, '--port', str(port),
+               '--workers', str(workers)]
+    process = subprocess.Popen(command)
+    wait_ready(f"http://127.0.0.1:{port}", process=process)
+    return process
+
+async def run_load(url, tool, arguments, clients, duration, reload_after=None, reload_pid=None):
+    queries = make_queries(max(clients * 50, 1000))
+    latencies, errors = [], []
+    counter = iter(range(10**9))
+    deadline = time.monotonic() + duration
+
+    async def client_loop(c):
+        async with Client(url) as client:
+            while time.monotonic() < deadline:
+                query = queries[next(counter) % len(queries)]
+                args = {k: v.format(query=query) if isinstance(v, str) else v for k, v in arguments.items()}
+                start = time.perf_counter()
+                try:
+                    await client.call_tool(tool, args)
+                    latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+
+    async def reloader():
+        await asyncio.sleep(reload_after)
+        print(f"第 {reload_after}s: 向 {reload_pid} 发送 SIGHUP")
+        os.kill(reload_pid, signal.SIGHUP)
+
+    tasks = [client_loop(c) for c in range(clients)]
+    if reload_after is not None and reload_pid is not None:
+        tasks.append(reloader())
+    start = time.perf_counter()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    # 建立会话失败的客户端也计为错误
+    errors += [f"{type(r).__name__}: {r}" for r in results if isinstance(r, BaseException)]
+    values = sorted(s * 1000 for s in latencies)
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(values, 0.5),
+        'p95_ms': percentile(values, 0.95),
+        'p99_ms': percentile(values, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP 部署的压力测试")
+    parser.add_argument('--url', default=None, help="MCP 地址，例如 http://127.0.0.1:8001/mcp")
+    parser.add_argument('--spawn', default=None, help="自行启动部署：rag / brave 或服务器模块名")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tool', default=None, help="要调用的工具，默认按服务器选择")
+    parser.add_argument('--arguments', default=None, help="工具参数（JSON），字符串中的 {query} 替换为查询")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--reload-after', type=float, default=None, help="第几秒发送 SIGHUP")
+    parser.add_argument('--reload-pid', type=int, default=None, help="部署主进程的pid，--spawn 时自动设置")
+    args = parser.parse_args()
+
+    tool = args.tool or ('brave_search' if args.spawn == 'brave' else 'search_in_RAG')
+    arguments = json.loads(args.arguments) if args.arguments else DEFAULT_TOOLS.get(tool, {'query': '{query}'})
+    process = None
+    if args.spawn:
+        process = spawn_deployment(args.spawn, args.port, args.workers)
+        url = f"http://127.0.0.1:{args.port}/mcp"
+        reload_pid = process.pid
+    else:
+        url = args.url or f"http://127.0.0.1:{args.port}/mcp"
+        wait_ready(url.rsplit('/', 1)[0])
+        reload_pid = args.reload_pid
+    try:
+        report = asyncio.run(run_load(url, tool, arguments, args.clients, args.duration,
+                                      args.reload_after, reload_pid))
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+    print(f"{report['clients']} 个客户端，{report['seconds']:.1f}s: {report['requests']} 个请求，"
+          f"失败 {report['errors']} 个，{report['requests_per_second']:.1f} 请求/s，"
+          f"p50 {report['p50_ms']:.1f} ms，p95 {report['p95_ms']:.1f} ms，p99 {report['p99_ms']:.1f} ms")
+    for sample in report['error_samples']:
+        print(f"  {sample}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
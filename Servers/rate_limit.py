@@ -0,0 +1,274 @@
+'''
+上游接口的限流与并发控制：令牌桶限制每秒请求数，有界队列限制等待中的请求数，
+429 / 5xx 响应和网络错误按带抖动的指数退避重试，按月的调用额度保存在 SQLite 中，重启后继续累计，多个进程共用。
+'''
+from pathlib import Path
+import asyncio
+import atexit
+import os
+import random
+import sqlite3
+import time
+
+import httpx
+
+
+# --- 默认参数，可通过环境变量调整 ---
+# Brave 免费套餐为每秒1次、每月2000次
+RATE = float(os.getenv("BRAVE_RATE", "1"))
+BURST = int(os.getenv("BRAVE_BURST", "1"))
+MAX_CONCURRENCY = int(os.getenv("BRAVE_MAX_CONCURRENCY", "4"))
+MAX_QUEUE = int(os.getenv("BRAVE_MAX_QUEUE", "100"))
+MAX_RETRIES = int(os.getenv("BRAVE_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# 每月调用额度，0 表示不限制
+MONTHLY_QUOTA = int(os.getenv("BRAVE_MONTHLY_QUOTA", "0"))
+# 额度计数文件（SQLite），多个进程共用；设为空字符串时只在内存中计数
+QUOTA_FILE = os.getenv("BRAVE_QUOTA_FILE", str(Path(__file__).parent / 'brave_quota.sqlite'))
+# 额度计数最多每隔多少秒写入磁盘并读回其他进程的计数，进程退出时写入剩余的计数
+QUOTA_SAVE_INTERVAL = float(os.getenv("BRAVE_QUOTA_SAVE_INTERVAL", "5"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamLimitError(RuntimeError):
+    '''
+    请求未能完成。kind 为 'queue_full'、'quota_exhausted'、'rate_limited' 或 'upstream_error'，
+    retry_after 为建议的重试等待秒数（None 表示重试没有意义）。
+    '''
+    def __init__(self, kind, message, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {'error': {'type': self.kind, 'message': str(self), 'retryable': self.retry_after is not None,
+                          'retry_after': self.retry_after}}
+
+
+class TokenBucket:
+    '''令牌桶：平均每秒 rate 个令牌，最多积累 burst 个。'''
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self):
+        '''取一个令牌，不足时等待；按先来先得的顺序发放。'''
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class QuotaStore:
+    '''
+    按自然月累计的调用次数，保存在 SQLite 中，多个进程（例如 serve.py 的工作进程）共用同一个计数。
+    各进程在内存中累计增量，最多每隔 save_interval 秒把增量原子地加到数据库中并读回所有进程的合计，
+    进程退出时写入剩余的增量。limit 为 0 时只计数不限制。
+    '''
+    def __init__(self, path=QUOTA_FILE, limit=MONTHLY_QUOTA, save_interval=QUOTA_SAVE_INTERVAL):
+        self.path = Path(path) if path else None
+        self.limit = limit
+        self.save_interval = save_interval
+        self.month = time.strftime('%Y-%m')
+        # 本进程所知的本月合计，包括尚未写入的增量
+        self.used = 0
+        self._pending = 0
+        # 上游返回的剩余额度推算出的已用次数
+        self._observed = 0
+        self._saved_at = time.monotonic()
+        self._conn = None
+        if self.path is not None:
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS quota (month TEXT PRIMARY KEY, used INTEGER)")
+            self.flush()
+            atexit.register(self.flush)
+
+    def _roll(self):
+        month = time.strftime('%Y-%m')
+        if month != self.month:
+            self.flush()
+            self.month, self.used, self._observed = month, 0, 0
+
+    def remaining(self):
+        self._roll()
+        return None if not self.limit else max(0, self.limit - self.used)
+
+    def check(self):
+        '''额度已用完时抛出 UpstreamLimitError。'''
+        if self.remaining() == 0:
+            raise UpstreamLimitError('quota_exhausted', f"本月额度 {self.limit} 次已用完。")
+
+    def consume(self):
+        '''记录一次被上游接受的调用。'''
+        self._roll()
+        self.used += 1
+        self._pending += 1
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self.flush()
+
+    def observe_remaining(self, remaining):
+        '''用上游返回的剩余额度校正本地计数（例如同一密钥在其他机器上也有调用）。'''
+        if self.limit and self.limit - remaining > self.used:
+            self.used = self._observed = self.limit - remaining
+
+    def flush(self):
+        '''把未写入的增量加到数据库中，并读回所有进程合计的本月次数。'''
+        self._saved_at = time.monotonic()
+        if self._conn is None:
+            self._pending = 0
+            return
+        try:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO quota VALUES (?, 0)", (self.month,))
+                self._conn.execute("UPDATE quota SET used = MAX(used + ?, ?) WHERE month = ?",
+                                   (self._pending, self._observed, self.month))
+                total = self._conn.execute("SELECT used FROM quota WHERE month = ?", (self.month,)).fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"无法写入额度文件 {self.path}: {e}")
+            return
+        self._pending = 0
+        self.used = total
+
+
+def retry_after_seconds(response):
+    '''读取 Retry-After 或 X-RateLimit-Reset（Brave 为逗号分隔的多个窗口，取第一个），没有时返回None。'''
+    for header in ('retry-after', 'x-ratelimit-reset'):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value.split(',')[0])
+            except ValueError:
+                pass
+    return None
+
+
+class UpstreamGovernor:
+    '''
+    所有上游请求都经过 call()：先在有界队列中等待并发名额和令牌，再检查月度额度，
+    失败时按带抖动的指数退避重试，超过重试次数后抛出 UpstreamLimitError。
+    '''
+    def __init__(self, rate=RATE, burst=BURST, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE,
+                 max_retries=MAX_RETRIES, quota=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.quota = quota if quota is not None else QuotaStore()
+        self._loop = None
+        self._slots = None
+        self.waiting = 0
+        self.admitted = 0
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _ensure_slots(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self.bucket._lock = None
+        return self._slots
+
+    async def call(self, send):
+        '''
+        参数:
+        send (callable): 无参数的协程函数，发送一次请求并返回 httpx.Response。
+        返回:
+        状态码为 2xx 的 httpx.Response。
+        '''
+        slots = self._ensure_slots()
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise UpstreamLimitError('queue_full', f"等待中的搜索请求已达上限（{self.max_queue}）。",
+                                     retry_after=self.waiting / self.bucket.rate)
+        self.waiting += 1
+        queued = True
+        start = time.perf_counter()
+        try:
+            async with slots:  # type: ignore
+                await self.bucket.acquire()
+                self.waiting -= 1
+                queued = False
+                waited = time.perf_counter() - start
+                self.admitted += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                return await self._send_with_retries(send)
+        finally:
+            if queued:
+                self.waiting -= 1
+
+    async def _send_with_retries(self, send):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await self.bucket.acquire()
+            self.quota.check()
+            self.requests += 1
+            retry_after = None
+            try:
+                response = await send()
+            except httpx.TransportError as e:
+                error = UpstreamLimitError('upstream_error', f"{type(e).__name__}: {e}", retry_after=BACKOFF_BASE)
+            else:
+                # 被限流（429）的请求不计入月度额度
+                if response.status_code != 429:
+                    self.quota.consume()
+                remaining = response.headers.get('x-ratelimit-remaining')
+                if remaining and ',' in remaining:
+                    self.quota.observe_remaining(int(remaining.split(',')[-1]))
+                if response.status_code < 400:
+                    return response
+                retry_after = retry_after_seconds(response)
+                if response.status_code == 429:
+                    self.throttled += 1
+                    error = UpstreamLimitError('rate_limited', "上游接口限流（429）。", retry_after=retry_after or 1.0)
+                elif response.status_code in RETRY_STATUS:
+                    error = UpstreamLimitError('upstream_error', f"上游接口错误（{response.status_code}）。",
+                                               retry_after=retry_after or BACKOFF_BASE)
+                else:
+                    self.failures += 1
+                    raise UpstreamLimitError('upstream_error', f"上游接口返回 {response.status_code}。")
+            if attempt == self.max_retries:
+                break
+            self.retries += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(max(delay, retry_after or 0))
+        self.failures += 1
+        raise error  # type: ignore
+
+    def stats(self):
+        '''排队、重试、拒绝和额度等统计。'''
+        return {
+            'rate_per_s': self.bucket.rate,
+            'queue_depth': self.waiting,
+            'max_queue': self.max_queue,
+            'avg_queue_wait_ms': self.wait_total / self.admitted * 1000 if self.admitted else 0.0,
+            'max_queue_wait_ms': self.wait_max * 1000,
+            'requests': self.requests,
+            'retries': self.retries,
+            'throttled_429': self.throttled,
+            'rejected': self.rejected,
+            'failures': self.failures,
+            'quota_month': self.quota.month,
+            'quota_used': self.quota.used,
+            'quota_remaining': self.quota.remaining(),
+        }
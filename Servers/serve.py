@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+'''
+以 streamable-HTTP 方式常驻运行知识库或 Brave 搜索 MCP 服务器，供多个agent应用共享一个部署，
+不再由每个agent应用各自启动一个解释器和一份模型。
+
+主进程导入服务器模块并预加载（知识库加载模型和索引），然后监听端口并 fork 出多个工作进程。
+工作进程共用同一个监听套接字，由内核分配连接；预加载的模型权重在 fork 后以写时复制的方式共享，
+以 RAG_STORAGE=mmap 打开的索引和URL表通过操作系统页缓存共享。MCP 使用无状态模式（stateless_http），
+同一客户端的各个请求可以由不同的工作进程处理。
+
+路由:
+    /mcp     MCP streamable-HTTP 接口
+    /health  存活检查，进程在运行即返回200
+    /ready   就绪检查，工作进程完成预热且没有在退出时返回200，否则返回503
+
+信号（发给主进程）:
+    SIGHUP            平滑重新加载：主进程重新加载索引，启动新一代工作进程并等待其就绪，
+                      然后通知旧工作进程停止接受新连接、处理完已有请求后退出，期间服务不中断。
+    SIGTERM / SIGINT  停止：所有工作进程处理完已有请求后退出。
+
+服务器模块需要提供 mcp（FastMCP 实例），可选提供 preload()（主进程中调用）、warmup()（每个工作进程中调用）、
+shutdown()（每个工作进程退出前调用）和 reload_index()（SIGHUP 时在主进程中调用）。
+
+用法:
+    RAG_STORAGE=mmap python Servers/serve.py rag --port 8001 --workers 4
+    python Servers/serve.py brave --port 8002 --workers 2
+    kill -HUP <主进程pid>
+没有 fork 的平台（Windows）上以单进程运行，不支持 SIGHUP。
+'''
+from pathlib import Path
+import argparse
+import importlib
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+SERVERS = {'rag': 'Servers.RAGSearch', 'brave': 'Servers.BraveSearch'}
+# 按进程生效的设置，多个工作进程时按工作进程数平分，总量不变：上游限流（见 rate_limit.py）和推理线程数。
+# 这些变量在导入服务器模块时读取，serve.py 只能在导入之前平分，因此不区分服务器模块（包装其他服务器的模块，
+# 例如 Bench.rag_server，同样适用），所服务的模块不使用的变量没有影响。
+# Brave 的月度额度和结果缓存保存在 SQLite 中，由所有工作进程共用，不需要平分
+PER_WORKER_ENV = {
+    'BRAVE_RATE': ('1', float), 'BRAVE_BURST': ('1', int), 'BRAVE_MAX_CONCURRENCY': ('4', int),
+    # ONNX 编码后端的推理线程数（见 RAG/embedder.py），各工作进程平分CPU核心
+    'RAG_ONNX_THREADS': (str(os.cpu_count() or 1), int),
+}
+MCP_PATH = '/mcp'
+# 收到停止信号后等待已有请求完成的最长时间（秒）
+GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+# 新工作进程完成预热的最长等待时间（秒）
+READY_TIMEOUT = float(os.getenv("SERVE_READY_TIMEOUT", "120"))
+
+# 当前进程的状态，由 /ready 返回
+_state = {'ready': False, 'draining': False, 'generation': 0}
+
+
+def add_health_routes(mcp):
+    from starlette.responses import JSONResponse
+
+    @mcp.custom_route('/health', methods=['GET'])
+    async def health(request):
+        return JSONResponse({'status': 'ok', 'pid': os.getpid()})
+
+    @mcp.custom_route('/ready', methods=['GET'])
+    async def ready(request):
+        ok = _state['ready'] and not _state['draining']
+        return JSONResponse({'ready': ok, 'pid': os.getpid(), 'generation': _state['generation']},
+                            status_code=200 if ok else 503)
+
+def split_per_worker(workers):
+    '''在导入服务器模块之前，按工作进程数平分按进程生效的设置（PER_WORKER_ENV）。'''
+    for name, (default, cast) in PER_WORKER_ENV.items():
+        total = cast(os.getenv(name, default))
+        os.environ[name] = str(max(cast(total / workers), cast(1)) if cast is int else total / workers)
+
+def bind(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+# --- 工作进程 ---
+
+def run_worker(module, sock, workers, ready_fd=None):
+    '''在当前进程中运行 uvicorn，直到收到 SIGTERM / SIGINT 并处理完已有请求。'''
+    import uvicorn
+
+    torch = sys.modules.get('torch')
+    if torch is not None and workers > 1:
+        # 各工作进程平分CPU核心，避免推理线程数超过核心数
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    warmup = getattr(module, 'warmup', None)
+    if warmup is not None:
+        warmup()
+    _state['ready'] = True
+    # 工作进程以 os._exit 退出，不执行 atexit，需要保存的状态由 shutdown() 写入
+    shutdown = getattr(module, 'shutdown', None)
+
+    class WorkerServer(uvicorn.Server):
+        async def startup(self, sockets=None):
+            await super().startup(sockets)
+            if ready_fd is not None and not self.should_exit:
+                os.write(ready_fd, b'1')
+                os.close(ready_fd)
+
+        def handle_exit(self, sig, frame):
+            # 退出期间 /ready 返回503，负载均衡不再分配新请求
+            _state['draining'] = True
+            super().handle_exit(sig, frame)
+
+    app = module.mcp.http_app(path=MCP_PATH, stateless_http=True)
+    config = uvicorn.Config(app, lifespan='on', log_level=os.getenv("SERVE_LOG_LEVEL", "warning"),
+                            timeout_graceful_shutdown=int(GRACEFUL_TIMEOUT))
+    try:
+        WorkerServer(config).run(sockets=[sock])
+    finally:
+        if shutdown is not None:
+            shutdown()
+
+
+# --- 主进程 ---
+
+class Supervisor:
+    '''管理工作进程：启动、异常退出时补齐、SIGHUP 时滚动替换、停止时等待全部退出。'''
+    def __init__(self, module, sock, workers):
+        self.module = module
+        self.sock = sock
+        self.workers = workers
+        self.generation = 0
+        self.children = {}  # pid -> generation
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def spawn(self):
+        '''fork 一个当前代的工作进程，返回 (pid, 读取就绪通知的管道)。'''
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            # SIGTERM / SIGINT 由 uvicorn 处理；SIGHUP 只对主进程有意义，发给整个进程组时工作进程忽略
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+                signal.signal(sig, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            _state['generation'] = self.generation
+            # 预加载时打开的向量缓存随 fork 继承；工作进程拿不到缓存的写锁，只读取已有的行，
+            # 新的查询向量保存在各自的内存LRU中（见 RAG/embed_cache.py）
+            code = 0
+            try:
+                run_worker(self.module, self.sock, self.workers, write_fd)
+            except BaseException as e:
+                print(f"工作进程 {os.getpid()} 异常退出: {type(e).__name__}: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        self.children[pid] = self.generation
+        return pid, read_fd
+
+    def start_generation(self):
+        '''启动新一代的全部工作进程并等待它们就绪，返回是否全部就绪；有进程未就绪时终止这一代的全部进程。'''
+        self.generation += 1
+        pending = dict(self.spawn() for _ in range(self.workers))
+        deadline = time.monotonic() + READY_TIMEOUT
+        ready = set()
+        fds = {fd: pid for pid, fd in pending.items()}
+        while fds and time.monotonic() < deadline:
+            readable, _, _ = select.select(list(fds), [], [], 0.5)
+            for fd in readable:
+                if os.read(fd, 1):
+                    ready.add(fds[fd])
+                os.close(fd)
+                del fds[fd]
+        for fd in fds:
+            os.close(fd)
+        if len(ready) == len(pending):
+            return True
+        # 这一代作废：全部终止，且退出后不再补齐
+        for pid in pending:
+            self.children[pid] = -1
+            self._signal(pid, signal.SIGKILL)
+        self.generation -= 1
+        return False
+
+    def _signal(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        '''回收已退出的工作进程，当前代的进程异常退出时补齐。'''
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self.stop_requested:
+                print(f"工作进程 {pid} 退出（状态 {status}），重新启动。", file=sys.stderr)
+                _, fd = self.spawn()
+                os.close(fd)
+
+    def reload(self):
+        '''重新加载索引后滚动替换工作进程。新一代未能就绪时保留旧工作进程继续服务。'''
+        print("收到 SIGHUP，重新加载...")
+        start = time.perf_counter()
+        reload_index = getattr(self.module, 'reload_index', None)
+        try:
+            if reload_index is not None:
+                reload_index()
+        except Exception as e:
+            print(f"重新加载失败，继续使用当前工作进程: {type(e).__name__}: {e}", file=sys.stderr)
+            return
+        old = [pid for pid, generation in self.children.items() if generation == self.generation]
+        if not self.start_generation():
+            print("新工作进程未能就绪，继续使用当前工作进程。", file=sys.stderr)
+            return
+        for pid in old:
+            self._signal(pid, signal.SIGTERM)
+        print(f"重新加载完成（第 {self.generation} 代），耗时 {time.perf_counter() - start:.1f}s，"
+              f"{len(old)} 个旧工作进程正在处理剩余请求后退出。")
+
+    def stop(self):
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGKILL)
+        while self.children:
+            self.reap()
+            time.sleep(0.05)
+
+    def run(self):
+        def on_reload(sig, frame):
+            self.reload_requested = True
+
+        def on_stop(sig, frame):
+            self.stop_requested = True
+
+        signal.signal(signal.SIGHUP, on_reload)
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        if not self.start_generation():
+            self.stop()
+            sys.exit("工作进程未能就绪。")
+        print(f"已启动 {self.workers} 个工作进程，主进程 pid {os.getpid()}。")
+        while not self.stop_requested:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap()
+            time.sleep(0.2)
+        print("正在停止...")
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以 streamable-HTTP 方式常驻运行 MCP 服务器")
+    parser.add_argument('server', help=f"{' / '.join(SERVERS)}，或服务器模块名（例如 Bench.rag_server）")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--workers', type=int, default=int(os.getenv("SERVE_WORKERS", "2")))
+    args = parser.parse_args()
+
+    module_name = SERVERS.get(args.server, args.server)
+    workers = args.workers if hasattr(os, 'fork') else 1
+    split_per_worker(workers)
+    module = importlib.import_module(module_name)
+    add_health_routes(module.mcp)
+    preload = getattr(module, 'preload', None)
+    if preload is not None:
+        start = time.perf_counter()
+        preload()
+        print(f"预加载完成，耗时 {time.perf_counter() - start:.1f}s。")
+    sock = bind(args.host, args.port)
+    print(f"MCP 服务地址: http://{args.host}:{args.port}{MCP_PATH}")
+    if not hasattr(os, 'fork'):
+        run_worker(module, sock, 1)
+        return
+    Supervisor(module, sock, workers).run()
+
+
+if __name__ == '__main__':
+    main()
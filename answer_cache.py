@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+'''
+语义答案缓存：放在完整的搜索-总结流程之前。查询用与知识库相同的模型和编码后端编码（RAG/embedder.py，
+RAG_EMBED_BACKEND=onnx-int8 时客户端进程也不导入 PyTorch），
+与之前回答过的查询的余弦相似度不低于阈值时直接返回之前的答案，不再调用搜索、抓取和总结。
+
+每条答案记录它用到的来源（web: 联网搜索，rag: 知识库），有效期取各来源有效期中最短的：
+网页搜索结果变化快，知识库的结果只在知识库更新时变化。
+答案保存在 SQLite 中（向量以 float32 字节保存），条目数超过上限时淘汰最久未命中的条目；
+启动时把未过期的向量载入内存矩阵，查找只需要一次矩阵乘法。
+
+环境变量:
+    ANSWER_CACHE=0                关闭缓存
+    ANSWER_CACHE_FILE             缓存文件，默认 answer_cache.sqlite
+    ANSWER_CACHE_THRESHOLD        余弦相似度阈值，默认 0.9
+    ANSWER_CACHE_MAX_ENTRIES      最多保存的答案数，默认 10000
+    ANSWER_CACHE_TTL_WEB / _RAG   各来源的有效期（秒），默认 6 小时 / 7 天
+'''
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent))
+from tracing import span
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") != "0"
+CACHE_FILE = Path(os.getenv("ANSWER_CACHE_FILE", Path(__file__).parent / 'answer_cache.sqlite'))
+THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+# 各来源答案的有效期（秒）
+SOURCE_TTL = {
+    'web': float(os.getenv("ANSWER_CACHE_TTL_WEB", str(6 * 3600))),
+    'rag': float(os.getenv("ANSWER_CACHE_TTL_RAG", str(7 * 24 * 3600))),
+}
+
+# 当前查询用到的来源，由 record_source 在工具调用时写入
+_sources: ContextVar["set | None"] = ContextVar('answer_sources', default=None)
+
+
+@contextmanager
+def collect_sources():
+    '''在 with 块中执行一个查询，结束后返回的集合包含查询期间 record_source 记录的来源。'''
+    sources = set()
+    token = _sources.set(sources)
+    try:
+        yield sources
+    finally:
+        _sources.reset(token)
+
+def record_source(source):
+    sources = _sources.get()
+    if sources is not None and source:
+        sources.add(source)
+
+def ttl_for(sources):
+    '''答案的有效期取各来源中最短的；来源未知时按网页搜索处理。'''
+    return min((SOURCE_TTL.get(s, SOURCE_TTL['web']) for s in sources), default=SOURCE_TTL['web'])
+
+
+class AnswerCache:
+    '''
+    按查询向量匹配的答案缓存，同一进程内通过 get_answer_cache 共享。
+
+    参数:
+    path (str | Path): SQLite 文件路径。
+    model_name (str): 编码查询的模型名称，默认与知识库相同（RAG/retriever.py 的 MODEL_NAME）。
+    encode (callable): 接收文本列表、返回向量矩阵的函数，默认用 RAG.embedder.load_embedder 按 RAG_EMBED_BACKEND 加载。
+    threshold (float): 余弦相似度阈值。
+    max_entries (int): 最多保存的答案数。
+    '''
+    def __init__(self, path=CACHE_FILE, model_name=None, encode=None, threshold=THRESHOLD, max_entries=MAX_ENTRIES):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._encode = encode
+        # 可重入：查找和写入在持有锁时还会读写数据库，并行的 to_thread 调用不会看到不一致的向量矩阵
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY, model TEXT, query TEXT, embedding BLOB, answer BLOB, context BLOB, "
+                "sources TEXT, seconds REAL, created_at REAL, expires_at REAL, last_hit REAL, hits INTEGER)"
+            )
+        # 内存中的向量矩阵，行与 self._ids 一一对应
+        self._ids = []
+        self._expires = np.empty(0, dtype='float64')
+        self._matrix = None
+        self._loaded = False
+        self.lookups = 0
+        self.hits = 0
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+    def _ensure_encoder(self):
+        if self._encode is not None:
+            return
+        # 与知识库共用模型、编码后端（RAG_EMBED_BACKEND）和查询向量缓存，模型只在第一次查找时加载
+        from RAG.embed_cache import get_embedding_cache
+        from RAG.embedder import EMBED_BACKEND, embedder_name, load_embedder
+        from RAG.retriever import MODEL_NAME
+        model_name = self.model_name or MODEL_NAME
+        print(f"答案缓存: 正在加载 Sentence Transformer 模型（{EMBED_BACKEND}）...")
+        with span('answer_cache.load_model', model=model_name, backend=EMBED_BACKEND):
+            model = load_embedder(model_name, EMBED_BACKEND)
+        # 不同后端的向量不能互相比较，保存的答案按包含后端的名称区分
+        self.model_name = embedder_name(model_name, EMBED_BACKEND)
+        cache = get_embedding_cache(self.model_name)
+        self._encode = lambda texts: cache.encode(texts, model.encode, is_query=True)
+
+    def _embed(self, query):
+        self._ensure_encoder()
+        vector = np.asarray(self._encode([query]), dtype='float32')[0]  # type: ignore
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _load(self):
+        '''载入当前模型未过期的向量，过期的条目直接删除。'''
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+            rows = self._conn.execute(
+                "SELECT id, embedding, expires_at FROM answers WHERE model = ?", (self.model_name,)
+            ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._expires = np.array([row[2] for row in rows], dtype='float64')
+        self._matrix = np.stack([np.frombuffer(row[1], dtype='float32') for row in rows]) if rows else None
+        self._loaded = True
+
+    def lookup(self, query):
+        '''
+        返回最相似且未过期的答案 {'answer', 'context', 'matched_query', 'similarity', 'sources', 'cached'}，
+        相似度低于阈值时返回None。
+        '''
+        start = time.perf_counter()
+        with span('answer_cache.lookup') as s:
+            vector = self._embed(query)
+            hit = None
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                self.lookups += 1
+                if self._matrix is not None:
+                    scores = self._matrix @ vector
+                    # 过期的条目不参与匹配，淘汰时再删除
+                    scores[self._expires <= time.time()] = -1.0
+                    best = int(np.argmax(scores))
+                    similarity = float(scores[best])
+                    s.set('similarity', similarity)
+                    if similarity >= self.threshold:
+                        hit = self._hit(self._ids[best], similarity)
+            s.set('cache_hit', hit is not None)
+        elapsed = time.perf_counter() - start
+        self.lookup_seconds += elapsed
+        if hit is not None:
+            self.hits += 1
+            self.saved_seconds += max(hit.pop('seconds') - elapsed, 0.0)
+        return hit
+
+    def _hit(self, row_id, similarity):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT query, answer, context, sources, seconds FROM answers WHERE id = ?", (row_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE answers SET last_hit = ?, hits = hits + 1 WHERE id = ?",
+                               (time.time(), row_id))
+        query, answer, context, sources, seconds = row
+        return {
+            'answer': zlib.decompress(answer).decode('utf-8'),
+            'context': zlib.decompress(context).decode('utf-8'),
+            'matched_query': query,
+            'similarity': round(similarity, 4),
+            'sources': sources.split(',') if sources else [],
+            'cached': True,
+            'seconds': seconds,
+        }
+
+    def put(self, query, answer, context, sources, seconds):
+        '''
+        保存一个答案。
+        sources (set): 答案用到的来源，决定有效期，见 ttl_for。
+        seconds (float): 完整流程的耗时，用于统计命中时节省的时间。
+        '''
+        if not answer:
+            return
+        vector = self._embed(query)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            now = time.time()
+            expires_at = now + ttl_for(sources)
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO answers (model, query, embedding, answer, context, sources, seconds, created_at, "
+                    "expires_at, last_hit, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                    (self.model_name, query, vector.astype('float32').tobytes(),
+                     zlib.compress(answer.encode('utf-8'), 6), zlib.compress((context or '').encode('utf-8'), 6),
+                     ','.join(sorted(sources)), seconds, now, expires_at, now),
+                )
+            self._ids.append(cursor.lastrowid)
+            self._expires = np.append(self._expires, expires_at)
+            self._matrix = vector[None, :] if self._matrix is None else np.vstack([self._matrix, vector])
+            if len(self._ids) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        '''删除过期的条目；仍超过上限时按最近命中时间淘汰，保留 90% 的容量，避免每次写入都淘汰。'''
+        keep = int(self.max_entries * 0.9)
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),))
+            self._conn.execute(
+                "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY last_hit DESC LIMIT ?)",
+                (keep,),
+            )
+        self._load()
+
+    def stats(self):
+        '''命中率、节省的时间和平均查找耗时。'''
+        return {
+            'entries': len(self._ids),
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+            'saved_seconds': round(self.saved_seconds, 3),
+            'avg_lookup_ms': self.lookup_seconds / self.lookups * 1000 if self.lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_unavailable = False
+_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    '''返回进程内共享的答案缓存；ANSWER_CACHE=0 或无法加载模型时返回None。'''
+    global _cache, _unavailable
+    if not ANSWER_CACHE or _unavailable:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            cache = AnswerCache()
+            try:
+                cache._ensure_encoder()
+            except (ImportError, OSError, ValueError) as e:
+                print(f"答案缓存不可用，已关闭: {type(e).__name__}: {e}")
+                cache.close()
+                _unavailable = True
+                return None
+            _cache = cache
+        return _cache
+
+
+def test():
+    '''用确定的词袋编码器验证：改写的查询命中、不相关的查询未命中、过期和淘汰。'''
+    import tempfile
+    from Bench.stub_embedder import HashEmbedder
+
+    embedder = HashEmbedder()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = AnswerCache(Path(tmp) / 'answers.sqlite', 'hash', embedder.encode, threshold=0.8, max_entries=10)
+        with collect_sources() as sources:
+            record_source('rag')
+            record_source('web')
+        assert sources == {'rag', 'web'} and ttl_for(sources) == SOURCE_TTL['web']
+        cache.put("What is Obama's life and achievements?", "答案", "上下文", sources, seconds=12.0)
+        hit = cache.lookup("what is obama's life and achievements")
+        assert hit is not None and hit['answer'] == "答案", hit
+        assert cache.lookup("latest news about Singapore") is None
+        # 重新打开后仍能命中
+        cache.close()
+        cache = AnswerCache(Path(tmp) / 'answers.sqlite', 'hash', embedder.encode, threshold=0.8, max_entries=10)
+        assert cache.lookup("What is Obama's life and achievements?") is not None
+        cache.put("expired question", "答案", "", {'rag'}, seconds=1.0)
+        cache._expires[-1] = time.time() - 1
+        assert cache.lookup("expired question") is None
+        for i in range(20):
+            cache.put(f"question number {i}", "答案", "", {'rag'}, seconds=1.0)
+        assert len(cache._ids) <= 10
+        print(cache.stats())
+        cache.close()
+    print("测试通过。")
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,156 @@
+# Usage: uv run batch.py queries.jsonl results.jsonl --concurrency 8
+# -*- coding: utf-8 -*-
+
+'''
+批量执行查询：从 JSONL 或 CSV 文件读取查询，在同一个 MCPApp 上下文中并发执行 main.py 的完整流程，
+所有查询复用同一组agent和MCP服务器连接。每完成一个查询就把结果追加写入输出文件，
+重新运行时跳过输出文件中已成功的查询，从中断处继续。
+
+输入格式:
+    JSONL: 每行一个对象，包含 query 字段，可选 id 字段；也可以每行直接是一个JSON字符串。
+    CSV:   表头包含 query 列，可选 id 列。
+    没有 id 时使用行号（从0开始）作为 id，因此续跑时输入文件的顺序不能改变。
+输出格式（JSONL）:
+    {"id", "query", "answer", "context", "fetch", "seconds"}，失败时为 {"id", "query", "error", "seconds"}；
+    命中答案缓存（answer_cache.py）的查询另有 "cached"、"similarity"、"matched_query" 和 "sources" 字段。
+'''
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from pathlib import Path
+
+from mcp_agent.workflows.llm.augmented_llm import RequestParams
+
+from answer_cache import get_answer_cache
+from main import answer_query, app, cached_answer, create_workflow
+
+DEFAULT_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# 每完成多少个查询打印一次进度
+PROGRESS_EVERY = 10
+
+
+def read_queries(path):
+    '''读取查询文件，返回 [(id, query), ...]。'''
+    path = Path(path)
+    queries = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.csv':
+            for i, row in enumerate(csv.DictReader(f)):
+                queries.append((str(row.get('id') or i), row['query']))
+        else:
+            for i, line in enumerate(line for line in f if line.strip()):
+                record = json.loads(line)
+                if isinstance(record, str):
+                    record = {'query': record}
+                queries.append((str(record.get('id', i)), record['query']))
+    return queries
+
+def completed_ids(output_path):
+    '''输出文件中已成功完成的查询id。最后一行可能因中断而不完整，直接忽略。'''
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'error' not in record:
+                done.add(str(record['id']))
+    return done
+
+
+async def run_batch(input_path, output_path, concurrency=DEFAULT_CONCURRENCY, limit=None):
+    '''
+    并发执行 input_path 中尚未完成的查询，结果追加写入 output_path。
+
+    参数:
+    concurrency (int): 同时执行的查询数量。
+    limit (int): 本次最多执行的查询数量，None 表示全部。
+    返回:
+    dict: 本次执行的查询数、失败数、耗时和每分钟查询数。
+    '''
+    queries = read_queries(input_path)
+    done = completed_ids(output_path)
+    pending = [(qid, query) for qid, query in queries if qid not in done]
+    if limit is not None:
+        pending = pending[:limit]
+    print(f"共 {len(queries)} 个查询，已完成 {len(done)} 个，本次执行 {len(pending)} 个，并发数 {concurrency}。")
+    if not pending:
+        return {'queries': 0, 'failed': 0, 'seconds': 0.0, 'queries_per_minute': 0.0}
+
+    # 查询之间共享agent，关闭对话历史，避免并发查询的消息混在一起
+    request_params = RequestParams(use_history=False)
+    queue = asyncio.Queue()
+    for item in pending:
+        queue.put_nowait(item)
+    counts = {'finished': 0, 'failed': 0}
+    # 各查询的URL去重和网页缓存统计之和（见 fetch_stage.py）
+    fetch_totals = {}
+    started = time.perf_counter()
+    cache = await asyncio.to_thread(get_answer_cache)
+
+    async with app.run() as mcp_agent_app:
+        logger = mcp_agent_app.logger
+        workflow = await create_workflow()
+
+        with open(output_path, 'a', encoding='utf-8') as out:
+            async def worker():
+                while not queue.empty():
+                    qid, query = queue.get_nowait()
+                    start = time.perf_counter()
+                    try:
+                        result = await cached_answer(query, cache)
+                        if result is None:
+                            result = await answer_query(query, workflow, logger, request_params, cache)
+                        record = {'id': qid, 'query': query, **result}
+                        for key, value in result.get('fetch', {}).items():
+                            fetch_totals[key] = fetch_totals.get(key, 0) + value
+                    except Exception as e:
+                        counts['failed'] += 1
+                        record = {'id': qid, 'query': query, 'error': f"{type(e).__name__}: {e}"}
+                    record['seconds'] = round(time.perf_counter() - start, 3)
+                    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    out.flush()
+                    counts['finished'] += 1
+                    if counts['finished'] % PROGRESS_EVERY == 0 or counts['finished'] == len(pending):
+                        elapsed = time.perf_counter() - started
+                        print(f"已完成 {counts['finished']}/{len(pending)}，失败 {counts['failed']}，"
+                              f"{counts['finished'] / elapsed * 60:.1f} 个查询/分钟")
+
+            await asyncio.gather(*(worker() for _ in range(min(concurrency, len(pending)))))
+
+    elapsed = time.perf_counter() - started
+    report = {
+        'queries': counts['finished'],
+        'failed': counts['failed'],
+        'seconds': round(elapsed, 3),
+        'queries_per_minute': counts['finished'] / elapsed * 60 if elapsed else 0.0,
+    }
+    print(f"批量执行完成：{report['queries']} 个查询，失败 {report['failed']} 个，"
+          f"耗时 {elapsed:.1f}s，{report['queries_per_minute']:.1f} 个查询/分钟。")
+    if fetch_totals:
+        report['fetch'] = fetch_totals
+        print(f"网页抓取：找到 {fetch_totals['urls_found']} 个URL，去掉重复 {fetch_totals['duplicates']} 个、"
+              f"超出预算 {fetch_totals['over_budget']} 个，缓存命中 {fetch_totals['cache_hits']} 次，"
+              f"实际抓取 {fetch_totals['fetches']} 次，节省约 {fetch_totals['saved_tokens']} 个 fetcher token。")
+    if cache is not None:
+        report['answer_cache'] = cache.stats()
+        print(f"答案缓存：命中率 {report['answer_cache']['hit_rate']:.1%}，"
+              f"节省 {report['answer_cache']['saved_seconds']:.1f}s，"
+              f"平均查找 {report['answer_cache']['avg_lookup_ms']:.1f} ms。")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量执行查询")
+    parser.add_argument('input', help="查询文件（.jsonl 或 .csv）")
+    parser.add_argument('output', help="结果文件（.jsonl），已存在时从中断处继续")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(run_batch(args.input, args.output, args.concurrency, args.limit))
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+'''
+搜索与抓取之间的URL处理阶段。ParallelLLM 把 rag_searcher 和 web_searcher 的结果拼接后交给 fetcher，
+同一个网页（http/https、末尾斜杠、跟踪参数不同）可能被抓取和摘要两次，之前查询抓过的网页也会重新抓取。
+
+这里在 fetcher 调用LLM之前:
+    1. 从拼接的结果中提取URL，规范化后去重，最多保留 FETCH_URL_BUDGET 个；
+    2. 在网页内容缓存（与 RAG/scraper.py 共用的 SQLite 文件，fetch 工具的结果保存在单独的表中）中查找未过期的内容，
+       命中的网页直接附在消息中，fetcher 只需摘要，不再调用 fetch 工具；
+    3. 只把未命中的URL交给 fetcher 抓取。抓取计划附在搜索结果的原文后面，标题、摘要和查询背景都保留。
+       fetch 工具的结果写入同一个缓存（见 main.py 的 call_tool）。
+每个查询的URL数量、缓存命中、实际抓取次数和节省的token数通过 collect_fetch_stats 统计，并记录在 span 中。
+
+环境变量:
+    FETCH_URL_BUDGET      每个查询最多交给 fetcher 的URL数，默认 6
+    FETCH_CACHE_FILE      网页内容缓存，默认 RAG/cache.sqlite（与知识库的网页抓取共用）
+    FETCH_CACHE_MAX_AGE   缓存内容的有效期（秒），默认 1 天；0 表示不使用缓存
+    FETCH_INLINE_CHARS    命中缓存的网页附在消息中的最大字符数，默认 3000
+'''
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+sys.path.append(str(Path(__file__).parent))
+from RAG.scraper import ContentCache
+from tracing import estimate_tokens, span
+
+FETCH_URL_BUDGET = int(os.getenv("FETCH_URL_BUDGET", "6"))
+FETCH_CACHE_FILE = Path(os.getenv("FETCH_CACHE_FILE", Path(__file__).parent / 'RAG' / 'cache.sqlite'))
+FETCH_CACHE_MAX_AGE = float(os.getenv("FETCH_CACHE_MAX_AGE", str(24 * 3600)))
+FETCH_INLINE_CHARS = int(os.getenv("FETCH_INLINE_CHARS", "3000"))
+# mcp-server-fetch 默认每次返回的最大字符数，用于估算命中缓存时少交给LLM的工具输出
+FETCH_MAX_LENGTH = 5000
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'`\]\[)(，。、；）]+')
+# 不影响网页内容的跟踪参数
+TRACKING_PARAMS = {'gclid', 'fbclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', 'igshid', 'spm', 'ref', 'ref_src'}
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+# mcp-server-fetch 输出的开头
+FETCH_HEADER = re.compile(r'^Contents of \S+:\n')
+
+
+# --- URL 规范化 ---
+
+def normalize_url(url):
+    '''
+    返回用于去重和缓存的规范形式: 统一为 https，小写主机名并去掉 www. 和默认端口，
+    去掉片段、跟踪参数和路径末尾的斜杠，查询参数按名称排序。
+    '''
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and str(parts.port) != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{parts.port}"
+    path = re.sub(r'/{2,}', '/', parts.path or '/')
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES))
+    return urlunsplit(('https', host, path, urlencode(query), ''))
+
+def extract_urls(text):
+    '''按出现顺序返回文本中的URL，去掉末尾的标点。'''
+    return [url.rstrip('.,;:!?') for url in URL_PATTERN.findall(text)]
+
+def plan_urls(urls, budget=FETCH_URL_BUDGET):
+    '''
+    规范化并去重，返回 (要处理的URL列表, 重复的数量, 超出预算的数量)。
+    同一网页出现多次时保留第一次出现的原始URL，若之后出现 https 版本则改用 https。
+    '''
+    chosen = {}
+    for url in urls:
+        key = normalize_url(url)
+        if key not in chosen:
+            chosen[key] = url
+        elif url.startswith('https://') and not chosen[key].startswith('https://'):
+            chosen[key] = url
+    duplicates = len(urls) - len(chosen)
+    selected = list(chosen.values())
+    return selected[:budget], duplicates, max(len(selected) - budget, 0)
+
+
+# --- 网页内容缓存 ---
+
+def strip_fetch_header(text):
+    return FETCH_HEADER.sub('', text, count=1)
+
+class FetchCache:
+    '''
+    fetch 工具结果的缓存，键为规范化的URL，多个进程可以共用同一个文件。
+    fetch 工具的输出（Markdown，带 "Contents of ..." 开头）保存在单独的 fetched 表中，不写入知识库抓取用的
+    pages 表（RAG/scraper.py 的 ContentCache），知识库建索引时不会读到 fetch 工具的输出；
+    查找时也会读取 pages 表中知识库抓取的正文。
+    '''
+    def __init__(self, path=FETCH_CACHE_FILE, max_age=FETCH_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.pages = ContentCache(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fetched (url TEXT PRIMARY KEY, fetched_at REAL, text BLOB)"
+            )
+
+    def get(self, url):
+        '''返回未过期的网页内容，没有时返回None。fetch 工具的结果优先，其次是知识库以原始URL保存的正文。'''
+        if self.max_age <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched_at, text FROM fetched WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+        if row is not None and now - row[0] < self.max_age:
+            return zlib.decompress(row[1]).decode('utf-8')
+        record = self.pages.get(url)
+        if record is not None and record['text'] and now - record['fetched_at'] < self.max_age:
+            return record['text']
+        return None
+
+    def put(self, url, text):
+        if self.max_age > 0 and text:
+            with self._lock, self._conn:
+                self._conn.execute("INSERT OR REPLACE INTO fetched VALUES (?, ?, ?)",
+                                   (normalize_url(url), time.time(), zlib.compress(text.encode('utf-8'), 6)))
+
+    def close(self):
+        self.pages.close()
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_fetch_cache():
+    '''返回进程内共享的缓存；FETCH_CACHE_MAX_AGE=0 时返回None。'''
+    global _cache
+    if FETCH_CACHE_MAX_AGE <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = FetchCache()
+        return _cache
+
+
+# --- 每个查询的统计 ---
+
+_stats: ContextVar["dict | None"] = ContextVar('fetch_stats', default=None)
+
+def new_stats():
+    return {'urls_found': 0, 'duplicates': 0, 'over_budget': 0, 'cache_hits': 0, 'fetches': 0,
+            'saved_fetches': 0, 'saved_tokens': 0}
+
+@contextmanager
+def collect_fetch_stats():
+    '''在 with 块中执行一个查询，结束后返回的字典包含该查询的URL和抓取统计。'''
+    stats = new_stats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
+
+def count(key, amount=1):
+    stats = _stats.get()
+    if stats is not None:
+        stats[key] += amount
+
+
+# --- 给 fetcher 的消息 ---
+
+def prepare_fetch_message(text, cache=None, budget=FETCH_URL_BUDGET, inline_chars=FETCH_INLINE_CHARS):
+    '''
+    在搜索agent的输出后面附上给 fetcher 的抓取计划，原文（标题、摘要和查询背景）保持不变。
+    返回 (消息, 需要抓取的URL列表)；没有任何URL时消息为None，调用方保持原消息不变。
+    '''
+    found = extract_urls(text)
+    if not found:
+        return None, []
+    urls, duplicates, over_budget = plan_urls(found, budget)
+    to_fetch, cached = [], []
+    with span('stage.fetch_plan') as s:
+        for url in urls:
+            content = cache.get(url) if cache is not None else None
+            if content is None:
+                to_fetch.append(url)
+            else:
+                cached.append((url, strip_fetch_header(content)))
+        # 命中缓存的网页不再经过 fetch 工具：少一轮工具调用，交给LLM的内容也从工具输出的长度缩短为摘录
+        saved_tokens = sum(max(estimate_tokens(content[:FETCH_MAX_LENGTH]) - estimate_tokens(content[:inline_chars]), 0)
+                           for _, content in cached)
+        stats = {'urls_found': len(found), 'duplicates': duplicates, 'over_budget': over_budget,
+                 'cache_hits': len(cached), 'saved_fetches': duplicates + len(cached), 'saved_tokens': saved_tokens}
+        for key, value in stats.items():
+            count(key, value)
+            s.set(f"fetch.{key}", value)
+
+    parts = [text.rstrip(), "---\n抓取计划：上文中的URL已经去重，只访问下面列出的URL，其他URL不需要访问。"]
+    if to_fetch:
+        parts.append("需要访问的URL列表:\n" + '\n'.join(to_fetch))
+    if cached:
+        parts.append("以下网页的内容已经获取，不需要再访问，请直接根据内容摘要，并与上面的URL按顺序统一编号:\n\n"
+                     + '\n\n'.join(f"URL: {url}\n内容:\n{content[:inline_chars]}" for url, content in cached))
+    return '\n\n'.join(parts), to_fetch
+
+def _content_text(content):
+    '''消息 content 中的文本：字符串，或文本片段列表拼接的结果；没有文本时返回None。'''
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        texts = [part.get('text', '') for part in content if isinstance(part, dict) and part.get('type') == 'text']
+        return '\n'.join(texts) if texts else None
+    return None
+
+def prepare_fetch_request(message, cache=None, budget=FETCH_URL_BUDGET, inline_chars=FETCH_INLINE_CHARS):
+    '''
+    对 fetcher 收到的消息执行 prepare_fetch_message。支持字符串、OpenAI 格式的单条消息（content 为字符串
+    或片段列表）和消息列表（改写最后一条用户消息）。返回改写后的消息，没有URL时原样返回；
+    无法识别的消息格式返回None，由调用方记录。
+    '''
+    if isinstance(message, str):
+        prepared, _ = prepare_fetch_message(message, cache, budget, inline_chars)
+        return message if prepared is None else prepared
+    if isinstance(message, list):
+        users = [i for i, m in enumerate(message) if isinstance(m, dict) and m.get('role') == 'user']
+        if not users:
+            return None
+        i = users[-1]
+        prepared = prepare_fetch_request(message[i], cache, budget, inline_chars)
+        return None if prepared is None else message[:i] + [prepared] + message[i + 1:]
+    if isinstance(message, dict):
+        content = message.get('content')
+        text = _content_text(content)
+        if text is None:
+            return None
+        prepared, _ = prepare_fetch_message(text, cache, budget, inline_chars)
+        if prepared is None:
+            return message
+        if isinstance(content, list):
+            # 文本片段合并为一个，图片等其他片段保持不变
+            prepared = [{'type': 'text', 'text': prepared}] + [
+                part for part in content if not (isinstance(part, dict) and part.get('type') == 'text')]
+        return {**message, 'content': prepared}
+    return None
@@ -2,57 +2,183 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import json
+import time
 
 from mcp_agent.app import MCPApp
 from mcp_agent.agents.agent import Agent
 from mcp_agent.workflows.llm.augmented_llm_openai import OpenAIAugmentedLLM
 from mcp_agent.workflows.parallel.parallel_llm import ParallelLLM
+from mcp.types import CallToolResult, TextContent
 
 from prompts import url_agent_instruction, summarizer_agent_instruction, web_search_agent_instruction, rag_search_agent_instruction
+from tracing import estimate_tokens, span
+from answer_cache import collect_sources, get_answer_cache, record_source
+from fetch_stage import collect_fetch_stats, count, get_fetch_cache, prepare_fetch_request
 
 app = MCPApp(name="web_info_search")
 
+# 各搜索agent对应的答案来源，决定缓存答案的有效期（见 answer_cache.py）
+AGENT_SOURCES = {'web_searcher': 'web', 'rag_searcher': 'rag'}
+
+class TracedOpenAIAugmentedLLM(OpenAIAugmentedLLM):
+    '''
+    在每次LLM调用和每次MCP工具调用外记录 span（见 tracing.py），span 名称分别为 llm.<agent名> 和 tool.<工具名>。
+    token 数按请求消息、指令和模型回复的文本估算。
+    '''
+    def _agent_name(self):
+        agent = getattr(self, 'agent', None)
+        return getattr(agent, 'name', None) or getattr(self, 'name', None) or 'llm'
+
+    async def generate(self, message, request_params=None):
+        agent = self._agent_name()
+        with span(f"llm.{agent}", agent=agent) as s:
+            responses = await super().generate(message, request_params)
+            if s.recording:
+                reply = ''.join(getattr(r, 'content', None) or '' for r in responses)
+                s.set('llm.messages', len(responses))
+                s.set('gen_ai.usage.input_tokens',
+                      estimate_tokens(str(message)) + estimate_tokens(getattr(self, 'instruction', None) or ''))
+                s.set('gen_ai.usage.output_tokens', estimate_tokens(reply))
+            return responses
+
+    async def call_tool(self, request, tool_call_id=None):
+        tool = request.params.name
+        record_source(AGENT_SOURCES.get(self._agent_name()))
+        with span(f"tool.{tool}", tool=tool, agent=self._agent_name()) as s:
+            if s.recording:
+                s.set('payload.request_bytes',
+                      len(json.dumps(request.params.arguments or {}, ensure_ascii=False).encode('utf-8')))
+            result = await super().call_tool(request, tool_call_id)
+            if s.recording:
+                text = ''.join(getattr(c, 'text', '') for c in result.content)
+                s.set('payload.response_bytes', len(text.encode('utf-8')))
+                s.set('tool.response_tokens', estimate_tokens(text))
+                s.set('tool.is_error', bool(result.isError))
+            return result
+
+class FetcherLLM(TracedOpenAIAugmentedLLM):
+    '''
+    fetcher 使用的LLM。调用LLM之前先经过 fetch_stage.py 的URL处理阶段：规范化、去重、按预算截断，
+    抓取计划和已缓存的网页内容附在原消息后面。fetch 工具的结果写入网页内容缓存，缓存命中时不再调用工具。
+    '''
+    async def generate(self, message, request_params=None):
+        prepared = await asyncio.to_thread(prepare_fetch_request, message, get_fetch_cache())
+        if prepared is None:
+            print(f"fetcher 收到无法识别的消息格式（{type(message).__name__}），跳过URL处理阶段。")
+        else:
+            message = prepared
+        return await super().generate(message, request_params)
+
+    async def call_tool(self, request, tool_call_id=None):
+        arguments = request.params.arguments or {}
+        url = arguments.get('url')
+        # 只缓存从头开始的文本内容，分段读取和原始HTML直接调用工具
+        cacheable = bool(url) and request.params.name.endswith('fetch') \
+            and not arguments.get('raw') and not arguments.get('start_index')
+        cache = get_fetch_cache() if cacheable else None
+        if cache is not None:
+            text = await asyncio.to_thread(cache.get, url)
+            if text is not None:
+                count('cache_hits')
+                count('saved_fetches')
+                return CallToolResult(content=[TextContent(type='text', text=text)], isError=False)
+        result = await super().call_tool(request, tool_call_id)
+        if url:
+            count('fetches')
+        if cache is not None and not result.isError:
+            text = ''.join(getattr(c, 'text', '') for c in result.content)
+            await asyncio.to_thread(cache.put, url, text)
+        return result
+
+def llm_factory(agent):
+    '''fetcher 使用 FetcherLLM，其他agent使用 TracedOpenAIAugmentedLLM。'''
+    if agent.name == 'fetcher':
+        return FetcherLLM(agent=agent)
+    return TracedOpenAIAugmentedLLM(agent=agent)
+
+async def create_workflow():
+    '''
+    创建四个agent和工作流，返回 (parallel, summarizer_llm)。需在 app.run() 的上下文中调用。
+    返回的对象可以被多个查询复用，各agent的MCP服务器连接也随之复用；
+    并发执行多个查询时，调用方需传入 use_history=False 的 RequestParams，避免查询之间共享对话历史。
+    '''
+    # 创建需要的agent
+    web_searcher_agent = Agent(
+        name="web_searcher",
+        instruction=web_search_agent_instruction,
+        server_names=["webSearch"],  # 声明 agent 可以使用的 mcp server
+    )
+    rag_searcher_agent = Agent(
+        name="rag_searcher",
+        instruction=rag_search_agent_instruction,
+        server_names=["ragSearch"],  # 声明 agent 可以使用的 mcp server
+    )
+    fetcher_agent = Agent(
+        name="fetcher",
+        instruction=url_agent_instruction,
+        server_names=["fetch"],  # 声明 agent 可以使用的 mcp server
+    )
+    summarizer_agent = Agent(
+        name="summarizer",
+        instruction=summarizer_agent_instruction,
+    )
+    parallel = ParallelLLM(
+        fan_in_agent=fetcher_agent,
+        fan_out_agents=[rag_searcher_agent, web_searcher_agent],
+        llm_factory=llm_factory,
+    )
+    summarizer_llm = await summarizer_agent.attach_llm(TracedOpenAIAugmentedLLM)
+    return parallel, summarizer_llm
+
+async def answer_query(query: str, workflow, logger, request_params=None, cache=None):
+    '''
+    对一个查询执行完整流程：RAG与联网搜索并行找url，获取网页信息，最后总结。
+    返回 {'context': 获取到的相关内容, 'answer': 最终结果, 'fetch': URL去重和网页缓存的统计（见 fetch_stage.py）}。
+    传入 cache（见 answer_cache.py）时把结果连同用到的来源写入答案缓存。
+    '''
+    parallel, summarizer_llm = workflow
+    start = time.perf_counter()
+    with span("query", query=query), collect_sources() as sources, collect_fetch_stats() as fetch_stats:
+        # 工作流
+        with span("stage.search_and_fetch"):
+            context_res = await parallel.generate_str(
+                message=f"根据用户查询【{query}】寻找合适的url，然后获取信息。",
+                request_params=request_params,
+            )
+        logger.info(f"获取到的相关内容: \n{context_res}")
+        with span("stage.summarize"):
+            final_result = await summarizer_llm.generate_str(
+                message=f"请根据用户的问题【{query}】，从以下内容中总结出合适的回答: {context_res}",
+                request_params=request_params,
+            )
+        logger.info(f"最终结果: \n{final_result}")
+    if cache is not None:
+        await asyncio.to_thread(cache.put, query, final_result, context_res, sources, time.perf_counter() - start)
+    return {'context': context_res, 'answer': final_result, 'fetch': fetch_stats}
+
+async def cached_answer(query: str, cache):
+    '''在答案缓存中查找相似的查询，命中时返回缓存的结果，否则返回None。'''
+    if cache is None:
+        return None
+    hit = await asyncio.to_thread(cache.lookup, query)
+    if hit is not None:
+        print(f"答案缓存命中（相似度 {hit['similarity']:.3f}，原查询: {hit['matched_query']}）")
+    return hit
+
 async def main(query: str):
     # TODO: 将初始化RAG挪到main中
+    # 先查答案缓存，命中时不启动MCP服务器和agent
+    cache = await asyncio.to_thread(get_answer_cache)
+    hit = await cached_answer(query, cache)
+    if hit is not None:
+        print(f"最终结果: \n{hit['answer']}")
+        return hit
     # 调用agent
     async with app.run() as mcp_agent_app:
         logger = mcp_agent_app.logger
-
-        # 创建需要的agent
-        web_searcher_agent = Agent(
-            name="web_searcher",
-            instruction=web_search_agent_instruction,
-            server_names=["webSearch"],  # 声明 agent 可以使用的 mcp server
-        )
-        rag_searcher_agent = Agent(
-            name="rag_searcher",
-            instruction=rag_search_agent_instruction,
-            server_names=["ragSearch"],  # 声明 agent 可以使用的 mcp server
-        )
-        fetcher_agent = Agent(
-            name="fetcher",
-            instruction=url_agent_instruction,
-            server_names=["fetch"],  # 声明 agent 可以使用的 mcp server
-        )
-        summarizer_agent = Agent(
-            name="summarizer",
-            instruction=summarizer_agent_instruction,
-        )
-        parallel = ParallelLLM(
-            fan_in_agent=fetcher_agent,
-            fan_out_agents=[rag_searcher_agent, web_searcher_agent],
-            llm_factory=OpenAIAugmentedLLM,
-        )
-        # 工作流
-        context_res = await parallel.generate_str(
-            message=f"根据用户查询【{query}】寻找合适的url，然后获取信息。",
-        )
-        logger.info(f"获取到的相关内容: \n{context_res}")
-        summarizer_llm = await summarizer_agent.attach_llm(OpenAIAugmentedLLM)
-        final_result = await summarizer_llm.generate_str(
-            message=f"请根据用户的问题【{query}】，从以下内容中总结出合适的回答: {context_res}"
-        )
-        logger.info(f"最终结果: \n{final_result}")
+        workflow = await create_workflow()
+        return await answer_query(query, workflow, logger, cache=cache)
 
 if __name__ == "__main__":
     query = "What is Obama's life and achievements?"
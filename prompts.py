@@ -71,7 +71,7 @@ web_search_agent_instruction = """
 你的唯一职责是响应用户的提问，使用一个名为 `websearch` 的工具来查找最相关的网页链接，并返回一个纯粹的URL列表。
 
 # 可用工具
-* `websearch(query: str)`: 这是你唯一可以使用的工具,它基于 Brave Search API 构建
+* `websearch(query: str)`: 这是你唯一可以使用的工具,它基于 Brave Search API 构建。只需要链接时传入 `output="urls"`，工具将只返回URL列表，每行一个。
 
 # 工作流程
 1.  **分析提问**: 仔细阅读用户的原始提问，准确理解其背后的意图和信息需求的核心。
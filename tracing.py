@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+'''
+轻量的链路追踪。span 的字段与 OpenTelemetry 的 JSON 导出格式对应
+（trace_id、span_id、parent_span_id、开始/结束时间（纳秒）、attributes、status），
+每个 span 结束时作为一行JSON追加到 TRACE_FILE。未设置 TRACE_FILE 时不记录任何内容，开销可以忽略。
+MCP 服务器是独立进程，需要在 mcp_agent.config.yaml 的 env 中设置同一个 TRACE_FILE（绝对路径）。
+
+用法:
+    TRACE_FILE=trace.jsonl uv run batch.py queries.jsonl results.jsonl
+    python tracing.py trace.jsonl    # 按 span 名称输出 p50 / p95 报告
+'''
+from contextlib import contextmanager
+import contextvars
+import json
+import os
+import secrets
+import sys
+import time
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+SERVICE_NAME = os.path.basename(sys.argv[0]) or 'python'
+
+_current = contextvars.ContextVar('current_span', default=None)
+_fd = None
+
+
+class Span:
+    '''一个已开始的 span，attributes 中的值需可以序列化为JSON。'''
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_span_id', 'start', 'end', 'attributes', 'status')
+    recording = True
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = dict(attributes)
+        self.status = {'code': 'OK'}
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, amount):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'start_time_unix_nano': self.start,
+            'end_time_unix_nano': self.end,
+            'attributes': self.attributes,
+            'status': self.status,
+            'resource': {'service.name': SERVICE_NAME, 'process.pid': os.getpid()},
+        }
+
+
+class _NoopSpan:
+    recording = False
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled():
+    return bool(TRACE_FILE)
+
+@contextmanager
+def span(name, **attributes):
+    '''
+    记录一个 span，可以嵌套；在协程中使用时，子任务会继承当前 span 作为父 span。
+    with span('rag.faiss_search', top_k=3) as s:
+        s.set('nq', 8)
+    '''
+    if not TRACE_FILE:
+        yield NOOP_SPAN
+        return
+    s = Span(name, _current.get(), attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = {'code': 'ERROR', 'message': f"{type(e).__name__}: {e}"}
+        raise
+    finally:
+        _current.reset(token)
+        s.end = time.time_ns()
+        _export(s)
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+def detach():
+    '''让当前上下文之后的 span 不再挂在之前的 span 下，用于长期运行的后台任务。'''
+    _current.set(None)
+
+def _export(s):
+    # 以 O_APPEND 方式每次写入一整行，多个进程写同一个文件时各行不会交错
+    global _fd
+    if _fd is None:
+        _fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    os.write(_fd, (json.dumps(s.to_dict(), ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+_encoding = None
+
+def estimate_tokens(text):
+    '''
+    估算文本的token数：安装了 tiktoken 时使用 cl100k_base 编码计数，
+    否则按中日韩字符每字约1个token、其他字符每4个约1个token估算。
+    '''
+    global _encoding
+    if not text:
+        return 0
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    cjk = sum(1 for ch in text if '　' <= ch <= '鿿' or '가' <= ch <= '힯')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# --- 报告 ---
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+def load_spans(path):
+    spans = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+def summarize(spans):
+    '''
+    按 span 名称汇总：次数、错误数、耗时的 p50 / p95 / 平均值（毫秒），
+    名称以 tokens / bytes 结尾的数值属性的合计，以及 cache_hit 属性的命中率。
+    '''
+    groups = {}
+    for s in spans:
+        groups.setdefault(s['name'], []).append(s)
+    summary = {}
+    for name, items in groups.items():
+        durations = sorted((s['end_time_unix_nano'] - s['start_time_unix_nano']) / 1e6 for s in items)
+        stats = {
+            'count': len(items),
+            'errors': sum(1 for s in items if s.get('status', {}).get('code') == 'ERROR'),
+            'p50_ms': percentile(durations, 0.5),
+            'p95_ms': percentile(durations, 0.95),
+            'mean_ms': sum(durations) / len(durations),
+        }
+        totals = {}
+        hits = []
+        for s in items:
+            for key, value in s.get('attributes', {}).items():
+                if key.endswith(('tokens', 'bytes')) and isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+                elif key.endswith('cache_hit') and isinstance(value, bool):
+                    hits.append(value)
+        stats.update(totals)
+        if hits:
+            stats['cache_hit_rate'] = sum(hits) / len(hits)
+        summary[name] = stats
+    return summary
+
+def report(path):
+    '''打印 path 中各类 span 的耗时分布，按总耗时从高到低排序。'''
+    summary = summarize(load_spans(path))
+    print(f"{'span':<32}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}  其他")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]['mean_ms'] * item[1]['count']):
+        extra = {k: v for k, v in stats.items() if k not in ('count', 'errors', 'p50_ms', 'p95_ms', 'mean_ms')}
+        extra_text = ', '.join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in extra.items())
+        print(f"{name:<32}{stats['count']:>8}{stats['errors']:>8}{stats['p50_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['mean_ms']:>10.1f}  {extra_text}")
+    return summary
+
+if __name__ == '__main__':
+    report(sys.argv[1] if len(sys.argv) > 1 else (TRACE_FILE or 'trace.jsonl'))